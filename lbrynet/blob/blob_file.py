@@ -34,6 +34,8 @@ class BlobFile(object):
         self.blob_hash = blob_hash
         self.length = length
         self.writers = {}  # {Peer: writer, finished_deferred}
+        # the (write handle, hashsum) of the longest interrupted download, to be continued by the next writer
+        self._partial_download = None
         self._verified = False
         self.readers = 0
         self.blob_dir = blob_dir
@@ -49,11 +51,14 @@ class BlobFile(object):
             # this call.
             self._verified = True
 
-    def open_for_writing(self, peer):
+    def open_for_writing(self, peer, resume=False):
         """
         open a blob file to be written by peer, supports concurrent
         writers, as long as they are from differnt peers.
 
+        if resume is True and an earlier download of the blob was interrupted,
+        the writer continues from where that download stopped, at writer.offset
+
         returns tuple of (writer, finished_deferred)
 
         writer - a file like object with a write() function, close() when finished
@@ -63,7 +68,10 @@ class BlobFile(object):
         if not peer in self.writers:
             log.debug("Opening %s to be written by %s", str(self), str(peer))
             finished_deferred = defer.Deferred()
-            writer = HashBlobWriter(self.get_length, self.writer_finished)
+            partial_download = None
+            if resume:
+                partial_download, self._partial_download = self._partial_download, None
+            writer = HashBlobWriter(self.get_length, self.writer_finished, partial_download)
             self.writers[peer] = (writer, finished_deferred)
             return (writer, finished_deferred)
         log.warning("Tried to download the same file twice simultaneously from the same peer")
@@ -93,6 +101,7 @@ class BlobFile(object):
         if not self.writers and not self.readers:
             self._verified = False
             self.saved_verified_blob = False
+            self._partial_download = None
 
             def delete_from_file_system():
                 if os.path.isfile(self.file_path):
@@ -166,9 +175,18 @@ class BlobFile(object):
                     finished_deferred.errback(err)
 
         def cancel_other_downloads():
+            self._partial_download = None
             for p, (w, finished_deferred) in self.writers.items():
                 w.close()
 
+        def keep_partial_download():
+            # data that was cut off can be continued by the next writer, bad data can't
+            if self._verified or err.check(InvalidDataError) or writer.write_handle is None:
+                return
+            if writer.len_so_far and writer.len_so_far > self._get_partial_download_length():
+                log.debug("Keeping the %i bytes of %s received so far", writer.len_so_far, self)
+                self._partial_download = writer.detach_partial_download()
+
         if err is None:
             if writer.len_so_far == self.length and writer.blob_hash == self.blob_hash:
                 if self._verified is False:
@@ -186,11 +204,17 @@ class BlobFile(object):
                 errback_finished_deferred(Failure(InvalidDataError(err_string)))
                 d = defer.succeed(None)
         else:
+            keep_partial_download()
             errback_finished_deferred(err)
             d = defer.succeed(None)
         d.addBoth(lambda _: writer.close_handle())
         return d
 
+    def _get_partial_download_length(self):
+        if self._partial_download is None:
+            return 0
+        return self._partial_download[0].tell()
+
     def save_verified_blob(self, writer):
         # we cannot have multiple _save_verified_blob interrupting
         # each other, can happen since startProducing is a deferred
@@ -6,7 +6,7 @@ log = logging.getLogger(__name__)
 class HashBlobReader(object):
     """
     This is a file like reader class that supports
-    read(size) and close()
+    read(size), seek(offset) and close()
     """
     def __init__(self, read_handle, finished_cb):
         self.finished_cb = finished_cb
@@ -22,6 +22,9 @@ class HashBlobReader(object):
     def read(self, size=-1):
         return self.read_handle.read(size)
 
+    def seek(self, offset):
+        self.read_handle.seek(offset)
+
     def close(self):
         # if we've already closed and called finished_cb, do nothing
         if self.finished_cb_d is not None:
@@ -8,13 +8,23 @@ log = logging.getLogger(__name__)
 
 
 class HashBlobWriter(object):
-    def __init__(self, length_getter, finished_cb):
+    def __init__(self, length_getter, finished_cb, partial_download=None):
+        """
+        @param partial_download: the (write handle, hashsum) of an interrupted download of the blob, as returned
+            by detach_partial_download, to continue writing from where it stopped
+        """
         self.write_handle = BytesIO()
         self.length_getter = length_getter
         self.finished_cb = finished_cb
         self.finished_cb_d = None
         self._hashsum = get_lbry_hash_obj()
         self.len_so_far = 0
+        if partial_download is not None:
+            self.write_handle, self._hashsum = partial_download
+            self.write_handle.seek(0, 2)
+            self.len_so_far = self.write_handle.tell()
+        # the offset into the blob of the first byte to be written
+        self.offset = self.len_so_far
 
     def __del__(self):
         if self.finished_cb_d is None:
@@ -43,6 +53,17 @@ class HashBlobWriter(object):
             if self.len_so_far == self.length_getter():
                 self.finished_cb_d = self.finished_cb(self)
 
+    def detach_partial_download(self):
+        """
+        Take the data written so far and the hashing state of it, so that another writer can continue the
+        download. The writer can't be written to afterwards.
+
+        @return: (write handle, hashsum)
+        """
+        partial_download = (self.write_handle, self._hashsum)
+        self.write_handle = None
+        return partial_download
+
     def close_handle(self):
         if self.write_handle is not None:
             self.write_handle.close()
@@ -266,6 +266,7 @@ ADJUSTABLE_SETTINGS = {
     'data_rate': (float, .0001),  # points/megabyte
     'delete_blobs_on_remove': (bool, True),
     'dht_node_port': (int, 4444),
+    'dht_metrics': (bool, False),  # count rpcs, round trip times and lookups of the dht node, see dht_stats
     'download_directory': (str, default_download_dir),
     'download_timeout': (int, 180),
     'download_mirrors': (list, ['blobs.lbry.io']),
@@ -275,6 +276,12 @@ ADJUSTABLE_SETTINGS = {
     'known_dht_nodes': (list, DEFAULT_DHT_NODES, server_list, server_list_reverse),
     'lbryum_wallet_dir': (str, default_lbryum_dir),
     'max_connections_per_stream': (int, 5),
+    'max_peer_connections': (int, 50),  # connections to peers shared by all the streams being downloaded
+    'peer_connection_idle_timeout': (int, 30),  # seconds a connection no stream has a request for is kept open
+    'max_upload_slots': (int, 8),  # blobs uploaded at once, requests for more wait for a slot
+    'max_queued_uploads': (int, 32),  # requests waiting for an upload slot, clients are told to retry after that
+    'max_download_rate': (int, 0),  # bytes per second downloaded from peers, 0 for no limit
+    'max_upload_rate': (int, 0),  # bytes per second uploaded to peers, 0 for no limit
     'seek_head_blob_first': (bool, True),
     # TODO: writing json on the cmd line is a pain, come up with a nicer
     # parser for this data structure. maybe 'USD:25'
@@ -110,6 +110,12 @@ class InvalidStreamInfoError(Exception):
         self.stream_info = stream_info
 
 
+class UploadSlotsBusyError(Exception):
+    def __init__(self, retry_in):
+        Exception.__init__(self, "All upload slots are busy, retry in %i seconds" % retry_in)
+        self.retry_in = retry_in
+
+
 class MisbehavingPeerError(Exception):
     pass
 
@@ -1,14 +1,113 @@
-from random import choice
+import random
 import logging
+from collections import deque
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from twisted.web.client import HTTPConnectionPool
 import treq
 
+from lbrynet.blob.blob_file import MAX_BLOB_SIZE
+from lbrynet.core import utils
 from lbrynet.core.Error import DownloadCanceledError
 
 log = logging.getLogger(__name__)
 
 
+class Mirror(object):
+    """
+    A download mirror and how fast it has been, shared by all downloads from it. Mirrors are chosen by the time they
+    are expected to take to send a blob, like peers are.
+    """
+
+    # assumed of mirrors that haven't been downloaded from, so that they are tried
+    DEFAULT_THROUGHPUT = 1024 * 1024  # bytes per second
+    DEFAULT_TIME_TO_FIRST_BYTE = 0.5  # seconds
+    # the weight of a new measurement in the moving averages of throughput and time to first byte
+    MEASUREMENT_WEIGHT = 0.25
+    MAX_FAILURE_RATE = 0.95
+
+    def __init__(self, server):
+        self.server = server
+        self.throughput = None  # moving average of the blob download speed, in bytes per second
+        self.time_to_first_byte = None  # moving average of the seconds from a blob request to its response
+        self.blob_downloads = 0
+        self.failures = 0
+
+    def report_blob_download(self, num_bytes, seconds, time_to_first_byte):
+        throughput = num_bytes / max(seconds, 0.001)
+        self.throughput = self._average(self.throughput, throughput)
+        self.time_to_first_byte = self._average(self.time_to_first_byte, time_to_first_byte)
+        self.blob_downloads += 1
+
+    def report_failure(self):
+        self.failures += 1
+
+    def _average(self, average, measurement):
+        if average is None:
+            return measurement
+        return average + self.MEASUREMENT_WEIGHT * (measurement - average)
+
+    @property
+    def failure_rate(self):
+        return float(self.failures) / (self.blob_downloads + self.failures + 1)
+
+    def expected_download_time(self, num_bytes):
+        """The expected seconds to download num_bytes from the mirror, including retrying after failures"""
+        throughput = self.throughput or self.DEFAULT_THROUGHPUT
+        time_to_first_byte = self.time_to_first_byte
+        if time_to_first_byte is None:
+            time_to_first_byte = self.DEFAULT_TIME_TO_FIRST_BYTE
+        seconds = time_to_first_byte + float(num_bytes) / throughput
+        return seconds / (1.0 - min(self.failure_rate, self.MAX_FAILURE_RATE))
+
+    def __str__(self):
+        return 'mirror %s' % self.server
+
+    def __repr__(self):
+        return 'Mirror({!r})'.format(self.server)
+
+
+class PooledHTTPClient(object):
+    """treq's get and collect, over persistent connections kept open between the blobs downloaded from a mirror"""
+
+    MAX_CONNECTIONS_PER_MIRROR = 8
+    IDLE_TIMEOUT = 30  # seconds an idle connection to a mirror is kept open
+
+    def __init__(self):
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.MAX_CONNECTIONS_PER_MIRROR
+        self.pool.cachedConnectionTimeout = self.IDLE_TIMEOUT
+
+    def get(self, url):
+        return treq.get(url, pool=self.pool)
+
+    def collect(self, response, collector):
+        return treq.collect(response, collector)
+
+    def content(self, response):
+        return treq.content(response)
+
+
+_mirrors = {}
+_shared_client = None
+
+
+def get_mirror(server):
+    """The Mirror of a server, shared by all downloads from it"""
+    if server not in _mirrors:
+        _mirrors[server] = Mirror(server)
+    return _mirrors[server]
+
+
+def get_shared_http_client():
+    """The client of all downloads from mirrors, sharing its connections to each mirror"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = PooledHTTPClient()
+    return _shared_client
+
+
 class HTTPBlobDownloader(object):
     '''
     A downloader that is able to get blobs from HTTP mirrors.
@@ -16,19 +115,43 @@ class HTTPBlobDownloader(object):
     and cause any other type of downloader to progress to the next missing blob. Also, BlobFile is naturally able
     to cancel other writers when a writer finishes first. That's why there is no call to cancel/resume/stop between
     different types of downloaders.
+
+    Each blob is requested from a mirror chosen at random, weighted by how fast the mirrors have been. If the
+    download takes much longer than the mirror was expected to take, the blob is also requested from another
+    mirror, and the first to finish wins. The number of blobs downloaded at once starts at INITIAL_CONCURRENCY and
+    is adjusted every round of that many blobs, towards the fewest that give the most throughput, and halved when
+    a download fails. A mirror not having a blob isn't a failure.
     '''
+
+    INITIAL_CONCURRENCY = 2
+    MIN_CONCURRENCY = 1
+    MAX_CONCURRENCY = PooledHTTPClient.MAX_CONNECTIONS_PER_MIRROR
+    THROUGHPUT_CHANGE = 0.1  # throughput changes smaller than this fraction are taken as no change
+    HEDGE_FACTOR = 2.0  # a download taking this many times longer than expected is hedged
+    MIN_HEDGE_DELAY = 1.0  # seconds
+
     def __init__(self, blob_manager, blob_hashes=None, servers=None, client=None, sd_hashes=None):
         self.blob_manager = blob_manager
         self.servers = servers or []
-        self.client = client or treq
+        self.client = client or get_shared_http_client()
         self.blob_hashes = blob_hashes or []
         self.sd_hashes = sd_hashes or []
         self.head_blob_hashes = []
         self.max_failures = 3
         self.running = False
-        self.semaphore = defer.DeferredSemaphore(2)
+        self.concurrency = self.INITIAL_CONCURRENCY
         self.deferreds = []
         self.writers = []
+        self._hedge_calls = []
+        self._queue = deque()  # [(blob, Deferred)] of the blobs waiting to be downloaded
+        self._num_downloading = 0
+        self._missing = {}  # {blob_hash: set(Mirror)} of the mirrors that don't have a blob
+        # the throughput of the last round of downloads, and the change in concurrency made after it
+        self._round_started = None
+        self._round_bytes = 0
+        self._round_blobs = 0
+        self._last_throughput = None
+        self._concurrency_step = 1
 
     def start(self):
         if not self.running and self.blob_hashes and self.servers:
@@ -37,6 +160,9 @@ class HTTPBlobDownloader(object):
 
     def stop(self):
         if self.running:
+            for call in self._hedge_calls:
+                call.cancel()
+            self._hedge_calls = []
             for d in reversed(self.deferreds):
                 d.cancel()
             for writer in self.writers:
@@ -51,57 +177,214 @@ class HTTPBlobDownloader(object):
         for blob_hash in self.blob_hashes:
             blob = yield self.blob_manager.get_blob(blob_hash)
             if not blob.verified:
-                d = self.semaphore.run(self.download_blob, blob)
+                d = self._queue_download(blob)
                 d.addErrback(lambda err: err.check(defer.TimeoutError, defer.CancelledError))
                 dl.append(d)
         self.deferreds = dl
         yield defer.DeferredList(dl)
 
+    def _queue_download(self, blob):
+        def cancel(d):
+            if (blob, d) in self._queue:
+                self._queue.remove((blob, d))
+
+        d = defer.Deferred(cancel)
+        self._queue.append((blob, d))
+        self._download_queued()
+        return d
+
+    def _download_queued(self):
+        while self._queue and self._num_downloading < self.concurrency:
+            blob, d = self._queue.popleft()
+            self._num_downloading += 1
+            self.download_blob(blob).addBoth(self._download_finished, d)
+
+    def _download_finished(self, result, d):
+        self._num_downloading -= 1
+        if not d.called:  # it was cancelled while downloading
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        self._download_queued()
+
     @defer.inlineCallbacks
     def download_blob(self, blob):
         for _ in range(self.max_failures):
-            writer, finished_deferred = blob.open_for_writing('mirror')
-            self.writers.append(writer)
-            try:
-                downloaded = yield self._write_blob(writer, blob)
-                if downloaded:
-                    yield finished_deferred  # yield for verification errors, so we log them
-                    if blob.verified:
-                        log.info('Mirror completed download for %s', blob.blob_hash)
-                        b_h = blob.blob_hash
-                        if b_h in self.sd_hashes or b_h in self.head_blob_hashes:
-                            should_announce = True
-                        else:
-                            should_announce = False
-                        yield self.blob_manager.blob_completed(blob, should_announce=should_announce)
+            downloaded = yield self._download_hedged(blob)
+            if downloaded or not self.running or self._choose_mirror(blob) is None:
                 break
-            except (IOError, Exception) as e:
-                if isinstance(e, DownloadCanceledError) or 'closed file' in str(e):
-                    # some other downloader finished first or it was simply cancelled
-                    log.info("Mirror download cancelled: %s", blob.blob_hash)
-                    break
-                else:
-                    log.exception('Mirror failed downloading')
-            finally:
-                finished_deferred.addBoth(lambda _: None)  # suppress echoed errors
-                if 'mirror' in blob.writers:
-                    writer.close()
-                self.writers.remove(writer)
-
-    @defer.inlineCallbacks
-    def _write_blob(self, writer, blob):
-        response = yield self.client.get(url_for(choice(self.servers), blob.blob_hash))
-        if response.code != 200:
+            if downloaded is False:
+                self._set_concurrency(self.concurrency // 2)
+        if blob.blob_hash in self._missing and len(self._missing[blob.blob_hash]) == len(self.servers):
             log.debug('Missing a blob: %s', blob.blob_hash)
             if blob.blob_hash in self.blob_hashes:
                 self.blob_hashes.remove(blob.blob_hash)
-            defer.returnValue(False)
+        self._missing.pop(blob.blob_hash, None)
+
+    def _download_hedged(self, blob):
+        """
+        Download a blob from the best mirror, and from another one too if the first is slow
+
+        @return: Deferred firing with True when the blob has been downloaded, or the download was cancelled, with
+            False if a mirror it was requested from failed, or with None if they don't have it
+        """
+        finished = defer.Deferred()
+        downloads = []
+        failed = []
+        hedge_call = []
+
+        def start_download(exclude):
+            mirror = self._choose_mirror(blob, exclude)
+            if mirror is None:
+                return None
+            d = self._download_from_mirror(blob, mirror)
+            downloads.append((mirror, d))
+            d.addCallback(download_finished, d)
+            return mirror
+
+        def download_finished(downloaded, d):
+            downloads.remove([download for download in downloads if download[1] is d][0])
+            if downloaded is False:
+                failed.append(d)
+            if finished.called:
+                return
+            if downloaded:
+                stop_hedging()
+                finished.callback(True)
+            elif not downloads:
+                stop_hedging()
+                finished.callback(False if failed else None)
+
+        def hedge():
+            self._hedge_calls.remove(hedge_call.pop())
+            if self.running and not finished.called and start_download([m for m, _ in downloads]):
+                log.info("Downloading %s from a second mirror, %s is slow", blob.blob_hash[:16], first_mirror)
+
+        def stop_hedging():
+            if hedge_call:
+                call = hedge_call.pop()
+                self._hedge_calls.remove(call)
+                call.cancel()
+
+        first_mirror = start_download([])
+        if first_mirror is None:
+            return defer.succeed(None)
+        if not finished.called and self._choose_mirror(blob, [first_mirror]) is not None:
+            call = utils.call_later(self._hedge_delay(first_mirror, blob), hedge)
+            hedge_call.append(call)
+            self._hedge_calls.append(call)
+        return finished
+
+    def _hedge_delay(self, mirror, blob):
+        expected = mirror.expected_download_time(blob.length or MAX_BLOB_SIZE)
+        return max(self.HEDGE_FACTOR * expected, self.MIN_HEDGE_DELAY)
+
+    def _choose_mirror(self, blob, exclude=()):
+        """Choose a mirror at random, weighted by how quickly they are expected to send the blob"""
+        num_bytes = blob.length or MAX_BLOB_SIZE
+        missing = self._missing.get(blob.blob_hash, ())
+        candidates = [
+            mirror for mirror in (get_mirror(server) for server in self.servers)
+            if mirror not in exclude and mirror not in missing and mirror not in blob.writers
+        ]
+        if not candidates:
+            return None
+        weights = [1.0 / mirror.expected_download_time(num_bytes) for mirror in candidates]
+        choice = random.uniform(0, sum(weights))
+        for mirror, weight in zip(candidates, weights):
+            choice -= weight
+            if choice <= 0:
+                return mirror
+        return candidates[-1]
+
+    @defer.inlineCallbacks
+    def _download_from_mirror(self, blob, mirror):
+        """
+        @return: Deferred firing with True when the blob has been downloaded, or the download was cancelled, with
+            False if the download failed, or with None if the mirror doesn't have the blob
+        """
+        writer, finished_deferred = blob.open_for_writing(mirror)
+        if writer is None:
+            defer.returnValue(None)
+        self.writers.append(writer)
+        downloaded = False
+        try:
+            downloaded = yield self._write_blob(writer, blob, mirror)
+            if downloaded:
+                yield finished_deferred  # yield for verification errors, so we log them
+                if blob.verified:
+                    log.info('Mirror completed download for %s', blob.blob_hash)
+                    b_h = blob.blob_hash
+                    if b_h in self.sd_hashes or b_h in self.head_blob_hashes:
+                        should_announce = True
+                    else:
+                        should_announce = False
+                    yield self.blob_manager.blob_completed(blob, should_announce=should_announce)
+        except (IOError, Exception) as e:
+            if isinstance(e, DownloadCanceledError) or 'closed file' in str(e):
+                # some other downloader finished first or it was simply cancelled
+                log.info("Mirror download cancelled: %s", blob.blob_hash)
+                downloaded = True
+            else:
+                log.exception('Mirror failed downloading')
+                mirror.report_failure()
+                downloaded = False
+        finally:
+            finished_deferred.addBoth(lambda _: None)  # suppress echoed errors
+            if mirror in blob.writers:
+                writer.close()
+            self.writers.remove(writer)
+        defer.returnValue(downloaded)
+
+    @defer.inlineCallbacks
+    def _write_blob(self, writer, blob, mirror):
+        requested_at = utils.timestamp()
+        response = yield self.client.get(url_for(mirror.server, blob.blob_hash))
+        if response.code != 200:
+            log.debug('%s is missing a blob: %s', mirror, blob.blob_hash)
+            self._missing.setdefault(blob.blob_hash, set()).add(mirror)
+            # read the response so that the connection can be used for the next request
+            yield self.client.content(response)
+            defer.returnValue(None)
 
         log.debug('Download started: %s', blob.blob_hash)
         blob.set_length(response.length)
+        started_at = utils.timestamp()
         yield self.client.collect(response, writer.write)
+        seconds = utils.timestamp() - started_at
+        mirror.report_blob_download(response.length, seconds, started_at - requested_at)
+        self._report_downloaded(response.length, seconds)
         defer.returnValue(True)
 
+    def _report_downloaded(self, num_bytes, seconds):
+        if self._round_started is None:
+            self._round_started = utils.timestamp() - seconds
+        self._round_bytes += num_bytes
+        self._round_blobs += 1
+        if self._round_blobs < self.concurrency:
+            return
+        throughput = self._round_bytes / max(utils.timestamp() - self._round_started, 0.001)
+        last_throughput = self._last_throughput
+        if last_throughput is not None:
+            if throughput < last_throughput * (1 - self.THROUGHPUT_CHANGE):
+                # the last change made it worse
+                self._concurrency_step = -self._concurrency_step
+            elif throughput < last_throughput * (1 + self.THROUGHPUT_CHANGE):
+                # the last change made no difference, try using fewer connections
+                self._concurrency_step = -1
+        self._set_concurrency(self.concurrency + self._concurrency_step)
+        log.debug("Mirror downloads got %i bytes/sec, downloading %i blobs at once", throughput, self.concurrency)
+        self._last_throughput = throughput
+        self._round_started = utils.timestamp()
+        self._round_bytes = 0
+        self._round_blobs = 0
+
+    def _set_concurrency(self, concurrency):
+        # when lowered, the downloads over the new limit finish before more are started
+        self.concurrency = min(max(concurrency, self.MIN_CONCURRENCY), self.MAX_CONCURRENCY)
+        self._download_queued()
+
     @defer.inlineCallbacks
     def download_stream(self, stream_hash, sd_hash):
         blobs = yield self.blob_manager.storage.get_blobs_for_stream(stream_hash)
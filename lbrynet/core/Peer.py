@@ -1,9 +1,31 @@
+import random
 import datetime
 from collections import defaultdict
 from lbrynet.core import utils
 
+
+def rank_peers(peers, num_bytes=2 ** 21):
+    """
+    Sort peers by how fast they are expected to upload a blob, fastest first, in random order among peers that are
+    expected to be as fast as each other, such as those that haven't been downloaded from
+
+    @param num_bytes: the size of the blob
+    """
+    peers = list(peers)
+    random.shuffle(peers)
+    peers.sort(key=lambda peer: peer.expected_download_time(num_bytes))
+    return peers
+
+
 # Do not create this object except through PeerManager
 class Peer(object):
+    # assumed of peers that haven't been downloaded from, so that they are tried before known slow peers
+    DEFAULT_THROUGHPUT = 100 * 1024  # bytes per second
+    DEFAULT_TIME_TO_FIRST_BYTE = 1.0  # seconds
+    # the weight of a new measurement in the moving averages of throughput and time to first byte
+    MEASUREMENT_WEIGHT = 0.25
+    MAX_FAILURE_RATE = 0.95
+
     def __init__(self, host, port):
         self.host = host
         self.port = port
@@ -15,6 +37,13 @@ class Peer(object):
         self.success_count = 0
         self.score = 0
         self.stats = defaultdict(float)  # {string stat_type, float count}
+        # The reputation of the peer, saved by PeerManager
+        self.throughput = None  # moving average of the blob download speed, in bytes per second
+        self.time_to_first_byte = None  # moving average of the seconds from a blob request to its response
+        self.blob_downloads = 0  # blobs downloaded
+        self.failures = 0  # connections and requests that failed
+        self.last_seen = None  # timestamp of the last connection or download
+        self.reputation_changed = False
 
     def is_available(self):
         if self.attempt_connection_at is None or utils.today() > self.attempt_connection_at:
@@ -24,15 +53,65 @@ class Peer(object):
     def report_up(self):
         self.down_count = 0
         self.attempt_connection_at = None
+        self.last_seen = utils.timestamp()
+        self.reputation_changed = True
 
     def report_success(self):
         self.success_count += 1
 
     def report_down(self):
         self.down_count += 1
+        self.failures += 1
+        self.reputation_changed = True
         timeout_time = datetime.timedelta(seconds=60 * self.down_count)
         self.attempt_connection_at = utils.today() + timeout_time
 
+    def report_blob_download(self, num_bytes, seconds, time_to_first_byte):
+        """
+        Record the download of a blob
+
+        @param num_bytes: the size of the blob
+        @param seconds: the time from the first byte of the blob to the last
+        @param time_to_first_byte: the time from when the blob was requested to when the response arrived
+        """
+        throughput = num_bytes / max(seconds, 0.001)
+        self.throughput = self._average(self.throughput, throughput)
+        self.time_to_first_byte = self._average(self.time_to_first_byte, time_to_first_byte)
+        self.blob_downloads += 1
+        self.last_seen = utils.timestamp()
+        self.reputation_changed = True
+
+    def _average(self, average, measurement):
+        if average is None:
+            return measurement
+        return average + self.MEASUREMENT_WEIGHT * (measurement - average)
+
+    @property
+    def failure_rate(self):
+        return float(self.failures) / (self.blob_downloads + self.failures + 1)
+
+    def expected_download_time(self, num_bytes):
+        """
+        The expected seconds to download num_bytes from the peer, including retrying after failures
+        """
+        throughput = self.throughput or self.DEFAULT_THROUGHPUT
+        time_to_first_byte = self.time_to_first_byte
+        if time_to_first_byte is None:
+            time_to_first_byte = self.DEFAULT_TIME_TO_FIRST_BYTE
+        seconds = time_to_first_byte + float(num_bytes) / throughput
+        return seconds / (1.0 - min(self.failure_rate, self.MAX_FAILURE_RATE))
+
+    def get_reputation(self):
+        return (self.throughput, self.time_to_first_byte, self.blob_downloads, self.failures,
+                self.last_seen)
+
+    def set_reputation(self, throughput, time_to_first_byte, blob_downloads, failures, last_seen):
+        self.throughput = throughput
+        self.time_to_first_byte = time_to_first_byte
+        self.blob_downloads = blob_downloads
+        self.failures = failures
+        self.last_seen = last_seen
+
     def update_score(self, score_change):
         self.score += score_change
 
@@ -1,14 +1,65 @@
+import logging
+from twisted.internet import defer, task
+from lbrynet.core import utils
 from lbrynet.core.Peer import Peer
 
+log = logging.getLogger(__name__)
+
 
 class PeerManager(object):
-    def __init__(self):
-        self.peers = []
+    """
+    Creates the Peer for each host and port, and, given a storage, saves their reputations so that downloads after
+    a restart start on the fastest known peers
+    """
+
+    SAVE_REPUTATIONS_INTERVAL = 60
+    REPUTATION_MAX_AGE = 30 * 24 * 60 * 60  # reputations of peers not seen for this long are deleted
+
+    def __init__(self, storage=None):
+        self.peers = {}  # {(host, port): Peer}
+        self.storage = storage
+        self._saved_reputations = {}  # {(host, port): reputation} of peers there isn't a Peer for yet
+        self._save_reputations_lc = task.LoopingCall(self.save_reputations)
 
     def get_peer(self, host, port):
-        for peer in self.peers:
-            if peer.host == host and peer.port == port:
-                return peer
-        peer = Peer(host, port)
-        self.peers.append(peer)
+        peer = self.peers.get((host, port))
+        if peer is None:
+            peer = Peer(host, port)
+            reputation = self._saved_reputations.pop((host, port), None)
+            if reputation is not None:
+                peer.set_reputation(*reputation)
+            self.peers[(host, port)] = peer
         return peer
+
+    @defer.inlineCallbacks
+    def start(self):
+        if self.storage is None:
+            defer.returnValue(None)
+        reputations = yield self.storage.get_peer_reputations(utils.timestamp() - self.REPUTATION_MAX_AGE)
+        for host, port, throughput, time_to_first_byte, blob_downloads, failures, last_seen in reputations:
+            reputation = (throughput, time_to_first_byte, blob_downloads, failures, last_seen)
+            if (host, port) in self.peers:
+                self.peers[(host, port)].set_reputation(*reputation)
+            else:
+                self._saved_reputations[(host, port)] = reputation
+        log.info("Loaded the reputations of %i peers", len(reputations))
+        utils.safe_start_looping_call(self._save_reputations_lc, self.SAVE_REPUTATIONS_INTERVAL)
+
+    @defer.inlineCallbacks
+    def stop(self):
+        utils.safe_stop_looping_call(self._save_reputations_lc)
+        if self.storage is not None:
+            yield self.save_reputations()
+
+    def save_reputations(self):
+        changed = [peer for peer in self.peers.itervalues() if peer.reputation_changed]
+        if not changed:
+            return defer.succeed(None)
+        for peer in changed:
+            peer.reputation_changed = False
+        log.debug("Saving the reputations of %i peers", len(changed))
+        d = self.storage.save_peer_reputations(
+            [(peer.host, peer.port) + peer.get_reputation() for peer in changed]
+        )
+        d.addErrback(lambda err: log.warning("Failed to save peer reputations: %s", err.getErrorMessage()))
+        return d
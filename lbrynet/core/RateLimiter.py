@@ -2,11 +2,23 @@ import logging
 
 from zope.interface import implements
 from lbrynet.interfaces import IRateLimiter
+from lbrynet.core import utils
 from twisted.internet import task
 
 
 log = logging.getLogger(__name__)
 
+# priority classes of the groups of protocols sharing a rate limit, in the order they are served
+PRIORITY_STREAMING = 0  # a stream being watched
+PRIORITY_DOWNLOAD = 1  # a download in the background
+PRIORITY_UPLOAD = 2  # seeding
+# the share of a rate limit each group of a priority class is assured of when every group wants more
+PRIORITY_WEIGHTS = {
+    PRIORITY_STREAMING: 8,
+    PRIORITY_DOWNLOAD: 2,
+    PRIORITY_UPLOAD: 1,
+}
+
 
 class DummyRateLimiter(object):
     def __init__(self):
@@ -37,120 +49,314 @@ class DummyRateLimiter(object):
     def set_ul_limit(self, limit):
         pass
 
-    def report_dl_bytes(self, num_bytes):
+    def report_dl_bytes(self, num_bytes, protocol=None):
         self.dl_bytes_this_second += num_bytes
         self.total_dl_bytes += num_bytes
 
-    def report_ul_bytes(self, num_bytes):
+    def report_ul_bytes(self, num_bytes, protocol=None):
         self.ul_bytes_this_second += num_bytes
         self.total_ul_bytes += num_bytes
 
+    def register_protocol(self, protocol, group=None, priority=PRIORITY_DOWNLOAD):
+        pass
+
+    def unregister_protocol(self, protocol):
+        pass
+
+
+class TokenBucket(object):
+    """
+    Tokens, each allowing a byte to be transferred, accumulate at rate per second up to burst. Transfers take
+    tokens even when there aren't enough, putting the bucket in debt until it refills.
+    """
+
+    def __init__(self, rate, burst, max_debt=None):
+        """
+        @param max_debt: the most tokens the bucket can owe, or None for no limit
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_debt = max_debt
+        self.tokens = burst
+        self._updated = utils.timestamp()
+
+    def _refill(self):
+        now = utils.timestamp()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate, burst, max_debt=None):
+        self._refill()
+        self.rate = rate
+        self.burst = burst
+        self.max_debt = max_debt
+        self.tokens = min(self.tokens, burst)
+
+    def consume(self, num_bytes):
+        self._refill()
+        self.tokens -= num_bytes
+        if self.max_debt is not None:
+            self.tokens = max(self.tokens, -self.max_debt)
+
+    def in_debt(self):
+        self._refill()
+        return self.tokens < 0
+
+    def time_until_refilled(self):
+        """The seconds until the bucket is out of debt"""
+        self._refill()
+        if self.tokens >= 0:
+            return 0
+        # at least a millisecond, rounding can leave a tiny debt after waiting the time it takes to refill
+        return max(-self.tokens / self.rate, 0.001)
+
+
+class _LimitedDirection(object):
+    """
+    The token buckets of one direction of transfer, in a hierarchy of the global limit, groups of protocols (a
+    stream or an upload slot) and the protocols
+
+    Each group is assured a share of the global rate by the weight of its priority class, split evenly between its
+    protocols. While the global bucket has tokens any protocol can transfer as fast as it likes, borrowing the
+    unused shares of the others. Once it is in debt, protocols that have used up their own share, or whose group
+    has, are paused until they are back within it. Whenever the global bucket refills because the protocols within
+    their shares aren't using all of it, one of the paused protocols is resumed to borrow it, taking turns within the
+    highest priority class with paused protocols. If the global bucket owes more than it can hold, every
+    protocol is paused until it has refilled.
+    """
+
+    BURST_SECONDS = 0.25  # buckets hold this many seconds worth of their rate
+    MIN_BURST = 2 ** 14  # but at least this many bytes, more than most single reads or writes
+    LEND_INTERVAL = 0.01  # the least seconds between resuming paused protocols to borrow spare tokens
+
+    def __init__(self, name, throttle, unthrottle):
+        self.name = name
+        self._throttle = throttle
+        self._unthrottle = unthrottle
+        self.limit = None
+        self.total_bytes = 0
+        self._global_bucket = None
+        self._groups = {}  # {group: (priority, [protocol])}
+        self._protocol_groups = {}  # {protocol: group}
+        self._group_buckets = {}  # {group: TokenBucket}
+        self._protocol_buckets = {}  # {protocol: TokenBucket}
+        self._throttled = {}  # {protocol: DelayedCall to check if it can be resumed}
+        self._lend_call = None
+        self._lends = 0
+        self._last_lent = {}  # {protocol: the number of lends when it last borrowed}
+
+    def _burst(self, rate):
+        return max(rate * self.BURST_SECONDS, self.MIN_BURST)
+
+    def set_limit(self, limit):
+        if limit is not None and limit < 0:
+            raise ValueError("The %s limit can't be negative" % self.name)
+        limit = limit or None  # 0 is no limit
+        self.limit = limit
+        if limit is None:
+            self._global_bucket = None
+            self.unthrottle_all()
+        elif self._global_bucket is None:
+            self._global_bucket = TokenBucket(limit, self._burst(limit))
+        else:
+            self._global_bucket.set_rate(limit, self._burst(limit))
+        self._update_shares()
+
+    def register(self, protocol, group, priority):
+        self.unregister(protocol, unthrottle=False)
+        protocols = self._groups[group][1] if group in self._groups else []
+        protocols.append(protocol)
+        self._groups[group] = (priority, protocols)
+        self._protocol_groups[protocol] = group
+        self._update_shares()
+
+    def unregister(self, protocol, unthrottle=True):
+        group = self._protocol_groups.pop(protocol, None)
+        if group is None:
+            return
+        protocols = self._groups[group][1]
+        protocols.remove(protocol)
+        if not protocols:
+            del self._groups[group]
+            del self._group_buckets[group]
+        del self._protocol_buckets[protocol]
+        self._last_lent.pop(protocol, None)
+        if protocol in self._throttled:
+            self._resume(protocol, unthrottle)
+        self._update_shares()
+
+    def _update_shares(self):
+        limit = self.limit or 0
+        total_weight = sum(PRIORITY_WEIGHTS[priority] for priority, _ in self._groups.itervalues())
+        for group, (priority, protocols) in self._groups.iteritems():
+            group_rate = float(limit) * PRIORITY_WEIGHTS[priority] / total_weight
+            self._set_share(self._group_buckets, group, group_rate)
+            for protocol in protocols:
+                self._set_share(self._protocol_buckets, protocol, group_rate / len(protocols))
+
+    def _set_share(self, buckets, key, rate):
+        # shares can't go further into debt than they can hold, so that a protocol that borrowed while there was
+        # spare bandwidth isn't paused for long once there isn't
+        burst = self._burst(rate)
+        if key in buckets:
+            buckets[key].set_rate(rate, burst, burst)
+        else:
+            buckets[key] = TokenBucket(rate, burst, burst)
+
+    def report(self, num_bytes, protocol):
+        self.total_bytes += num_bytes
+        if self._global_bucket is None:
+            return
+        self._global_bucket.consume(num_bytes)
+        if protocol not in self._protocol_groups:
+            return
+        self._protocol_buckets[protocol].consume(num_bytes)
+        self._group_buckets[self._protocol_groups[protocol]].consume(num_bytes)
+        if protocol not in self._throttled:
+            wait = self._time_until_allowed(protocol)
+            if wait:
+                log.trace("Pausing the %s of %s for %f seconds", self.name, protocol, wait)
+                self._throttle(protocol)
+                self._throttled[protocol] = utils.call_later(wait, self._check_throttled, protocol)
+        self._schedule_lending()
+
+    def _time_until_allowed(self, protocol):
+        global_bucket = self._global_bucket
+        if global_bucket is None or not global_bucket.in_debt():
+            return 0
+        if global_bucket.tokens < -global_bucket.burst:
+            return global_bucket.time_until_refilled()
+        return max(self._protocol_buckets[protocol].time_until_refilled(),
+                   self._group_buckets[self._protocol_groups[protocol]].time_until_refilled())
+
+    def _check_throttled(self, protocol):
+        wait = self._time_until_allowed(protocol)
+        if wait:
+            self._throttled[protocol] = utils.call_later(wait, self._check_throttled, protocol)
+        else:
+            self._resume(protocol)
+
+    def _resume(self, protocol, unthrottle=True):
+        delayed_call = self._throttled.pop(protocol)
+        if delayed_call.active():
+            delayed_call.cancel()
+        if unthrottle:
+            self._unthrottle(protocol)
+
+    def _schedule_lending(self):
+        if self._throttled and self._lend_call is None:
+            wait = max(self._global_bucket.time_until_refilled(), self.LEND_INTERVAL)
+            self._lend_call = utils.call_later(wait, self._lend)
+
+    def _lend(self):
+        self._lend_call = None
+        if self._global_bucket is None or not self._throttled:
+            return
+        if not self._global_bucket.in_debt():
+            protocol = min(self._throttled, key=self._lending_order)
+            self._lends += 1
+            self._last_lent[protocol] = self._lends
+            self._resume(protocol)
+        self._schedule_lending()
+
+    def _lending_order(self, protocol):
+        return self._groups[self._protocol_groups[protocol]][0], self._last_lent.get(protocol, 0)
+
+    def unthrottle_all(self):
+        if self._lend_call is not None and self._lend_call.active():
+            self._lend_call.cancel()
+        self._lend_call = None
+        for protocol in self._throttled.keys():
+            self._resume(protocol)
+
+    def is_throttled(self, protocol):
+        return protocol in self._throttled
+
 
 class RateLimiter(object):
-    """This class ensures that upload and download rates don't exceed specified maximums"""
+    """
+    Keeps upload and download rates under their maximums by pausing individual protocols, sharing the rates
+    between streams and upload slots by priority class
+
+    Protocols are registered in a group, the stream or upload slot they transfer data for, and a priority class.
+    When every group wants more than its share, a group of C{PRIORITY_STREAMING} gets 4 times the rate of a group
+    of C{PRIORITY_DOWNLOAD}, which gets twice the rate of one of C{PRIORITY_UPLOAD}.
+    """
 
     implements(IRateLimiter)
 
     #called by main application
 
     def __init__(self, max_dl_bytes=None, max_ul_bytes=None):
-        self.max_dl_bytes = max_dl_bytes
-        self.max_ul_bytes = max_ul_bytes
-        self.dl_bytes_this_interval = 0
-        self.ul_bytes_this_interval = 0
-        self.total_dl_bytes = 0
-        self.total_ul_bytes = 0
-        self.tick_call = None
-        self.tick_interval = 0.1
+        self._download = _LimitedDirection("download", lambda p: p.throttle_download(),
+                                           lambda p: p.unthrottle_download())
+        self._upload = _LimitedDirection("upload", lambda p: p.throttle_upload(),
+                                         lambda p: p.unthrottle_upload())
+        self.set_dl_limit(max_dl_bytes)
+        self.set_ul_limit(max_ul_bytes)
+
+    @property
+    def max_dl_bytes(self):
+        return self._download.limit
 
-        self.dl_throttled = False
-        self.ul_throttled = False
+    @property
+    def max_ul_bytes(self):
+        return self._upload.limit
 
-        self.protocols = []
+    @property
+    def total_dl_bytes(self):
+        return self._download.total_bytes
+
+    @property
+    def total_ul_bytes(self):
+        return self._upload.total_bytes
 
     def start(self):
         log.info("Starting rate limiter.")
-        self.tick_call = task.LoopingCall(self.tick)
-        self.tick_call.start(self.tick_interval)
-
-    def tick(self):
-        self.dl_bytes_this_interval = 0
-        self.ul_bytes_this_interval = 0
-        self.unthrottle_dl()
-        self.unthrottle_ul()
 
     def stop(self):
         log.info("Stopping rate limiter.")
-        if self.tick_call is not None:
-            self.tick_call.stop()
-            self.tick_call = None
+        self._download.unthrottle_all()
+        self._upload.unthrottle_all()
 
     def set_dl_limit(self, limit):
-        self.max_dl_bytes = limit
+        """
+        @param limit: the bytes per second that can be downloaded, None or 0 for no limit
+        """
+        self._download.set_limit(limit)
 
     def set_ul_limit(self, limit):
-        self.max_ul_bytes = limit
-
-    #throttling
-
-    def check_dl(self):
-        need_throttle = (self.max_dl_bytes is not None and
-                         self.dl_bytes_this_interval > self.max_dl_bytes * self.tick_interval)
-        if need_throttle:
-            from twisted.internet import reactor
-            reactor.callLater(0, self.throttle_dl)
-
-    def check_ul(self):
-        need_throttle = (self.max_ul_bytes is not None and
-                         self.ul_bytes_this_interval > self.max_ul_bytes * self.tick_interval)
-        if need_throttle:
-            from twisted.internet import reactor
-            reactor.callLater(0, self.throttle_ul)
-
-    def throttle_dl(self):
-        if self.dl_throttled is False:
-            for protocol in self.protocols:
-                protocol.throttle_download()
-            self.dl_throttled = True
-
-    def throttle_ul(self):
-        if self.ul_throttled is False:
-            for protocol in self.protocols:
-                protocol.throttle_upload()
-            self.ul_throttled = True
-
-    def unthrottle_dl(self):
-        if self.dl_throttled is True:
-            for protocol in self.protocols:
-                protocol.unthrottle_download()
-            self.dl_throttled = False
-
-    def unthrottle_ul(self):
-        if self.ul_throttled is True:
-            for protocol in self.protocols:
-                protocol.unthrottle_upload()
-            self.ul_throttled = False
+        """
+        @param limit: the bytes per second that can be uploaded, None or 0 for no limit
+        """
+        self._upload.set_limit(limit)
+
+    def is_download_throttled(self, protocol):
+        return self._download.is_throttled(protocol)
+
+    def is_upload_throttled(self, protocol):
+        return self._upload.is_throttled(protocol)
 
     #called by protocols
 
-    def report_dl_bytes(self, num_bytes):
-        self.dl_bytes_this_interval += num_bytes
-        self.total_dl_bytes += num_bytes
-        self.check_dl()
+    def report_dl_bytes(self, num_bytes, protocol=None):
+        self._download.report(num_bytes, protocol)
 
-    def report_ul_bytes(self, num_bytes):
-        self.ul_bytes_this_interval += num_bytes
-        self.total_ul_bytes += num_bytes
-        self.check_ul()
+    def report_ul_bytes(self, num_bytes, protocol=None):
+        self._upload.report(num_bytes, protocol)
+
+    def register_protocol(self, protocol, group=None, priority=PRIORITY_DOWNLOAD):
+        """
+        Register a protocol, or move a registered one to another group
 
-    def register_protocol(self, protocol):
-        if protocol not in self.protocols:
-            self.protocols.append(protocol)
-            if self.dl_throttled is True:
-                protocol.throttle_download()
-            if self.ul_throttled is True:
-                protocol.throttle_upload()
+        @param group: the stream or upload slot the protocol transfers data for, the protocol itself if None
+        @param priority: the priority class of the group
+        """
+        if group is None:
+            group = protocol
+        self._download.register(protocol, group, priority)
+        self._upload.register(protocol, group, priority)
 
     def unregister_protocol(self, protocol):
-        if protocol in self.protocols:
-            self.protocols.remove(protocol)
+        self._download.unregister(protocol)
+        self._upload.unregister(protocol)
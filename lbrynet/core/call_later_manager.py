@@ -1,4 +1,5 @@
 import logging
+import itertools
 
 log = logging.getLogger()
 
@@ -15,11 +16,12 @@ class CallLaterManager(object):
         """
 
         self._callLater = callLater
-        self._pendingCallLaters = []
+        # call id: DelayedCall, calls are removed when they run or are cancelled so this only holds pending calls
+        self._pendingCallLaters = {}
+        self._call_ids = itertools.count()
         self._delay = MIN_DELAY
 
     def get_min_delay(self):
-        self._pendingCallLaters = [cl for cl in self._pendingCallLaters if cl.active()]
         queue_size = len(self._pendingCallLaters)
         if queue_size > QUEUE_SIZE_THRESHOLD:
             self._delay = min((self._delay + DELAY_INCREMENT), MAX_DELAY)
@@ -27,9 +29,13 @@ class CallLaterManager(object):
             self._delay = max((self._delay - 2.0 * DELAY_INCREMENT), MIN_DELAY)
         return self._delay
 
-    def _cancel(self, call_later):
+    def _run(self, call_id, what, args, kwargs):
+        self._pendingCallLaters.pop(call_id, None)
+        return what(*args, **kwargs)
+
+    def _cancel(self, call_id):
         """
-        :param call_later: DelayedCall
+        :param call_id: (int) id of the pending call
         :return: (callable) canceller function
         """
 
@@ -39,10 +45,9 @@ class CallLaterManager(object):
             :return: reason
             """
 
-            if call_later.active():
+            call_later = self._pendingCallLaters.pop(call_id, None)
+            if call_later is not None and call_later.active():
                 call_later.cancel()
-            if call_later in self._pendingCallLaters:
-                self._pendingCallLaters.remove(call_later)
             return reason
         return cancel
 
@@ -53,9 +58,10 @@ class CallLaterManager(object):
 
         from twisted.internet import defer
         while self._pendingCallLaters:
-            canceller = self._cancel(self._pendingCallLaters[0])
+            _, call_later = self._pendingCallLaters.popitem()
             try:
-                canceller()
+                if call_later.active():
+                    call_later.cancel()
             except (defer.CancelledError, defer.AlreadyCalledError, ValueError):
                 pass
 
@@ -71,10 +77,10 @@ class CallLaterManager(object):
         :return: (tuple) twisted.internet.base.DelayedCall object, canceller function
         """
 
-        call_later = self._callLater(when, what, *args, **kwargs)
-        canceller = self._cancel(call_later)
-        self._pendingCallLaters.append(call_later)
-        return call_later, canceller
+        call_id = next(self._call_ids)
+        call_later = self._callLater(when, self._run, call_id, what, args, kwargs)
+        self._pendingCallLaters[call_id] = call_later
+        return call_later, self._cancel(call_id)
 
     def call_soon(self, what, *args, **kwargs):
         delay = self.get_min_delay()
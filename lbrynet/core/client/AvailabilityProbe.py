@@ -0,0 +1,97 @@
+import json
+import logging
+from twisted.internet import defer, reactor
+from twisted.internet.protocol import Protocol, ClientFactory
+from lbrynet.core import utils
+from lbrynet.core.json_framing import JSONMessageDecoder
+
+log = logging.getLogger(__name__)
+
+
+class AvailabilityProbeProtocol(Protocol):
+    """Sends a peer a single availability query and reads its answer"""
+
+    def connectionMade(self):
+        self._decoder = JSONMessageDecoder()
+        self.transport.write(json.dumps({'requested_blobs': self.factory.blob_hashes}))
+
+    def dataReceived(self, data):
+        self._decoder.feed(data)
+        try:
+            response = self._decoder.next_message()
+        except ValueError:
+            log.debug("Invalid availability response from %s", self.factory.peer)
+            response = {}
+        if response is None:
+            return
+        self.transport.loseConnection()
+        self.factory.probe_finished(self.factory.available_blobs(response))
+
+    def connectionLost(self, reason):
+        self.factory.probe_finished(None)
+
+
+class AvailabilityProbeFactory(ClientFactory):
+    """
+    Asks a peer which of some blobs it has, without negotiating a rate or downloading anything
+
+    C{finished} fires with the requested blob hashes the peer has, or None if it couldn't be reached or didn't answer.
+    """
+
+    protocol = AvailabilityProbeProtocol
+
+    def __init__(self, peer, blob_hashes):
+        self.peer = peer
+        self.blob_hashes = blob_hashes
+        self.finished = defer.Deferred()
+        self.connector = None
+
+    def available_blobs(self, response):
+        available = response.get('available_blobs') if isinstance(response, dict) else None
+        if not isinstance(available, list):
+            return []
+        return [blob_hash for blob_hash in self.blob_hashes if blob_hash in available]
+
+    def probe_finished(self, available_blobs):
+        if not self.finished.called:
+            self.finished.callback(available_blobs)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.probe_finished(None)
+
+    def stop(self):
+        self.probe_finished(None)
+        if self.connector is not None:
+            self.connector.disconnect()
+
+
+def probe_peers(peers, blob_hashes, timeout):
+    """
+    Ask peers at once which of some blobs they have, giving up on those that haven't answered within the timeout
+
+    @param peers: the Peers to ask
+    @param blob_hashes: the blob hashes to ask about
+    @param timeout: the seconds all the peers have to answer in
+
+    @return: Deferred firing with a dict of {Peer: [the blob hashes it has]}, None for the peers that didn't answer
+    """
+    factories = []
+    for peer in peers:
+        factory = AvailabilityProbeFactory(peer, blob_hashes)
+        factory.connector = reactor.connectTCP(peer.host, peer.port, factory, timeout=timeout)
+        factories.append(factory)
+
+    def time_out():
+        for factory in factories:
+            factory.stop()
+
+    timeout_call = utils.call_later(timeout, time_out)
+
+    def probes_finished(results):
+        if timeout_call.active():
+            timeout_call.cancel()
+        return {factory.peer: available for factory, (_, available) in zip(factories, results)}
+
+    d = defer.DeferredList([factory.finished for factory in factories])
+    d.addCallback(probes_finished)
+    return d
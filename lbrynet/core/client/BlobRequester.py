@@ -10,9 +10,13 @@ from zope.interface import implements
 from lbrynet.core.Error import ConnectionClosedBeforeResponseError
 from lbrynet.core.Error import InvalidResponseError, RequestCanceledError, NoResponseError
 from lbrynet.core.Error import PriceDisagreementError, DownloadCanceledError, InsufficientFundsError
+from lbrynet.core.Error import UploadSlotsBusyError
+from lbrynet.core import utils
 from lbrynet.core.client.ClientRequest import ClientRequest, ClientBlobRequest
+from lbrynet.core.client.DownloadScheduler import DownloadScheduler
 from lbrynet.interfaces import IRequestCreator
 from lbrynet.core.Offer import Offer
+from lbrynet.core.Peer import rank_peers
 
 
 log = logging.getLogger(__name__)
@@ -42,21 +46,30 @@ def cache(fn):
 class BlobRequester(object):
     implements(IRequestCreator)
 
-    def __init__(self, blob_manager, peer_finder, payment_rate_manager, wallet, download_manager):
+    MAX_BUSY_SECONDS = 300  # the longest a peer with busy upload slots is left alone, whatever it asks for
+
+    def __init__(self, blob_manager, peer_finder, payment_rate_manager, wallet, download_manager,
+                 scheduler=None):
         self.blob_manager = blob_manager
         self.peer_finder = peer_finder
         self.payment_rate_manager = payment_rate_manager
         self.wallet = wallet
         self._download_manager = download_manager
         self._peers = defaultdict(int)  # {Peer: score}
-        self._available_blobs = defaultdict(list)  # {Peer: [blob_hash]}
-        self._unavailable_blobs = defaultdict(list)  # {Peer: [blob_hash]}}
+        self._available_blobs = defaultdict(set)  # {Peer: set(blob_hash)}
+        self._blob_peers = defaultdict(set)  # {blob_hash: set(Peer)}, the reverse of _available_blobs
+        self._unavailable_blobs = defaultdict(set)  # {Peer: set(blob_hash)}
         self._protocol_prices = {}  # {ClientProtocol: price}
         self._protocol_offers = {}
-        self._price_disagreements = []  # [Peer]
+        self._price_disagreements = set()  # set(Peer)
         self._protocol_tries = {}
-        self._maxed_out_peers = []
-        self._incompatible_peers = []
+        self._maxed_out_peers = set()
+        self._incompatible_peers = set()
+        self._bad_peers = set()  # peers _should_send_request_to is False for
+        self._busy_peers = {}  # {Peer: timestamp}, peers whose upload slots are busy and when to ask them again
+        # {Peer: ClientProtocol}, connections shared with other streams at a rate this stream won't pay
+        self._unaffordable_connections = {}
+        self._scheduler = scheduler or DownloadScheduler()
 
     ######## IRequestCreator #########
     def send_next_request(self, peer, protocol):
@@ -87,10 +100,23 @@ class BlobRequester(object):
     ######### internal calls #########
     def should_send_next_request(self, peer):
         return (
-            self._blobs_to_download() and
+            self._download_manager.needed_blobs() and
             self._should_send_request_to(peer)
         )
 
+    def is_connection_unaffordable(self, peer):
+        """
+        Whether the open connection to a peer is shared with other streams at a rate this stream won't pay, in which
+        case this stream should leave it to them and download from other peers
+        """
+        protocol = self._unaffordable_connections.get(peer)
+        if protocol is None:
+            return False
+        if protocol.connection_closed:
+            del self._unaffordable_connections[peer]
+            return False
+        return True
+
     def _send_next_request(self, peer, protocol):
         log.debug('Sending a blob request for %s and %s', peer, protocol)
         availability = AvailabilityRequest(self, peer, protocol, self.payment_rate_manager)
@@ -99,6 +125,13 @@ class BlobRequester(object):
                                    self.wallet, head_blob_hash)
         price = PriceRequest(self, peer, protocol, self.payment_rate_manager)
 
+        if price.connection_rate_too_high():
+            log.debug("The rate agreed on with %s for the connection is more than this stream pays, not "
+                      "downloading from it over the connection", peer)
+            self._unaffordable_connections[peer] = protocol
+            return defer.succeed(False)
+        price.use_connection_rate()
+
         sent_request = False
         if availability.can_make_request():
             availability.make_request_and_handle_response()
@@ -138,11 +171,11 @@ class BlobRequester(object):
         d = self.peer_finder.find_peers_for_blob(h, filter_self=True)
 
         def choose_best_peers(peers):
-            bad_peers = self._get_bad_peers()
-            without_bad_peers = [p for p in peers if not p in bad_peers]
+            without_bad_peers = [p for p in peers if not p in self._bad_peers]
             without_maxed_out_peers = [
-                p for p in without_bad_peers if p not in self._maxed_out_peers]
-            return without_maxed_out_peers
+                p for p in without_bad_peers if p not in self._maxed_out_peers and not self._is_busy(p) and
+                not self.is_connection_unaffordable(p)]
+            return rank_peers(without_maxed_out_peers)
 
         d.addCallback(choose_best_peers)
 
@@ -162,20 +195,47 @@ class BlobRequester(object):
             return False
         return True
 
-    def _get_bad_peers(self):
-        return [p for p in self._peers.iterkeys() if not self._should_send_request_to(p)]
+    def _update_bad_peers(self, peer):
+        if self._should_send_request_to(peer):
+            self._bad_peers.discard(peer)
+        else:
+            self._bad_peers.add(peer)
 
-    def _hash_available(self, blob_hash):
-        for peer in self._available_blobs:
-            if blob_hash in self._available_blobs[peer]:
-                return True
-        return False
+    def _add_price_disagreement(self, peer):
+        self._price_disagreements.add(peer)
+        self._update_bad_peers(peer)
 
-    def _hash_available_on(self, blob_hash, peer):
-        if blob_hash in self._available_blobs[peer]:
+    def _add_incompatible_peer(self, peer):
+        self._incompatible_peers.add(peer)
+        self._update_bad_peers(peer)
+
+    def _set_peer_busy(self, peer, retry_in):
+        retry_in = min(retry_in, self.MAX_BUSY_SECONDS)
+        log.info("The upload slots of %s are busy, not requesting blobs from it for %i seconds", peer, retry_in)
+        self._busy_peers[peer] = utils.timestamp() + retry_in
+
+    def _is_busy(self, peer):
+        if peer not in self._busy_peers:
+            return False
+        if utils.timestamp() < self._busy_peers[peer]:
             return True
+        del self._busy_peers[peer]
         return False
 
+    def _set_hash_available(self, blob_hash, peer):
+        self._available_blobs[peer].add(blob_hash)
+        self._blob_peers[blob_hash].add(peer)
+        self._unavailable_blobs[peer].discard(blob_hash)
+
+    def _set_hash_unavailable(self, blob_hash, peer):
+        self._unavailable_blobs[peer].add(blob_hash)
+
+    def _hash_available(self, blob_hash):
+        return bool(self._blob_peers.get(blob_hash))
+
+    def _hash_available_on(self, blob_hash, peer):
+        return blob_hash in self._available_blobs[peer]
+
     def _blobs_to_download(self):
         needed_blobs = self._download_manager.needed_blobs()
         return sorted(needed_blobs, key=lambda b: b.is_downloading())
@@ -193,6 +253,7 @@ class BlobRequester(object):
 
     def _update_local_score(self, peer, amount):
         self._peers[peer] += amount
+        self._update_bad_peers(peer)
 
 
 class RequestHelper(object):
@@ -230,7 +291,7 @@ class RequestHelper(object):
                         ConnectionClosedBeforeResponseError, ValueError):
             return
         if reason.check(NoResponseError):
-            self.requestor._incompatible_peers.append(self.peer)
+            self.requestor._add_incompatible_peer(self.peer)
         log.warning("A request of type '%s' failed. Reason: %s, Error type: %s",
                     request_type, reason.getErrorMessage(), reason.type)
         self.update_local_score(-10.0)
@@ -242,8 +303,7 @@ class RequestHelper(object):
 
     def get_rate(self):
         if self.payment_rate_manager.price_limit_reached(self.peer):
-            if self.peer not in self.maxed_out_peers:
-                self.maxed_out_peers.append(self.peer)
+            self.maxed_out_peers.add(self.peer)
             return None
         rate = self.protocol_prices.get(self.protocol)
         if rate is None:
@@ -267,6 +327,13 @@ def _handle_incoming_blob(response_dict, peer, request):
         if response['error'] == "RATE_UNSET":
             # Stop the download with an error that won't penalize the peer
             request.cancel(PriceDisagreementError())
+        elif response['error'] == "BUSY":
+            # The peer's upload slots are all in use, stop the download without penalizing the peer and ask again
+            # when it says one should be free
+            retry_in = response.get('retry_in')
+            if not isinstance(retry_in, (int, long, float)) or retry_in <= 0:
+                return InvalidResponseError("Got an invalid retry time from the peer: %s" % (retry_in,))
+            request.cancel(UploadSlotsBusyError(retry_in))
         else:
             # The peer has done something bad so we should get out of here
             return InvalidResponseError("Got an unknown error from the peer: %s" %
@@ -283,16 +350,19 @@ def _handle_incoming_blob(response_dict, peer, request):
             return InvalidResponseError("Missing the required field 'length'")
         if not request.blob.set_length(response['length']):
             return InvalidResponseError("Could not set the length of the blob")
+        if response.get('offset', 0) != request.offset:
+            return InvalidResponseError("Incoming blob starts at %s instead of the requested offset %i" %
+                                        (response.get('offset', 0), request.offset))
     return True
 
 
 def _handle_download_error(err, peer, blob_to_download):
     if not err.check(DownloadCanceledError, PriceDisagreementError, RequestCanceledError,
-                     ConnectionClosedBeforeResponseError):
+                     ConnectionClosedBeforeResponseError, UploadSlotsBusyError):
         log.warning("An error occurred while downloading %s from %s. Error: %s",
                     blob_to_download.blob_hash, str(peer), err.getTraceback())
-    if err.check(PriceDisagreementError):
-        # Don't kill the whole connection just because a price couldn't be agreed upon.
+    if err.check(PriceDisagreementError, UploadSlotsBusyError):
+        # Don't kill the whole connection just because a price couldn't be agreed upon or the peer is busy.
         # Other information might be desired by other request creators at a better rate.
         return True
     return err
@@ -363,26 +433,42 @@ class AvailabilityRequest(RequestHelper):
                 self.process_available_blob_hash(blob_hash, request)
         # everything left in the request is missing
         for blob_hash in request.request_dict['requested_blobs']:
-            self.unavailable_blobs.append(blob_hash)
+            self.requestor._set_hash_unavailable(blob_hash, self.peer)
         return True
 
     def process_available_blob_hash(self, blob_hash, request):
         log.debug("The server has indicated it has the following blob available: %s", blob_hash)
-        self.available_blobs.append(blob_hash)
-        self.remove_from_unavailable_blobs(blob_hash)
+        self.requestor._set_hash_available(blob_hash, self.peer)
         request.request_dict['requested_blobs'].remove(blob_hash)
 
-    def remove_from_unavailable_blobs(self, blob_hash):
-        if blob_hash in self.unavailable_blobs:
-            self.unavailable_blobs.remove(blob_hash)
-
 
 class PriceRequest(RequestHelper):
     """Ask a peer if a certain price is acceptable"""
     def can_make_request(self):
-        if len(self.available_blobs) and self.protocol not in self.protocol_prices:
-            return self.get_rate() is not None
-        return False
+        if not len(self.available_blobs) or self.protocol in self.protocol_prices or \
+                self.protocol in self.protocol_offers:
+            return False
+        if self.protocol.blob_data_payment_rate is not None or \
+                self.protocol.blob_data_payment_rate_offer is not None:
+            # there's only one rate per connection, and another stream sharing it agreed on it or is waiting for
+            # the answer to its offer
+            return False
+        return self.get_rate() is not None
+
+    def connection_rate_too_high(self):
+        """Whether another stream sharing the connection agreed on a rate with the peer that this stream won't pay"""
+        rate = self.protocol.blob_data_payment_rate
+        if rate is None or self.protocol in self.protocol_prices:
+            return False
+        own_rate = self.get_rate()
+        return own_rate is None or rate > own_rate
+
+    def use_connection_rate(self):
+        """Settle on the rate another stream sharing the connection agreed on with the peer"""
+        rate = self.protocol.blob_data_payment_rate
+        if rate is not None and self.protocol not in self.protocol_prices:
+            log.debug("Using the rate %f/mb already agreed on with %s", rate, self.peer)
+            self.protocol_prices[self.protocol] = rate
 
     def make_request_and_handle_response(self):
         request = self._get_price_request()
@@ -398,13 +484,19 @@ class PriceRequest(RequestHelper):
         request_dict = {'blob_data_payment_rate': rate}
         assert self.protocol not in self.protocol_offers
         self.protocol_offers[self.protocol] = rate
+        self.protocol.blob_data_payment_rate_offer = rate
         return ClientRequest(request_dict, 'blob_data_payment_rate')
 
     def _handle_price_request(self, price_request):
         d = self.protocol.add_request(price_request)
+        d.addBoth(self._offer_answered)
         d.addCallback(self._handle_price_response, price_request)
         d.addErrback(self._request_failed, "price request")
 
+    def _offer_answered(self, result):
+        self.protocol.blob_data_payment_rate_offer = None
+        return result
+
     def _handle_price_response(self, response_dict, request):
         assert request.response_identifier == 'blob_data_payment_rate'
         if 'blob_data_payment_rate' not in response_dict:
@@ -416,13 +508,14 @@ class PriceRequest(RequestHelper):
         if offer.is_accepted:
             log.info("Offered rate %f/mb accepted by %s", offer.rate, self.peer.host)
             self.protocol_prices[self.protocol] = offer.rate
+            self.protocol.blob_data_payment_rate = offer.rate
             return True
         elif offer.is_too_low:
             log.debug("Offered rate %f/mb rejected by %s", offer.rate, self.peer.host)
             return not self.payment_rate_manager.price_limit_reached(self.peer)
         else:
             log.warning("Price disagreement")
-            self.requestor._price_disagreements.append(self.peer)
+            self.requestor._add_price_disagreement(self.peer)
             return False
 
 
@@ -434,7 +527,7 @@ class DownloadRequest(RequestHelper):
         self.head_blob_hash = head_blob_hash
 
     def can_make_request(self):
-        if self.protocol in self.protocol_prices:
+        if self.protocol in self.protocol_prices and not self.requestor._is_busy(self.peer):
             return self.get_blob_details()
         return False
 
@@ -458,10 +551,8 @@ class DownloadRequest(RequestHelper):
         return self.find_blob(to_download)
 
     def get_available_blobs(self):
-        available_blobs = [
-            b for b in self.requestor._blobs_to_download()
-            if self.requestor._hash_available_on(b.blob_hash, self.peer)
-        ]
+        available_blobs = self.requestor._scheduler.blobs_for_peer(
+            self.peer, self.requestor._download_manager.needed_blobs(), self.requestor._blob_peers)
         log.debug('available blobs: %s', available_blobs)
         return available_blobs
 
@@ -471,23 +562,34 @@ class DownloadRequest(RequestHelper):
             if blob.get_is_verified():
                 log.debug('Skipping blob %s as its already validated', blob)
                 continue
-            writer, d = blob.open_for_writing(self.peer)
+            if self.peer in blob.writers:
+                log.debug('Skipping blob %s as it is already being downloaded from %s', blob, self.peer)
+                continue
+            # an interrupted download of the blob is continued if the peer can send it from an offset
+            writer, d = blob.open_for_writing(self.peer, resume=self.protocol.supports_blob_offsets)
             if d is not None:
-                return BlobDownloadDetails(blob, d, writer.write, writer.close, self.peer)
+                return BlobDownloadDetails(blob, d, writer.write, writer.close, self.peer, writer.offset)
             log.warning('Skipping blob %s as there was an issue opening it for writing', blob)
         return None
 
     def _make_request(self, blob_details):
         blob = blob_details.blob
+        request_dict = {'requested_blob': blob.blob_hash}
+        if blob_details.offset:
+            request_dict['requested_blob_offset'] = blob_details.offset
         request = ClientBlobRequest(
-            {'requested_blob': blob.blob_hash},
+            request_dict,
             'incoming_blob',
             blob_details.counting_write_func,
             blob_details.deferred,
             blob_details.cancel_func,
-            blob
+            blob,
+            blob_details.offset
         )
-        log.info("Requesting blob %s from %s", blob.blob_hash, self.peer)
+        if blob_details.offset:
+            log.info("Requesting blob %s from %s from byte %i", blob.blob_hash, self.peer, blob_details.offset)
+        else:
+            log.info("Requesting blob %s from %s", blob.blob_hash, self.peer)
         return request
 
     def _handle_download_request(self, client_blob_request):
@@ -511,14 +613,14 @@ class DownloadRequest(RequestHelper):
             self._download_failed,
             callbackArgs=(client_blob_request.blob,),
         )
-        client_blob_request.finished_deferred.addBoth(self._pay_or_cancel_payment,
-                                                      reserved_points, client_blob_request.blob)
+        client_blob_request.finished_deferred.addBoth(self._pay_or_cancel_payment, reserved_points,
+                                                      client_blob_request.blob, client_blob_request.offset)
         client_blob_request.finished_deferred.addErrback(_handle_download_error, self.peer,
                                                          client_blob_request.blob)
 
-    def _pay_or_cancel_payment(self, arg, reserved_points, blob):
+    def _pay_or_cancel_payment(self, arg, reserved_points, blob, offset=0):
         if self._can_pay_peer(blob, arg):
-            self._pay_peer(blob.length, reserved_points)
+            self._pay_peer(blob.length - offset, reserved_points)
         else:
             self._cancel_points(reserved_points)
         return arg
@@ -573,19 +675,22 @@ class DownloadRequest(RequestHelper):
         return d
 
     def _download_failed(self, reason):
-        if not reason.check(DownloadCanceledError, PriceDisagreementError):
+        if reason.check(UploadSlotsBusyError):
+            self.requestor._set_peer_busy(self.peer, reason.value.retry_in)
+        elif not reason.check(DownloadCanceledError, PriceDisagreementError):
             self.update_local_score(-10.0)
         return reason
 
 
 class BlobDownloadDetails(object):
     """Contains the information needed to make a ClientBlobRequest from an open blob"""
-    def __init__(self, blob, deferred, write_func, cancel_func, peer):
+    def __init__(self, blob, deferred, write_func, cancel_func, peer, offset=0):
         self.blob = blob
         self.deferred = deferred
         self.write_func = write_func
         self.cancel_func = cancel_func
         self.peer = peer
+        self.offset = offset
 
     def counting_write_func(self, data):
         self.peer.update_stats('blob_bytes_downloaded', len(data))
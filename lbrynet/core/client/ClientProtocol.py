@@ -1,5 +1,6 @@
 import json
 import logging
+from collections import deque
 from decimal import Decimal
 from twisted.internet import error, defer
 from twisted.internet.protocol import Protocol, ClientFactory
@@ -7,9 +8,11 @@ from twisted.protocols.policies import TimeoutMixin
 from twisted.python import failure
 from lbrynet import conf
 from lbrynet.core import utils
+from lbrynet.core.json_framing import JSONMessageDecoder
+from lbrynet.core.client.ClientRequest import ClientRequest
 from lbrynet.core.Error import ConnectionClosedBeforeResponseError, NoResponseError
 from lbrynet.core.Error import DownloadCanceledError, MisbehavingPeerError
-from lbrynet.core.Error import RequestCanceledError
+from lbrynet.core.Error import RequestCanceledError, InvalidResponseError
 from lbrynet.interfaces import IRequestSender, IRateLimited
 from zope.interface import implements
 
@@ -24,47 +27,99 @@ def encode_decimal(obj):
 
 
 class ClientProtocol(Protocol, TimeoutMixin):
+    """
+    Sends the requests of the request creators to a peer, one message at a time, and hands the responses and blob
+    data back to them
+
+    Servers supporting it let the client queue up to C{MAX_PIPELINED_BLOB_REQUESTS} blob requests on the
+    connection, as negotiated with the C{blob_pipelining} request in the first message. The server answers the
+    messages in order, streaming the blobs back to back, and the next request is asked for as soon as the response
+    to a blob request arrives instead of after the whole blob has been downloaded. With servers that don't support
+    it, a request is only sent once the response to the last one, and its blob, have been received.
+
+    Servers answering the C{blob_offsets} request, also sent in the first message, can be asked for a blob from an
+    offset, to continue a download of it that was interrupted.
+    """
+
     implements(IRequestSender, IRateLimited)
     ######### Protocol #########
     PROTOCOL_TIMEOUT = 30
+    MAX_PIPELINED_BLOB_REQUESTS = 3
 
     def connectionMade(self):
         log.debug("Connection made to %s", self.factory.peer)
         self._connection_manager = self.factory.connection_manager
         self._rate_limiter = self.factory.rate_limiter
         self.peer = self.factory.peer
-        self._response_deferreds = {}
-        self._response_buff = ''
+        self._response_deferreds = {}  # {response identifier: Deferred} of the next message
+        self._response_decoder = JSONMessageDecoder()
         self._downloading_blob = False
-        self._blob_download_request = None
+        self._blob_download_request = None  # the blob request whose data is being received
+        self._blob_bytes_left = None
+        self._blob_requests = []  # blob requests that haven't finished, in the order they were added
+        # (response deferreds, blob request, time sent) of the messages awaiting a response
+        self._requests_sent = deque()
+        self._blob_timings = {}  # {blob request: (length, time to first byte, time of first byte)}
+        self._last_blob_finished_at = None
         self._next_request = {}
+        self._next_blob_request = None
+        self._asking_for_request = False
+        self.pipelined_blob_requests = None  # the number of blob requests the server lets us queue, once known
+        self.supports_blob_offsets = False
+        # the server bills every blob sent over the connection at the last rate it accepted, so the streams sharing
+        # the connection settle on the first rate accepted instead of each negotiating their own
+        self.blob_data_payment_rate = None
+        self.blob_data_payment_rate_offer = None  # the rate offered to the server, until it has answered
         self.connection_closed = False
         self.connection_closing = False
         # This needs to be set for TimeoutMixin
         self.callLater = utils.call_later
         self.peer.report_up()
+        self._rate_limiter.register_protocol(self)
 
         self._ask_for_request()
 
     def dataReceived(self, data):
         log.debug("Received %d bytes from %s", len(data), self.peer)
         self.setTimeout(None)
-        self._rate_limiter.report_dl_bytes(len(data))
+        self._rate_limiter.report_dl_bytes(len(data), self)
 
-        if self._downloading_blob is True:
-            self._blob_download_request.write(data)
+        while data:
+            if self._downloading_blob is True:
+                data = self._write_blob_data(data)
+            else:
+                data = self._read_response(data)
+
+    def _read_response(self, data):
+        self._response_decoder.feed(data)
+        if len(self._response_decoder) > conf.settings['MAX_RESPONSE_INFO_SIZE']:
+            log.warning("Response is too large from %s. Size %s",
+                        self.peer, len(self._response_decoder))
+            self.transport.loseConnection()
+            return ''
+        try:
+            response = self._response_decoder.next_message()
+        except ValueError as err:
+            log.warning("Invalid response from %s: %s", self.peer, err)
+            self.transport.loseConnection()
+            return ''
+        if response is None:
+            return ''
+        extra_data = self._response_decoder.remaining()
+        self._handle_response(response)
+        return extra_data
+
+    def _write_blob_data(self, data):
+        if self._blob_bytes_left is None:
+            blob_data, data = data, ''
         else:
-            self._response_buff += data
-            if len(self._response_buff) > conf.settings['MAX_RESPONSE_INFO_SIZE']:
-                log.warning("Response is too large from %s. Size %s",
-                            self.peer, len(self._response_buff))
-                self.transport.loseConnection()
-            response, extra_data = self._get_valid_response(self._response_buff)
-            if response is not None:
-                self._response_buff = ''
-                self._handle_response(response)
-                if self._downloading_blob is True and len(extra_data) != 0:
-                    self._blob_download_request.write(extra_data)
+            blob_data, data = data[:self._blob_bytes_left], data[self._blob_bytes_left:]
+            self._blob_bytes_left -= len(blob_data)
+            if not self._blob_bytes_left:
+                # anything after the blob is the response to the next message
+                self._downloading_blob = False
+        self._blob_download_request.write(blob_data)
+        return data
 
     def timeoutConnection(self):
         log.info("Connection timed out to %s", self.peer)
@@ -75,15 +130,15 @@ class ClientProtocol(Protocol, TimeoutMixin):
         log.debug("Connection lost to %s: %s", self.peer, reason)
         self.setTimeout(None)
         self.connection_closed = True
+        self._rate_limiter.unregister_protocol(self)
         if reason.check(error.ConnectionDone):
             err = failure.Failure(ConnectionClosedBeforeResponseError())
         else:
             err = reason
-        for key, d in self._response_deferreds.items():
-            del self._response_deferreds[key]
+        for d in self._pop_response_deferreds():
             d.errback(err)
-        if self._blob_download_request is not None:
-            self._blob_download_request.cancel(err)
+        for blob_request in self._blob_requests[:]:
+            blob_request.cancel(err)
         self.factory.connection_was_made_deferred.callback(True)
 
     ######### IRequestSender #########
@@ -98,11 +153,14 @@ class ClientProtocol(Protocol, TimeoutMixin):
         return d
 
     def add_blob_request(self, blob_request):
-        if self._blob_download_request is None:
+        if self._next_blob_request is None and len(self._blob_requests) < (self.pipelined_blob_requests or 1):
             d = self.add_request(blob_request)
-            self._blob_download_request = blob_request
+            self._next_blob_request = blob_request
+            self._blob_requests.append(blob_request)
             blob_request.finished_deferred.addCallbacks(self._downloading_finished,
-                                                        self._handle_response_error)
+                                                        self._handle_response_error,
+                                                        callbackArgs=(blob_request,),
+                                                        errbackArgs=(blob_request,))
             return d
         else:
             return defer.fail(ValueError("There is already a blob download request active"))
@@ -111,17 +169,24 @@ class ClientProtocol(Protocol, TimeoutMixin):
         self.connection_closing = True
         ds = []
         err = RequestCanceledError()
-        for key, d in self._response_deferreds.items():
-            del self._response_deferreds[key]
+        for d in self._pop_response_deferreds():
             d.errback(err)
             ds.append(d)
-        if self._blob_download_request is not None:
-            ds.append(self._blob_download_request.finished_deferred)
-            self._blob_download_request.cancel(err)
-            self._blob_download_request = None
+        for blob_request in self._blob_requests[:]:
+            ds.append(blob_request.finished_deferred)
+            blob_request.cancel(err)
+        self._blob_requests = []
+        self._blob_download_request = None
         self._downloading_blob = False
         return defer.DeferredList(ds)
 
+    def _pop_response_deferreds(self):
+        deferreds = self._response_deferreds.values()
+        self._response_deferreds = {}
+        while self._requests_sent:
+            deferreds.extend(self._requests_sent.popleft()[0].values())
+        return deferreds
+
     ######### Internal request handling #########
 
     def _handle_request_error(self, err):
@@ -129,15 +194,32 @@ class ClientProtocol(Protocol, TimeoutMixin):
                   self.peer, err.type, err.message)
         self.transport.loseConnection()
 
+    def is_idle(self):
+        return not self._requests_sent and not self._blob_requests
+
+    def _is_pipelining(self):
+        return self.pipelined_blob_requests is not None and self.pipelined_blob_requests > 1
+
+    def _can_send_request(self):
+        if self.is_idle():
+            return True
+        # with pipelining, keep up to pipelined_blob_requests blob requests queued at the server
+        return self._is_pipelining() and len(self._blob_requests) < self.pipelined_blob_requests
+
     def _ask_for_request(self):
         if self.connection_closed is True or self.connection_closing is True:
             return
+        if self._asking_for_request or not self._can_send_request():
+            return
+        self._asking_for_request = True
 
         def send_request_or_close(do_request):
+            self._asking_for_request = False
+            if self.connection_closed is True or self.connection_closing is True:
+                return
             if do_request is True:
-                request_msg, self._next_request = self._next_request, {}
-                self._send_request_message(request_msg)
-            else:
+                self._send_next_request()
+            elif self.is_idle():
                 # The connection manager has indicated that this connection should be terminated
                 log.debug("Closing the connection to %s due to having no further requests to send",
                           self.peer)
@@ -147,6 +229,34 @@ class ClientProtocol(Protocol, TimeoutMixin):
         d.addCallback(send_request_or_close)
         d.addErrback(self._handle_request_error)
 
+    def _send_next_request(self):
+        if self.pipelined_blob_requests is None and 'blob_pipelining' not in self._response_deferreds:
+            d = self.add_request(ClientRequest({'blob_pipelining': self.MAX_PIPELINED_BLOB_REQUESTS},
+                                               'blob_pipelining'))
+            d.addCallbacks(self._handle_pipelining_response, self._handle_no_pipelining)
+            d = self.add_request(ClientRequest({'blob_offsets': True}, 'blob_offsets'))
+            d.addCallbacks(self._handle_offsets_response, lambda err: None)
+        request_msg, self._next_request = self._next_request, {}
+        self._requests_sent.append((self._response_deferreds, self._next_blob_request, utils.timestamp()))
+        self._response_deferreds, self._next_blob_request = {}, None
+        self._send_request_message(request_msg)
+
+    def _handle_pipelining_response(self, response_dict):
+        try:
+            self.pipelined_blob_requests = max(1, min(self.MAX_PIPELINED_BLOB_REQUESTS,
+                                                      int(response_dict['blob_pipelining'])))
+        except (TypeError, ValueError):
+            self.pipelined_blob_requests = 1
+        log.debug("%s accepts %i pipelined blob requests", self.peer, self.pipelined_blob_requests)
+
+    def _handle_no_pipelining(self, err):
+        # older servers don't answer the pipelining request, request their blobs one at a time
+        self.pipelined_blob_requests = 1
+
+    def _handle_offsets_response(self, response_dict):
+        self.supports_blob_offsets = response_dict['blob_offsets'] is True
+        log.debug("%s supports blob offsets: %s", self.peer, self.supports_blob_offsets)
+
     def _send_request_message(self, request_msg):
         self.setTimeout(self.PROTOCOL_TIMEOUT)
         # TODO: compare this message to the last one. If they're the same,
@@ -154,26 +264,7 @@ class ClientProtocol(Protocol, TimeoutMixin):
         m = json.dumps(request_msg, default=encode_decimal)
         self.transport.write(m)
 
-    def _get_valid_response(self, response_msg):
-        extra_data = None
-        response = None
-        curr_pos = 0
-        while 1:
-            next_close_paren = response_msg.find('}', curr_pos)
-            if next_close_paren != -1:
-                curr_pos = next_close_paren + 1
-                try:
-                    response = json.loads(response_msg[:curr_pos])
-                except ValueError:
-                    pass
-                else:
-                    extra_data = response_msg[curr_pos:]
-                    break
-            else:
-                break
-        return response, extra_data
-
-    def _handle_response_error(self, err):
+    def _handle_response_error(self, err, blob_request):
         # If an error gets to this point, log it and kill the connection.
         if err.check(DownloadCanceledError, RequestCanceledError, error.ConnectionAborted,
                      ConnectionClosedBeforeResponseError):
@@ -182,7 +273,7 @@ class ClientProtocol(Protocol, TimeoutMixin):
             # TODO: of telling the server it wants the download to stop. It would be great if the
             # TODO: protocol had such a mechanism.
             log.info("Closing the connection to %s because the download of blob %s was canceled",
-                     self.peer, self._blob_download_request.blob)
+                     self.peer, blob_request.blob)
             result = None
         elif err.check(MisbehavingPeerError):
             log.warning("The connection to %s is closing due to: %s", self.peer, err)
@@ -191,30 +282,40 @@ class ClientProtocol(Protocol, TimeoutMixin):
             log.error("The connection to %s is closing due to an unexpected error: %s",
                       self.peer, err)
             result = err
-        self._blob_download_request = None
-        self._downloading_blob = False
+        self._blob_finished(blob_request)
         self.transport.loseConnection()
         return result
 
     def _handle_response(self, response):
+        if not self._requests_sent:
+            log.warning("Got a response from %s without having sent a request", self.peer)
+            self.transport.loseConnection()
+            return
+        response_deferreds, blob_request, sent_at = self._requests_sent.popleft()
         ds = []
         log.debug(
             "Handling a response from %s. Expected responses: %s. Actual responses: %s",
-            self.peer, self._response_deferreds.keys(), response.keys())
+            self.peer, response_deferreds.keys(), response.keys())
         for key, val in response.items():
-            if key in self._response_deferreds:
-                d = self._response_deferreds.pop(key)
+            if key in response_deferreds:
+                d = response_deferreds.pop(key)
                 d.callback({key: val})
                 ds.append(d)
-        for k, d in self._response_deferreds.items():
-            del self._response_deferreds[k]
+        for k, d in response_deferreds.items():
+            del response_deferreds[k]
             d.errback(failure.Failure(NoResponseError()))
             ds.append(d)
 
-        if self._blob_download_request is not None:
+        if blob_request in self._blob_requests:
+            self._blob_download_request = blob_request
+            self._blob_bytes_left = self._get_blob_length(response)
             self._downloading_blob = True
-            d = self._blob_download_request.finished_deferred
-            d.addErrback(self._handle_response_error)
+            self._record_first_byte(blob_request, sent_at)
+            d = blob_request.finished_deferred
+            if self._blob_bytes_left is None and self._is_pipelining():
+                # without the length the response to the next message can't be told apart from the blob
+                blob_request.cancel(InvalidResponseError("No blob length in the response"))
+            d.addErrback(self._handle_response_error, blob_request)
             ds.append(d)
 
         # TODO: are we sure we want to consume errors here
@@ -239,11 +340,44 @@ class ClientProtocol(Protocol, TimeoutMixin):
                 self.transport.loseConnection()
 
         dl.addCallback(get_next_request)
+        if self._downloading_blob is True:
+            # queue the next blob request at the server while this one is being received
+            self._ask_for_request()
+
+    def _get_blob_length(self, response):
+        # the number of bytes of blob data following the response, or None if it isn't known
+        incoming_blob = response.get('incoming_blob')
+        if isinstance(incoming_blob, dict) and 'error' not in incoming_blob:
+            length = incoming_blob.get('length')
+            offset = incoming_blob.get('offset', 0)
+            if isinstance(length, (int, long)) and isinstance(offset, (int, long)) and 0 <= offset < length:
+                return length - offset
+        return None
+
+    def _record_first_byte(self, blob_request, sent_at):
+        if self._blob_bytes_left is None:
+            return
+        now = utils.timestamp()
+        # a pipelined request waits at the server for the blobs before it, which isn't the peer being slow to reply
+        waited_since = max(sent_at, self._last_blob_finished_at or sent_at)
+        self._blob_timings[blob_request] = (self._blob_bytes_left, now - waited_since, now)
+
+    def _blob_finished(self, blob_request):
+        self._blob_timings.pop(blob_request, None)
+        if blob_request in self._blob_requests:
+            self._blob_requests.remove(blob_request)
+        if blob_request is self._blob_download_request:
+            self._blob_download_request = None
+            self._downloading_blob = False
 
-    def _downloading_finished(self, arg):
+    def _downloading_finished(self, arg, blob_request):
         log.debug("The blob has finished downloading from %s", self.peer)
-        self._blob_download_request = None
-        self._downloading_blob = False
+        self._last_blob_finished_at = utils.timestamp()
+        if blob_request in self._blob_timings:
+            length, time_to_first_byte, first_byte_at = self._blob_timings[blob_request]
+            self.peer.report_blob_download(length, self._last_blob_finished_at - first_byte_at,
+                                           time_to_first_byte)
+        self._blob_finished(blob_request)
         return arg
 
     ######### IRateLimited #########
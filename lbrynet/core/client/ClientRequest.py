@@ -15,13 +15,14 @@ class ClientPaidRequest(ClientRequest):
 
 class ClientBlobRequest(ClientPaidRequest):
     def __init__(self, request_dict, response_identifier, write_func, finished_deferred,
-                 cancel_func, blob):
+                 cancel_func, blob, offset=0):
         if blob.length is None:
             max_pay_units = MAX_BLOB_SIZE
         else:
-            max_pay_units = blob.length
+            max_pay_units = blob.length - offset
         ClientPaidRequest.__init__(self, request_dict, response_identifier, max_pay_units)
         self.write = write_func
         self.finished_deferred = finished_deferred
         self.cancel = cancel_func
         self.blob = blob
+        self.offset = offset  # the offset into the blob the data is requested from
@@ -1,38 +1,48 @@
-import random
 import logging
-from twisted.internet import defer, reactor
+from twisted.internet import defer
 from zope.interface import implements
 from lbrynet import interfaces
 from lbrynet import conf
-from lbrynet.core.client.ClientProtocol import ClientProtocolFactory
+from lbrynet.core.client.ConnectionPool import ConnectionPool
 from lbrynet.core.Error import InsufficientFundsError
+from lbrynet.core.Peer import rank_peers
+from lbrynet.core.RateLimiter import PRIORITY_DOWNLOAD
 from lbrynet.core import utils
 
 log = logging.getLogger(__name__)
 
 
 class PeerConnectionHandler(object):
-    def __init__(self, request_creators, factory):
+    def __init__(self, request_creators, pooled_connection):
         self.request_creators = request_creators
-        self.factory = factory
-        self.connection = None
+        self.pooled_connection = pooled_connection
+        self.factory = pooled_connection.factory
+        self.connection = pooled_connection.connection
 
 
 class ConnectionManager(object):
     implements(interfaces.IConnectionManager)
     MANAGE_CALL_INTERVAL_SEC = 5
-    TCP_CONNECT_TIMEOUT = 15
 
     def __init__(self, downloader, rate_limiter,
-                 primary_request_creators, secondary_request_creators):
+                 primary_request_creators, secondary_request_creators, connection_pool=None,
+                 rate_limit_priority=PRIORITY_DOWNLOAD):
+        """
+        @param connection_pool: the ConnectionPool to get connections from, shared with the ConnectionManagers of
+            other streams. By default the connections are only used by this ConnectionManager and closed as soon
+            as it has no more requests for them.
+        @param rate_limit_priority: the priority class of the downloads in the rate limiter
+        """
 
         self.seek_head_blob_first = conf.settings['seek_head_blob_first']
         self.max_connections_per_stream = conf.settings['max_connections_per_stream']
 
         self.downloader = downloader
         self.rate_limiter = rate_limiter
+        self.rate_limit_priority = rate_limit_priority
         self._primary_request_creators = primary_request_creators
         self._secondary_request_creators = secondary_request_creators
+        self._connection_pool = connection_pool or ConnectionPool()
         self._peer_connections = {}  # {Peer: PeerConnectionHandler}
         self._connections_closing = {}  # {Peer: deferred (fired when the connection is closed)}
         self._next_manage_call = None
@@ -89,6 +99,11 @@ class ConnectionManager(object):
             return d
 
         def close_connection(p):
+            if not self._connection_pool.release(p, self):
+                log.debug("%s Leaving the connection to %s to the other streams using it",
+                          self._get_log_name(), p)
+                del self._peer_connections[p]
+                return defer.succeed(True)
             log.debug("%s Abruptly closing a connection to %s due to downloading being paused",
                         self._get_log_name(), p)
             if self._peer_connections[p].factory.p is not None:
@@ -112,8 +127,17 @@ class ConnectionManager(object):
         have_request = any(r[1] for r in requests if r[0] is True)
         if have_request:
             yield self._send_secondary_requests(peer, protocol)
+        elif self._primary_request_creators[0].is_connection_unaffordable(peer):
+            self._leave_connection(peer)
         defer.returnValue(have_request)
 
+    def _leave_connection(self, peer):
+        # leave a connection shared at a rate this stream won't pay to the other streams, freeing its place for a
+        # connection to another peer. If no other stream uses it, it closes as there's no request to send
+        if peer in self._peer_connections and not self._connection_pool.release(peer, self):
+            log.debug("%s Leaving the connection to %s to the other streams using it", self._get_log_name(), peer)
+            del self._peer_connections[peer]
+
     def _send_primary_requests(self, peer, protocol):
         def handle_error(err):
             err.trap(InsufficientFundsError)
@@ -150,6 +174,9 @@ class ConnectionManager(object):
     @defer.inlineCallbacks
     def manage(self, schedule_next_call=True):
         self._manage_deferred = defer.Deferred()
+        # idle shared connections don't ask for requests until they're woken up
+        for peer_connection_handler in self._peer_connections.values():
+            peer_connection_handler.pooled_connection.wake()
         if len(self._peer_connections) < self.max_connections_per_stream:
             log.debug("%s have %d connections, looking for %d",
                         self._get_log_name(), len(self._peer_connections),
@@ -162,9 +189,10 @@ class ConnectionManager(object):
         if not self.stopped and schedule_next_call:
             self._next_manage_call = utils.call_later(self.MANAGE_CALL_INTERVAL_SEC, self.manage)
 
-    def return_shuffled_peers_not_connected_to(self, peers, new_conns_needed):
-        out = [peer for peer in peers if peer not in self._peer_connections]
-        random.shuffle(out)
+    def return_best_peers_not_connected_to(self, peers, new_conns_needed):
+        out = rank_peers(peer for peer in peers if peer not in self._peer_connections)
+        # connections other streams have open are reused before connecting to new peers
+        out.sort(key=lambda peer: not self._connection_pool.has_connection(peer))
         return out[0:new_conns_needed]
 
     @defer.inlineCallbacks
@@ -181,7 +209,7 @@ class ConnectionManager(object):
         if self.seek_head_blob_first:
             try:
                 peers = yield request_creator.get_new_peers_for_head_blob()
-                peers = self.return_shuffled_peers_not_connected_to(peers, new_conns_needed)
+                peers = self.return_best_peers_not_connected_to(peers, new_conns_needed)
             except KeyError:
                 log.warning("%s does not have a head blob", self._get_log_name())
                 peers = []
@@ -192,7 +220,7 @@ class ConnectionManager(object):
         # we have to look for the first unavailable blob
         if not peers:
             peers = yield request_creator.get_new_peers_for_next_unavailable()
-            peers = self.return_shuffled_peers_not_connected_to(peers, new_conns_needed)
+            peers = self.return_best_peers_not_connected_to(peers, new_conns_needed)
 
         log.debug("%s Got a list of peers to choose from: %s",
                     self._get_log_name(), peers)
@@ -207,16 +235,14 @@ class ConnectionManager(object):
             return
 
         log.debug("%s Trying to connect to %s", self._get_log_name(), peer)
-        factory = ClientProtocolFactory(peer, self.rate_limiter, self)
-        factory.connection_was_made_deferred.addCallback(
-                lambda c_was_made: self._peer_disconnected(c_was_made, peer))
+        pooled_connection = self._connection_pool.connect(peer, self, self.rate_limiter)
+        if pooled_connection is None:
+            return
         self._peer_connections[peer] = PeerConnectionHandler(self._primary_request_creators[:],
-                                                             factory)
-        connection = reactor.connectTCP(peer.host, peer.port, factory,
-                                        timeout=self.TCP_CONNECT_TIMEOUT)
-        self._peer_connections[peer].connection = connection
+                                                             pooled_connection)
+        pooled_connection.wake()
 
-    def _peer_disconnected(self, connection_was_made, peer):
+    def peer_disconnected(self, connection_was_made, peer):
         log.debug("%s protocol disconnected for %s",
                     self._get_log_name(), peer)
         if peer in self._peer_connections:
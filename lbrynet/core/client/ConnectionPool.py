@@ -0,0 +1,190 @@
+import logging
+from twisted.internet import defer, reactor
+from lbrynet import conf
+from lbrynet.core import utils
+from lbrynet.core.client.ClientProtocol import ClientProtocolFactory
+
+log = logging.getLogger(__name__)
+
+
+class PooledConnection(object):
+    """
+    A connection to a peer that the ConnectionManagers of several streams take turns sending requests over
+
+    It is the connection manager of its ClientProtocol. When none of the streams has a request for the peer, the
+    connection is kept open for the pool's idle timeout in case a stream wants it again, and closed after that.
+
+    The server bills the blobs sent over a connection at the one rate it last accepted on it, so the streams don't
+    negotiate their own: the first rate agreed on is used by all of them, and a stream that won't pay it leaves the
+    connection to the others and downloads from other peers while it is open.
+    """
+
+    def __init__(self, pool, peer, rate_limiter):
+        self.pool = pool
+        self.peer = peer
+        self.connection_managers = []  # the ConnectionManagers using the connection, in the order they take turns
+        self.rate_limiter = rate_limiter
+        self.factory = ClientProtocolFactory(peer, rate_limiter, self)
+        self.connection = None
+        self._rate_limited_protocol = None
+        self._idle_deferred = None
+        self._idle_call = None
+
+    def is_idle(self):
+        return self._idle_deferred is not None
+
+    def update_rate_limit_group(self, protocol=None):
+        """Rate limit the connection as part of the highest priority stream using it"""
+        protocol = protocol or self._rate_limited_protocol
+        if protocol is None or protocol.connection_closed or not self.connection_managers:
+            return
+        self._rate_limited_protocol = protocol
+        connection_manager = min(self.connection_managers, key=lambda manager: manager.rate_limit_priority)
+        self.rate_limiter.register_protocol(protocol, connection_manager, connection_manager.rate_limit_priority)
+
+    @defer.inlineCallbacks
+    def get_next_request(self, peer, protocol):
+        if protocol is not self._rate_limited_protocol:
+            self.update_rate_limit_group(protocol)
+        while True:
+            for connection_manager in list(self.connection_managers):
+                if connection_manager not in self.connection_managers:
+                    continue
+                have_request = yield connection_manager.get_next_request(peer, protocol)
+                if have_request:
+                    # let the other streams go first next time
+                    if connection_manager in self.connection_managers:
+                        self.connection_managers.remove(connection_manager)
+                        self.connection_managers.append(connection_manager)
+                    defer.returnValue(True)
+            if not self.pool.idle_timeout or not protocol.is_idle() or protocol.connection_closed:
+                defer.returnValue(False)
+            log.debug("Keeping the idle connection to %s open", peer)
+            have_request = yield self._wait_while_idle()
+            if not have_request:
+                defer.returnValue(False)
+
+    def _wait_while_idle(self):
+        self._idle_deferred = defer.Deferred()
+        self._idle_call = utils.call_later(self.pool.idle_timeout, self.close_if_idle)
+        return self._idle_deferred
+
+    def _stop_waiting(self, result):
+        d, self._idle_deferred = self._idle_deferred, None
+        if self._idle_call.active():
+            self._idle_call.cancel()
+        self._idle_call = None
+        d.callback(result)
+
+    def wake(self):
+        """Ask the streams for requests again if the connection is idle"""
+        if self.is_idle():
+            self._stop_waiting(True)
+
+    def close_if_idle(self):
+        """
+        Close the connection if it is idle
+
+        @return: True if the connection is closing
+        """
+        if not self.is_idle():
+            return False
+        log.debug("Closing the idle connection to %s", self.peer)
+        self._stop_waiting(False)
+        return True
+
+
+class ConnectionPool(object):
+    """
+    Connections to peers, one per peer, shared by the ConnectionManagers of the streams being downloaded
+
+    At most max_connections are open at once. When that many are open, an idle connection is closed to make room
+    for a new one, and no new connection is made if none is idle.
+    """
+
+    TCP_CONNECT_TIMEOUT = 15
+
+    def __init__(self, max_connections=None, idle_timeout=0):
+        """
+        @param max_connections: the number of connections that can be open at once, or None for no limit
+        @param idle_timeout: the seconds an idle connection is kept open, 0 to close it as soon as it is idle
+        """
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._connections = {}  # {Peer: PooledConnection}
+
+    def num_connections(self):
+        return len(self._connections)
+
+    def has_connection(self, peer):
+        return peer in self._connections
+
+    def connect(self, peer, connection_manager, rate_limiter):
+        """
+        Get the connection to a peer for a ConnectionManager, connecting to the peer if there is no connection
+
+        @return: the PooledConnection, or None if too many connections are open
+        """
+        pooled_connection = self._connections.get(peer)
+        if pooled_connection is None:
+            if not self._has_room():
+                log.debug("Not connecting to %s, %i connections are open", peer, len(self._connections))
+                return None
+            pooled_connection = PooledConnection(self, peer, rate_limiter)
+            self._connections[peer] = pooled_connection
+            pooled_connection.factory.connection_was_made_deferred.addCallback(self._connection_lost,
+                                                                               pooled_connection)
+            pooled_connection.connection = reactor.connectTCP(peer.host, peer.port, pooled_connection.factory,
+                                                              timeout=self.TCP_CONNECT_TIMEOUT)
+        else:
+            log.debug("Reusing the connection to %s", peer)
+        if connection_manager not in pooled_connection.connection_managers:
+            pooled_connection.connection_managers.append(connection_manager)
+            pooled_connection.update_rate_limit_group()
+        return pooled_connection
+
+    def release(self, peer, connection_manager):
+        """
+        Stop a ConnectionManager from using the connection to a peer
+
+        @return: True if no other ConnectionManager is using the connection, in which case it's left to the caller
+            to close it and it keeps being told when the connection is lost
+        """
+        pooled_connection = self._connections.get(peer)
+        if pooled_connection is None or connection_manager not in pooled_connection.connection_managers:
+            return True
+        if len(pooled_connection.connection_managers) == 1:
+            return True
+        pooled_connection.connection_managers.remove(connection_manager)
+        pooled_connection.update_rate_limit_group()
+        return False
+
+    def _has_room(self):
+        if self.max_connections is None or len(self._connections) < self.max_connections:
+            return True
+        for peer, pooled_connection in self._connections.items():
+            if pooled_connection.close_if_idle():
+                del self._connections[peer]
+                return True
+        return False
+
+    def _connection_lost(self, connection_was_made, pooled_connection):
+        if self._connections.get(pooled_connection.peer) is pooled_connection:
+            del self._connections[pooled_connection.peer]
+        if pooled_connection.is_idle():
+            pooled_connection.close_if_idle()
+        for connection_manager in pooled_connection.connection_managers:
+            connection_manager.peer_disconnected(connection_was_made, pooled_connection.peer)
+        return connection_was_made
+
+
+_shared_pool = None
+
+
+def get_shared_connection_pool():
+    """The pool of the connections shared by all streams being downloaded"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ConnectionPool(conf.settings['max_peer_connections'],
+                                      conf.settings['peer_connection_idle_timeout'])
+    return _shared_pool
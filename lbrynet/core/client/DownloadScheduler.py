@@ -0,0 +1,59 @@
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class DownloadScheduler(object):
+    """
+    Chooses which blobs of a stream to request from a peer. One scheduler is shared by the connections to all the
+    peers of a stream, so that they work on different blobs.
+
+    Blobs that aren't being downloaded yet are handed out first: those in the window at the front of the stream in
+    stream order, so that the stream can be output as soon as possible, then the rest rarest first, so that the
+    blobs few peers have are not left until last. Blobs being downloaded from other peers are only requested again
+    in the endgame, once every blob left that the peer has is being downloaded, so that a slow peer doesn't hold
+    up the end of the stream. The blobs with the fewest peers and the least data received are requested first, and
+    a blob is downloaded from at most max_endgame_writers peers at once. The first peer to finish a blob wins, the
+    other downloads of it are cancelled by the blob.
+    """
+
+    def __init__(self, window_size=4, max_endgame_writers=3):
+        """
+        @param window_size: the number of blobs at the front of the stream requested in stream order
+        @param max_endgame_writers: the number of peers a blob can be downloaded from at once in the endgame
+        """
+        self.window_size = window_size
+        self.max_endgame_writers = max_endgame_writers
+
+    @staticmethod
+    def _bytes_received(blob):
+        return max(writer.len_so_far for writer, _ in blob.writers.itervalues())
+
+    def blobs_for_peer(self, peer, needed_blobs, blob_peers):
+        """
+        Get the blobs to request from a peer
+
+        @param needed_blobs: the blobs left to download, in stream order
+        @param blob_peers: {blob hash: set(Peer)} of the peers that have said they have each blob
+        @return: the blobs to try to request from the peer, best first
+        """
+        fresh, in_flight = [], []
+        for position, blob in enumerate(needed_blobs):
+            peers = blob_peers.get(blob.blob_hash, ())
+            if peer not in peers or peer in blob.writers:
+                continue
+            if blob.is_downloading():
+                in_flight.append((len(blob.writers), self._bytes_received(blob), position, blob))
+            elif position < self.window_size:
+                fresh.append(((position,), blob))
+            else:
+                fresh.append(((self.window_size, len(peers), position), blob))
+        if fresh:
+            fresh.sort()
+            return [blob for _, blob in fresh]
+        in_flight.sort()
+        blobs = [blob for writers, _, _, blob in in_flight if writers < self.max_endgame_writers]
+        if blobs:
+            log.debug("Endgame: requesting %i blobs being downloaded from other peers from %s", len(blobs), peer)
+        return blobs
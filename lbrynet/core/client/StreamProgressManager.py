@@ -111,8 +111,8 @@ class FullStreamProgressManager(StreamProgressManager):
     def needed_blobs(self):
         blobs = self.download_manager.blobs
         return [
-            b for n, b in blobs.iteritems()
-            if not b.get_is_verified() and not n in self.provided_blob_nums
+            blobs[n] for n in sorted(blobs)
+            if not blobs[n].get_is_verified() and not n in self.provided_blob_nums
         ]
 
     ######### internal #########
@@ -0,0 +1,157 @@
+import re
+import json
+from json.decoder import WHITESPACE
+
+_DECODER = json.JSONDecoder()
+# a whole string, a brace, or the quote starting a string that continues in data that hasn't arrived yet
+_OBJECT_TOKENS = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}"]', re.DOTALL)
+_STRING_TOKENS = re.compile(r'["\\]')
+
+
+class JSONMessageDecoder(object):
+    """
+    Splits a stream of JSON objects, as sent by the peer protocol, into messages
+
+    Data is fed in as it arrives and nothing is done with it until a closing brace has arrived. Then the buffer is
+    parsed once, which is all it takes when the message arrived whole. If that fails the message is incomplete, and
+    the data is scanned for the braces and strings delimiting the objects as it arrives, every byte once, so that it
+    is only parsed again when its closing brace has been found. Decoding takes linear time no matter how the stream
+    is split up.
+
+    Data after a message is left unscanned until the next message is asked for, so a caller that switches to
+    reading raw data (like a blob) after a message can take it with C{remaining}.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._scanned = 0  # number of chunks scanned
+        self._scanned_size = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._end = None  # offset of the end of the first message, once it has been found
+        self._closing_brace = False  # whether a closing brace arrived since the last scan
+        self._parse_attempted = False
+
+    def __len__(self):
+        return self._size
+
+    def feed(self, data):
+        if data:
+            self._chunks.append(data)
+            self._size += len(data)
+            self._closing_brace = self._closing_brace or '}' in data
+
+    def _check_whitespace(self, chunk, start, end):
+        if chunk[start:end].strip():
+            raise ValueError("unexpected data between messages")
+
+    def _scan(self, chunk):
+        """
+        Continue scanning the message with the next chunk of data
+
+        @return: the offset in the chunk where the message ends, or None if it doesn't end in this chunk
+        """
+        position = 0
+        if self._escaped:
+            position, self._escaped = 1, False
+        while True:
+            if self._in_string:
+                match = _STRING_TOKENS.search(chunk, position)
+                if match is None:
+                    return None
+                position = match.end()
+                if match.group() == '"':
+                    self._in_string = False
+                elif position == len(chunk):
+                    self._escaped = True
+                    return None
+                else:
+                    position += 1
+                continue
+            match = _OBJECT_TOKENS.search(chunk, position)
+            if not self._depth:
+                self._check_whitespace(chunk, position, len(chunk) if match is None else match.start())
+            if match is None:
+                return None
+            position, token = match.end(), match.group()
+            if token == '{':
+                self._depth += 1
+            elif not self._depth:
+                raise ValueError("message is not a json object")
+            elif token[0] == '"':
+                self._in_string = len(token) == 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    return position
+
+    def _parse(self):
+        """
+        Try to parse a message from the start of the buffer
+
+        @return: the message, or None if it hasn't been received completely
+        """
+        data = ''.join(self._chunks)
+        self._chunks = [data]
+        start = WHITESPACE.match(data).end()
+        if data[start] != '{':
+            self.remaining()
+            raise ValueError("message is not a json object")
+        try:
+            message, end = _DECODER.raw_decode(data, start)
+        except ValueError:
+            return None
+        self.remaining()
+        self.feed(data[end:])
+        return message
+
+    def next_message(self):
+        """
+        Get the next complete message
+
+        @return: the decoded message, or None if it hasn't been received completely yet
+        @raise ValueError: if the data isn't a valid json object, the invalid data is discarded
+        """
+        if self._end is None:
+            if not self._closing_brace:
+                return None
+            if not self._parse_attempted:
+                self._parse_attempted = True
+                message = self._parse()
+                if message is not None:
+                    return message
+            # scan everything that arrived since the last scan at once
+            self._chunks[self._scanned:] = [''.join(self._chunks[self._scanned:])]
+            self._closing_brace = False
+        while self._end is None and self._scanned < len(self._chunks):
+            chunk = self._chunks[self._scanned]
+            try:
+                end = self._scan(chunk)
+            except ValueError:
+                self.remaining()
+                raise
+            if end is not None:
+                self._end = self._scanned_size + end
+            self._scanned += 1
+            self._scanned_size += len(chunk)
+        if self._end is None:
+            return None
+        end = self._end
+        data = self.remaining()
+        self.feed(data[end:])
+        return json.loads(data[:end])
+
+    def remaining(self):
+        """
+        Take the buffered data that hasn't been returned as a message
+        """
+        data = ''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        self._reset_scan()
+        return data
@@ -1,12 +1,14 @@
 import logging
 
 from twisted.internet import defer
+from twisted.internet.defer import CancelledError
 from twisted.protocols.basic import FileSender
 from twisted.python.failure import Failure
 from zope.interface import implements
 
 from lbrynet import analytics
 from lbrynet.core.Offer import Offer
+from lbrynet.core.Error import UploadSlotsBusyError
 from lbrynet.interfaces import IQueryHandlerFactory, IQueryHandler, IBlobSender
 
 log = logging.getLogger(__name__)
@@ -15,17 +17,19 @@ log = logging.getLogger(__name__)
 class BlobRequestHandlerFactory(object):
     implements(IQueryHandlerFactory)
 
-    def __init__(self, blob_manager, wallet, payment_rate_manager, analytics_manager):
+    def __init__(self, blob_manager, wallet, payment_rate_manager, analytics_manager, upload_scheduler=None):
         self.blob_manager = blob_manager
         self.wallet = wallet
         self.payment_rate_manager = payment_rate_manager
         self.analytics_manager = analytics_manager
+        self.upload_scheduler = upload_scheduler
 
     ######### IQueryHandlerFactory #########
 
     def build_query_handler(self):
         q_h = BlobRequestHandler(
-            self.blob_manager, self.wallet, self.payment_rate_manager, self.analytics_manager)
+            self.blob_manager, self.wallet, self.payment_rate_manager, self.analytics_manager,
+            self.upload_scheduler)
         return q_h
 
     def get_primary_query_identifier(self):
@@ -40,20 +44,33 @@ class BlobRequestHandler(object):
     PAYMENT_RATE_QUERY = 'blob_data_payment_rate'
     BLOB_QUERY = 'requested_blob'
     AVAILABILITY_QUERY = 'requested_blobs'
-
-    def __init__(self, blob_manager, wallet, payment_rate_manager, analytics_manager):
+    PIPELINING_QUERY = 'blob_pipelining'
+    MAX_PIPELINED_BLOB_REQUESTS = 3
+    OFFSETS_QUERY = 'blob_offsets'
+    BLOB_OFFSET_QUERY = 'requested_blob_offset'
+
+    def __init__(self, blob_manager, wallet, payment_rate_manager, analytics_manager, upload_scheduler=None):
+        """
+        @param upload_scheduler: the UploadScheduler blobs are uploaded in the slots of, or None to upload every
+            requested blob at once
+        """
         self.blob_manager = blob_manager
         self.payment_rate_manager = payment_rate_manager
         self.wallet = wallet
-        self.query_identifiers = [self.PAYMENT_RATE_QUERY, self.BLOB_QUERY, self.AVAILABILITY_QUERY]
+        self.query_identifiers = [self.PAYMENT_RATE_QUERY, self.BLOB_QUERY, self.AVAILABILITY_QUERY,
+                                  self.PIPELINING_QUERY, self.OFFSETS_QUERY, self.BLOB_OFFSET_QUERY]
         self.analytics_manager = analytics_manager
         self.peer = None
         self.blob_data_payment_rate = None
         self.read_handle = None
         self.currently_uploading = None
+        self.upload_offset = 0
         self.file_sender = None
         self.blob_bytes_uploaded = 0
         self._blobs_requested = []
+        self.upload_scheduler = upload_scheduler
+        self.upload_slot = None
+        self._slot_request = None
 
     ######### IQueryHandler #########
 
@@ -66,6 +83,11 @@ class BlobRequestHandler(object):
         response = defer.succeed({})
         log.debug("Handle query: %s", str(queries))
 
+        if self.PIPELINING_QUERY in queries:
+            requested = queries[self.PIPELINING_QUERY]
+            response.addCallback(lambda r: self._reply_to_pipelining(r, requested))
+        if self.OFFSETS_QUERY in queries:
+            response.addCallback(self._reply_to_offsets)
         if self.AVAILABILITY_QUERY in queries:
             self._blobs_requested = queries[self.AVAILABILITY_QUERY]
             response.addCallback(lambda r: self._reply_to_availability(r, self._blobs_requested))
@@ -77,7 +99,8 @@ class BlobRequestHandler(object):
             response.addCallback(lambda r: self._handle_payment_rate_query(offer, r))
         if self.BLOB_QUERY in queries:
             incoming = queries[self.BLOB_QUERY]
-            response.addCallback(lambda r: self._reply_to_send_request(r, incoming))
+            offset = queries.get(self.BLOB_OFFSET_QUERY, 0)
+            response.addCallback(lambda r: self._reply_to_send_request(r, incoming, offset))
         return response
 
     ######### IBlobSender #########
@@ -88,10 +111,13 @@ class BlobRequestHandler(object):
         return defer.succeed(True)
 
     def cancel_send(self, err):
+        if self._slot_request is not None:
+            self._slot_request.cancel()
         if self.currently_uploading is not None:
             self.read_handle.close()
         self.read_handle = None
         self.currently_uploading = None
+        self._release_upload_slot()
         return err
 
     ######### internal #########
@@ -107,6 +133,21 @@ class BlobRequestHandler(object):
         d.addCallback(set_available)
         return d
 
+    def _reply_to_pipelining(self, request, requested):
+        # the ServerRequestHandler answers requests in order, so the client can queue blob requests
+        try:
+            accepted = max(1, min(self.MAX_PIPELINED_BLOB_REQUESTS, int(requested)))
+        except (TypeError, ValueError):
+            accepted = 1
+        log.debug("Accepting %i pipelined blob requests from %s", accepted, self.peer)
+        request[self.PIPELINING_QUERY] = accepted
+        return request
+
+    def _reply_to_offsets(self, request):
+        # the client can ask for blobs from an offset with requested_blob_offset, to continue interrupted downloads
+        request[self.OFFSETS_QUERY] = True
+        return request
+
     def _handle_payment_rate_query(self, offer, request):
         blobs = self._blobs_requested
         log.debug("Offered rate %f LBC/mb for %i blobs", offer.rate, len(blobs))
@@ -140,17 +181,28 @@ class BlobRequestHandler(object):
         d.addCallback(self.open_blob_for_reading, response)
         return d
 
-    def open_blob_for_reading(self, blob, response):
+    def open_blob_for_reading(self, blob, response, offset=0):
         response_fields = {}
         d = defer.succeed(None)
         if blob.get_is_verified():
+            if offset and (not isinstance(offset, (int, long)) or not 0 < offset < blob.length):
+                log.debug("Invalid offset %s of %s requested", offset, str(blob))
+                response['incoming_blob'] = {'error': 'INVALID_OFFSET'}
+                d.addCallback(lambda _: response)
+                return d
             read_handle = blob.open_for_reading()
             if read_handle is not None:
                 self.currently_uploading = blob
                 self.read_handle = read_handle
-                log.info("Sending %s to %s", str(blob), self.peer)
+                self.upload_offset = offset
                 response_fields['blob_hash'] = blob.blob_hash
                 response_fields['length'] = blob.length
+                if offset:
+                    log.info("Sending %s to %s from byte %i", str(blob), self.peer, offset)
+                    read_handle.seek(offset)
+                    response_fields['offset'] = offset
+                else:
+                    log.info("Sending %s to %s", str(blob), self.peer)
                 response['incoming_blob'] = response_fields
                 d.addCallback(lambda _: response)
                 return d
@@ -159,7 +211,7 @@ class BlobRequestHandler(object):
         d.addCallback(lambda _: response)
         return d
 
-    def _reply_to_send_request(self, response, incoming):
+    def _reply_to_send_request(self, response, incoming, offset=0):
         response_fields = {}
         response['incoming_blob'] = response_fields
 
@@ -170,9 +222,47 @@ class BlobRequestHandler(object):
         else:
             log.debug("Requested blob: %s", str(incoming))
             d = self.blob_manager.get_blob(incoming)
-            d.addCallback(lambda blob: self.open_blob_for_reading(blob, response))
+            d.addCallback(self._wait_for_upload_slot)
+            d.addCallback(lambda blob: self.open_blob_for_reading(blob, response, offset))
+            d.addCallback(self._release_unused_upload_slot)
+            d.addErrback(self._reply_busy, response)
             return d
 
+    def _wait_for_upload_slot(self, blob):
+        if self.upload_scheduler is None or not blob.get_is_verified():
+            return blob
+
+        def set_upload_slot(upload_slot):
+            self._slot_request = None
+            self.upload_slot = upload_slot
+            return blob
+
+        def stop_waiting(err):
+            self._slot_request = None
+            return err
+
+        d = self._slot_request = self.upload_scheduler.request_slot(self.peer, blob.blob_hash)
+        d.addCallbacks(set_upload_slot, stop_waiting)
+        return d
+
+    def _release_unused_upload_slot(self, response):
+        # the blob couldn't be opened or the request was invalid
+        if self.currently_uploading is None:
+            self._release_upload_slot()
+        return response
+
+    def _release_upload_slot(self):
+        if self.upload_slot is not None:
+            self.upload_slot.release()
+            self.upload_slot = None
+
+    def _reply_busy(self, err, response):
+        err.trap(UploadSlotsBusyError, CancelledError)
+        if err.check(UploadSlotsBusyError):
+            log.debug("Telling %s to retry in %i seconds", self.peer, err.value.retry_in)
+            response['incoming_blob'] = {'error': 'BUSY', 'retry_in': err.value.retry_in}
+        return response
+
     def _get_available_blobs(self, requested_blobs):
         d = self.blob_manager.completed_blobs(requested_blobs)
         return d
@@ -191,6 +281,8 @@ class BlobRequestHandler(object):
             uploaded = len(data)
             self.blob_bytes_uploaded += uploaded
             self.peer.update_stats('blob_bytes_uploaded', uploaded)
+            if self.upload_slot is not None:
+                self.upload_slot.report_bytes(uploaded)
             if self.analytics_manager is not None:
                 self.analytics_manager.add_observation(analytics.BLOB_BYTES_UPLOADED, uploaded)
             return data
@@ -211,8 +303,8 @@ class BlobRequestHandler(object):
             ):
                 # TODO: explain why 2**20
                 self.wallet.add_expected_payment(self.peer,
-                                                 self.currently_uploading.length * 1.0 *
-                                                 self.blob_data_payment_rate / 2 ** 20)
+                                                 (self.currently_uploading.length - self.upload_offset) *
+                                                 1.0 * self.blob_data_payment_rate / 2 ** 20)
                 self.blob_bytes_uploaded = 0
             self.peer.update_stats('blobs_uploaded', 1)
             return None
@@ -222,6 +314,8 @@ class BlobRequestHandler(object):
                 self.read_handle.close()
                 self.read_handle = None
                 self.currently_uploading = None
+                self.upload_offset = 0
+            self._release_upload_slot()
             self.file_sender = None
             if reason is not None and isinstance(reason, Failure):
                 log.warning("Upload has failed. Reason: %s", reason.getErrorMessage())
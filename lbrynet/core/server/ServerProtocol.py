@@ -3,6 +3,7 @@ from twisted.internet import interfaces, error
 from twisted.internet.protocol import Protocol, ServerFactory
 from twisted.python import failure
 from zope.interface import implements
+from lbrynet.core.RateLimiter import PRIORITY_UPLOAD
 from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
 
 
@@ -21,10 +22,13 @@ class ServerProtocol(Protocol):
     7) Upon creation, register with the rate limiter
     8) Upon connection loss, unregister with the rate limiter
     9) Report all uploaded and downloaded bytes to the rate limiter
-    10) Pause/resume production when told by the rate limiter
+    10) Pause/resume production when told by the rate limiter or the transport
     """
 
-    implements(interfaces.IConsumer)
+    implements(interfaces.IConsumer, interfaces.IPushProducer)
+
+    upload_throttled = False
+    transport_paused = False
 
     #Protocol stuff
 
@@ -37,7 +41,7 @@ class ServerProtocol(Protocol):
             query_handler = query_handler_factory.build_query_handler()
             query_handler.register_with_request_handler(self.request_handler, self.peer)
         log.debug("Setting the request handler")
-        self.factory.rate_limiter.register_protocol(self)
+        self.factory.rate_limiter.register_protocol(self, priority=PRIORITY_UPLOAD)
 
     def connectionLost(self, reason=failure.Failure(error.ConnectionDone())):
         if self.request_handler is not None:
@@ -48,7 +52,7 @@ class ServerProtocol(Protocol):
 
     def dataReceived(self, data):
         log.debug("Receiving %s bytes of data from the transport", str(len(data)))
-        self.factory.rate_limiter.report_dl_bytes(len(data))
+        self.factory.rate_limiter.report_dl_bytes(len(data), self)
         if self.request_handler is not None:
             self.request_handler.data_received(data)
 
@@ -57,24 +61,44 @@ class ServerProtocol(Protocol):
     def registerProducer(self, producer, streaming):
         log.debug("Registering the producer")
         assert streaming is True
+        self.transport.registerProducer(self, True)
 
     def unregisterProducer(self):
         self.request_handler = None
+        self.transport.unregisterProducer()
         self.transport.loseConnection()
 
     def write(self, data):
         log.trace("Writing %s bytes of data to the transport", len(data))
         self.transport.write(data)
-        self.factory.rate_limiter.report_ul_bytes(len(data))
+        self.factory.rate_limiter.report_ul_bytes(len(data), self)
+
+    #IPushProducer stuff, the transport pauses us while its write buffer is full
+
+    def pauseProducing(self):
+        self.transport_paused = True
+        if self.request_handler is not None:
+            self.request_handler.pauseProducing()
+
+    def resumeProducing(self):
+        self.transport_paused = False
+        if self.request_handler is not None and not self.upload_throttled:
+            self.request_handler.resumeProducing()
+
+    def stopProducing(self):
+        if self.request_handler is not None:
+            self.request_handler.stopProducing()
 
     #Rate limiter stuff
 
     def throttle_upload(self):
+        self.upload_throttled = True
         if self.request_handler is not None:
             self.request_handler.pauseProducing()
 
     def unthrottle_upload(self):
-        if self.request_handler is not None:
+        self.upload_throttled = False
+        if self.request_handler is not None and not self.transport_paused:
             self.request_handler.resumeProducing()
 
     def throttle_download(self):
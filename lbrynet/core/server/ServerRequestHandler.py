@@ -1,8 +1,10 @@
 import json
 import logging
+from collections import deque
 from twisted.internet import interfaces, defer
 from zope.interface import implements
 from lbrynet.interfaces import IRequestHandler
+from lbrynet.core.json_framing import JSONMessageDecoder
 
 
 log = logging.getLogger(__name__)
@@ -18,10 +20,13 @@ class ServerRequestHandler(object):
     def __init__(self, consumer):
         self.consumer = consumer
         self.production_paused = False
-        self.request_buff = ''
-        self.response_buff = ''
+        self.request_decoder = JSONMessageDecoder()
+        self.response_buff = deque()  # memoryviews of the data not written to the consumer yet
         self.producer = None
+        self._pulling = False
+        self._bytes_queued = 0
         self.request_received = False
+        self.stopped = False
         self.CHUNK_SIZE = 2**14
         self.query_handlers = {}  # {IQueryHandler: [query_identifiers]}
         self.blob_sender = None
@@ -36,76 +41,81 @@ class ServerRequestHandler(object):
         if self.producer is not None:
             self.producer.stopProducing()
             self.producer = None
+        self.stopped = True
+        if self.blob_sender is not None:
+            # a request waiting for an upload slot gives it up
+            self.blob_sender.cancel_send(None)
         self.production_paused = True
         self.consumer.unregisterProducer()
 
     def resumeProducing(self):
-
-        from twisted.internet import reactor
-
         self.production_paused = False
         self._produce_more()
-        if self.producer is not None:
-            reactor.callLater(0, self.producer.resumeProducing)
+        self._pull_from_producer()
 
     def _produce_more(self):
-
-        from twisted.internet import reactor
-
-        if self.production_paused:
-            return
-        chunk = self.response_buff[:self.CHUNK_SIZE]
-        self.response_buff = self.response_buff[self.CHUNK_SIZE:]
-        if chunk == '':
+        # write to the consumer until it pauses us, it is paused by the transport once its write buffer is full
+        while not self.production_paused and self.response_buff:
+            chunk = self.response_buff.popleft()
+            if len(chunk) > self.CHUNK_SIZE:
+                self.response_buff.appendleft(chunk[self.CHUNK_SIZE:])
+                chunk = chunk[:self.CHUNK_SIZE]
+            log.trace("writing %s bytes to the client", len(chunk))
+            self.consumer.write(chunk.tobytes())
+
+    def _pull_from_producer(self):
+        # the producer writes to us when asked to, ask it for more until we're paused or it has finished. writes
+        # made while asking are written out by this loop instead of asking again from inside the producer.
+        if self._pulling:
             return
-        log.trace("writing %s bytes to the client", len(chunk))
-        self.consumer.write(chunk)
-        reactor.callLater(0, self._produce_more)
+        self._pulling = True
+        try:
+            while self.producer is not None and not self.production_paused and not self.response_buff:
+                producer, queued = self.producer, self._bytes_queued
+                producer.resumeProducing()
+                if producer is self.producer and queued == self._bytes_queued:
+                    break
+        finally:
+            self._pulling = False
+
+    def _queue(self, data):
+        self.response_buff.append(memoryview(data))
+        self._bytes_queued += len(data)
 
     #IConsumer stuff
 
     def registerProducer(self, producer, streaming):
         self.producer = producer
         assert streaming is False
-        producer.resumeProducing()
+        self._pull_from_producer()
 
     def unregisterProducer(self):
         self.producer = None
 
     def write(self, data):
-
-        from twisted.internet import reactor
-
-        self.response_buff = self.response_buff + data
+        self._queue(data)
         self._produce_more()
-
-        def get_more_data():
-            if self.producer is not None:
-                log.trace("Requesting more data from the producer")
-                self.producer.resumeProducing()
-
-        reactor.callLater(0, get_more_data)
+        self._pull_from_producer()
 
     #From Protocol
 
     def data_received(self, data):
         log.debug("Received data")
         log.debug("%s", str(data))
-        if self.request_received is False:
-            return self._parse_data_and_maybe_send_blob(data)
-        else:
-            log.warning(
-                "The client sent data when we were uploading a file. This should not happen")
-
-    def _parse_data_and_maybe_send_blob(self, data):
-        self.request_buff = self.request_buff + data
-        msg = self.try_to_parse_request(self.request_buff)
-        if msg:
-            self.request_buff = ''
-            self._process_msg(msg)
-        else:
-            log.debug("Request buff not a valid json message")
-            log.debug("Request buff: %s", self.request_buff)
+        self.request_decoder.feed(data)
+        self._process_next_msg()
+
+    def _process_next_msg(self):
+        # requests are handled one at a time, in the order they arrived. a client pipelining blob requests sends the
+        # next one while a blob is being uploaded, it is handled once the upload has finished.
+        while self.request_received is False and not self.stopped:
+            msg = self.try_to_parse_request()
+            if msg is None:
+                log.debug("Waiting for the rest of the request, %i bytes buffered", len(self.request_decoder))
+                return
+            if msg:
+                self.request_received = True
+                self._process_msg(msg)
 
     def _process_msg(self, msg):
         d = self.handle_request(msg)
@@ -132,12 +142,13 @@ class ServerRequestHandler(object):
     def finished_response(self):
         self.request_received = False
         self._produce_more()
+        self._process_next_msg()
 
     def send_response(self, msg):
         m = json.dumps(msg)
         log.debug("Sending a response of length %s", str(len(m)))
         log.debug("Response: %s", str(m))
-        self.response_buff = self.response_buff + m
+        self._queue(m)
         self._produce_more()
         return True
 
@@ -178,9 +189,9 @@ class ServerRequestHandler(object):
         dl.addCallback(send_response)
         return dl
 
-    def try_to_parse_request(self, request_buff):
-        try:
-            msg = json.loads(request_buff)
-            return msg
-        except ValueError:
-            return None
+    def try_to_parse_request(self):
+        while True:
+            try:
+                return self.request_decoder.next_message()
+            except ValueError as err:
+                log.warning("Discarding invalid request: %s", err)
@@ -0,0 +1,160 @@
+import math
+import logging
+from collections import OrderedDict, deque
+from twisted.internet import defer
+from lbrynet.core import utils
+from lbrynet.core.Error import UploadSlotsBusyError
+
+log = logging.getLogger(__name__)
+
+
+class UploadSlot(object):
+    """An upload of a blob to a peer, holding one of the UploadScheduler's slots until it is released"""
+
+    def __init__(self, scheduler, peer, blob_hash):
+        self.scheduler = scheduler
+        self.peer = peer
+        self.blob_hash = blob_hash
+        self.started_at = utils.timestamp()
+        self.bytes_uploaded = 0
+        self.released = False
+
+    def report_bytes(self, num_bytes):
+        self.bytes_uploaded += num_bytes
+
+    @property
+    def seconds(self):
+        return utils.timestamp() - self.started_at
+
+    @property
+    def throughput(self):
+        """The bytes per second uploaded in the slot"""
+        return self.bytes_uploaded / max(self.seconds, 0.001)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class _QueuedRequest(object):
+    def __init__(self, peer, blob_hash, deferred):
+        self.peer = peer
+        self.blob_hash = blob_hash
+        self.deferred = deferred
+        self.timeout_call = None
+
+
+class UploadScheduler(object):
+    """
+    Limits the blobs being uploaded at once to a number of slots, queueing requests for a slot while they are all
+    in use
+
+    Waiting requests are served in turns between the hosts waiting, so that a client pipelining requests or making
+    several connections can't keep the others waiting. When the queue is full, or a request has waited longer than
+    QUEUE_TIMEOUT, the client is told to retry after about the time it takes for the slots to be free.
+    """
+
+    QUEUE_TIMEOUT = 10  # seconds, less than the time a client waits for a response before giving up
+    DEFAULT_UPLOAD_SECONDS = 2.0  # assumed until an upload has finished
+    UPLOAD_SECONDS_WEIGHT = 0.25  # the weight of a finished upload in the moving average of upload times
+    MIN_RETRY_IN = 1
+    MAX_RETRY_IN = 60
+
+    def __init__(self, max_slots, max_queued=0):
+        """
+        @param max_slots: the number of blobs that can be uploaded at once
+        @param max_queued: the number of requests that can wait for a slot, beyond which clients are told to retry
+        """
+        self.max_slots = max(max_slots, 1)
+        self.max_queued = max_queued
+        self.uploads_refused = 0
+        self._active = []  # [UploadSlot]
+        self._queues = OrderedDict()  # {host: deque([_QueuedRequest])}, in the order the hosts take turns
+        self._num_queued = 0
+        self._upload_seconds = self.DEFAULT_UPLOAD_SECONDS
+
+    def num_active(self):
+        return len(self._active)
+
+    def num_queued(self):
+        return self._num_queued
+
+    def retry_in(self):
+        """The seconds until a request made now would likely get a slot"""
+        seconds = self._upload_seconds * (self._num_queued // self.max_slots + 1)
+        return int(min(max(math.ceil(seconds), self.MIN_RETRY_IN), self.MAX_RETRY_IN))
+
+    def request_slot(self, peer, blob_hash):
+        """
+        Get a slot to upload a blob to a peer in
+
+        @return: Deferred firing with the UploadSlot, which has to be released when the upload has finished, or
+            failing with UploadSlotsBusyError if there's no slot free and the request can't wait for one. Cancel it
+            to stop waiting.
+        """
+        if len(self._active) < self.max_slots and not self._queues:
+            return defer.succeed(self._start(peer, blob_hash))
+        if self._num_queued >= self.max_queued:
+            return defer.fail(self._refuse(peer, blob_hash))
+        request = _QueuedRequest(peer, blob_hash, defer.Deferred(lambda _: self._dequeue(request)))
+        request.timeout_call = utils.call_later(self.QUEUE_TIMEOUT, self._time_out, request)
+        self._queues.setdefault(peer.host, deque()).append(request)
+        self._num_queued += 1
+        log.debug("Queued the upload of %s to %s, %i uploads are waiting", blob_hash[:16], peer, self._num_queued)
+        return request.deferred
+
+    def get_stats(self):
+        return {
+            'max_upload_slots': self.max_slots,
+            'active_uploads': [
+                {
+                    'peer': str(slot.peer),
+                    'blob_hash': slot.blob_hash,
+                    'bytes_uploaded': slot.bytes_uploaded,
+                    'throughput': slot.throughput,
+                } for slot in self._active
+            ],
+            'queued_uploads': self._num_queued,
+            'uploads_refused': self.uploads_refused,
+        }
+
+    def _start(self, peer, blob_hash):
+        slot = UploadSlot(self, peer, blob_hash)
+        self._active.append(slot)
+        return slot
+
+    def _refuse(self, peer, blob_hash):
+        self.uploads_refused += 1
+        retry_in = self.retry_in()
+        log.debug("Upload slots are busy, telling %s to retry %s in %i seconds", peer, blob_hash[:16], retry_in)
+        return UploadSlotsBusyError(retry_in)
+
+    def _dequeue(self, request):
+        queue = self._queues[request.peer.host]
+        queue.remove(request)
+        if not queue:
+            del self._queues[request.peer.host]
+        self._num_queued -= 1
+        if request.timeout_call.active():
+            request.timeout_call.cancel()
+
+    def _time_out(self, request):
+        self._dequeue(request)
+        request.deferred.errback(self._refuse(request.peer, request.blob_hash))
+
+    def _release(self, slot):
+        self._active.remove(slot)
+        seconds = slot.seconds
+        self._upload_seconds += self.UPLOAD_SECONDS_WEIGHT * (seconds - self._upload_seconds)
+        log.debug("Uploaded %i bytes of %s to %s in %f seconds, %i bytes/sec", slot.bytes_uploaded,
+                  slot.blob_hash[:16], slot.peer, seconds, slot.throughput)
+        while self._queues and len(self._active) < self.max_slots:
+            host, queue = self._queues.popitem(last=False)
+            request = queue.popleft()
+            if queue:
+                # the host waits for the others to take their turns before its next request
+                self._queues[host] = queue
+            self._num_queued -= 1
+            request.timeout_call.cancel()
+            request.deferred.callback(self._start(request.peer, request.blob_hash))
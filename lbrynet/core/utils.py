@@ -1,6 +1,7 @@
 import base64
 import datetime
 import random
+import time
 import socket
 import string
 import json
@@ -37,6 +38,10 @@ def today():
     return datetime.datetime.today()
 
 
+def timestamp():
+    return time.time()
+
+
 def timedelta(**kwargs):
     return datetime.timedelta(**kwargs)
 
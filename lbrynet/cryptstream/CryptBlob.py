@@ -1,8 +1,6 @@
 import binascii
 import logging
-from io import BytesIO
-from twisted.internet import defer
-from twisted.web.client import FileBodyProducer
+from twisted.internet import defer, threads
 from cryptography.hazmat.primitives.ciphers import Cipher, modes
 from cryptography.hazmat.primitives.ciphers.algorithms import AES
 from cryptography.hazmat.primitives.padding import PKCS7
@@ -31,6 +29,8 @@ class CryptBlobInfo(BlobInfo):
 
 
 class StreamBlobDecryptor(object):
+    CHUNK_SIZE = 2 ** 16  # the bytes read, decrypted and written at a time
+
     def __init__(self, blob, key, iv, length):
         """
         This class decrypts blob
@@ -45,7 +45,6 @@ class StreamBlobDecryptor(object):
         self.key = key
         self.iv = iv
         self.length = length
-        self.buff = b''
         self.len_read = 0
         cipher = Cipher(AES(self.key), modes.CBC(self.iv), backend=backend)
         self.unpadder = PKCS7(AES.block_size).unpadder()
@@ -55,49 +54,45 @@ class StreamBlobDecryptor(object):
         """
         Decrypt blob and write its content useing write_func
 
+        The blob is read, decrypted and written CHUNK_SIZE bytes at a time in a thread, so that neither the
+        decryption nor the writes hold up the reactor and only a chunk of the blob is in memory at once.
+
         write_func - function that takes decrypted string as
-            arugment and writes it somewhere
+            arugment and writes it somewhere, it is called from the thread
 
         Returns:
 
         deferred that returns after decrypting blob and writing content
         """
 
-        def remove_padding(data):
-            return self.unpadder.update(data) + self.unpadder.finalize()
-
-        def write_bytes():
-            if self.len_read < self.length:
-                num_bytes_to_decrypt = greatest_multiple(len(self.buff), (AES.block_size / 8))
-                data_to_decrypt, self.buff = split(self.buff, num_bytes_to_decrypt)
-                write_func(self.cipher.update(data_to_decrypt))
-
-        def finish_decrypt():
-            bytes_left = len(self.buff) % (AES.block_size / 8)
-            if bytes_left != 0:
-                log.warning(self.buff[-1 * (AES.block_size / 8):].encode('hex'))
-                raise Exception("blob %s has incorrect padding: %i bytes left" %
-                                (self.blob.blob_hash, bytes_left))
-            data_to_decrypt, self.buff = self.buff, b''
-            last_chunk = self.cipher.update(data_to_decrypt) + self.cipher.finalize()
-            write_func(remove_padding(last_chunk))
-
-
         read_handle = self.blob.open_for_reading()
 
-        @defer.inlineCallbacks
-        def decrypt_bytes():
-            producer = FileBodyProducer(read_handle)
-            buff = BytesIO()
-            yield producer.startProducing(buff)
-            self.buff = buff.getvalue()
-            self.len_read += len(self.buff)
-            write_bytes()
-            finish_decrypt()
-
-        d = decrypt_bytes()
+        def close_read_handle(result):
+            read_handle.close()
+            return result
+
+        d = threads.deferToThread(self._decrypt, read_handle, write_func)
+        d.addBoth(close_read_handle)
         return d
 
+    def _decrypt(self, read_handle, write_func):
+        while True:
+            data = read_handle.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            self.len_read += len(data)
+            # the unpadder holds back the last block until it is finalized
+            decrypted = self.unpadder.update(self.cipher.update(data))
+            if decrypted:
+                write_func(decrypted)
+        bytes_left = self.len_read % (AES.block_size / 8)
+        if bytes_left != 0:
+            raise Exception("blob %s has incorrect padding: %i bytes left" %
+                            (self.blob.blob_hash, bytes_left))
+        last_chunk = self.unpadder.update(self.cipher.finalize()) + self.unpadder.finalize()
+        if last_chunk:
+            write_func(last_chunk)
+
 
 class CryptStreamBlobMaker(object):
     def __init__(self, key, iv, blob_num, blob):
@@ -155,12 +150,3 @@ class CryptStreamBlobMaker(object):
         log.debug("called the finished_callback from CryptStreamBlobMaker.close")
         blob = CryptBlobInfo(blob_hash, self.blob_num, self.length, binascii.hexlify(self.iv))
         defer.returnValue(blob)
-
-
-def greatest_multiple(a, b):
-    """return the largest value `c`, that is a multiple of `b` and is <= `a`"""
-    return (a // b) * b
-
-
-def split(buff, cutoff):
-    return buff[:cutoff], buff[cutoff:]
@@ -4,8 +4,10 @@ from zope.interface import implements
 from lbrynet.interfaces import IStreamDownloader
 from lbrynet.core.client.BlobRequester import BlobRequester
 from lbrynet.core.client.ConnectionManager import ConnectionManager
+from lbrynet.core.client.ConnectionPool import get_shared_connection_pool
 from lbrynet.core.client.DownloadManager import DownloadManager
 from lbrynet.core.client.StreamProgressManager import FullStreamProgressManager
+from lbrynet.core.RateLimiter import PRIORITY_DOWNLOAD
 from lbrynet.cryptstream.client.CryptBlobHandler import CryptBlobHandler
 from twisted.internet import defer
 from twisted.python.failure import Failure
@@ -72,6 +74,8 @@ class CryptStreamDownloader(object):
         self.finished_deferred = None
         self.points_paid = 0.0
         self.blob_requester = None
+        # the priority class of the download in the rate limiter, set before the download is started
+        self.rate_limit_priority = PRIORITY_DOWNLOAD
 
     def __str__(self):
         return str(self.stream_name)
@@ -196,7 +200,8 @@ class CryptStreamDownloader(object):
     def _get_connection_manager(self, download_manager):
         return ConnectionManager(self, self.rate_limiter,
                                  self._get_primary_request_creators(download_manager),
-                                 self._get_secondary_request_creators(download_manager))
+                                 self._get_secondary_request_creators(download_manager),
+                                 get_shared_connection_pool(), self.rate_limit_priority)
 
     def _fire_completed_deferred(self, err=None):
         self.finished_deferred, d = None, self.finished_deferred
@@ -13,10 +13,12 @@ from lbrynet.core.utils import DeferredDict
 from lbrynet.core.PaymentRateManager import OnlyFreePaymentsManager
 from lbrynet.core.RateLimiter import RateLimiter
 from lbrynet.core.BlobManager import DiskBlobManager
+from lbrynet.core.PeerManager import PeerManager
 from lbrynet.core.StreamDescriptor import StreamDescriptorIdentifier, EncryptedFileStreamType
 from lbrynet.core.Wallet import LBRYumWallet
 from lbrynet.core.server.BlobRequestHandler import BlobRequestHandlerFactory
 from lbrynet.core.server.ServerProtocol import ServerProtocolFactory
+from lbrynet.core.server.UploadScheduler import UploadScheduler
 from lbrynet.daemon.Component import Component
 from lbrynet.daemon.ExchangeRateManager import ExchangeRateManager
 from lbrynet.database.storage import SQLiteStorage
@@ -110,7 +112,7 @@ class DatabaseComponent(Component):
 
     @staticmethod
     def get_current_db_revision():
-        return 9
+        return 10
 
     @staticmethod
     def get_revision_filename():
@@ -373,11 +375,12 @@ class BlobComponent(Component):
 
 class DHTComponent(Component):
     component_name = DHT_COMPONENT
-    depends_on = [UPNP_COMPONENT]
+    depends_on = [UPNP_COMPONENT, DATABASE_COMPONENT]
 
     def __init__(self, component_manager):
         Component.__init__(self, component_manager)
         self.dht_node = None
+        self.peer_manager = None
         self.upnp_component = None
         self.external_udp_port = None
         self.external_peer_port = None
@@ -400,13 +403,17 @@ class DHTComponent(Component):
         node_id = CS.get_node_id()
         if node_id is None:
             node_id = generate_id()
+        self.peer_manager = PeerManager(self.component_manager.get_component(DATABASE_COMPONENT))
+        yield self.peer_manager.start()
 
         self.dht_node = node.Node(
             node_id=node_id,
             udpPort=GCS('dht_node_port'),
             externalUDPPort=self.external_udp_port,
             externalIP=self.upnp_component.external_ip,
-            peerPort=self.external_peer_port
+            peerPort=self.external_peer_port,
+            peer_manager=self.peer_manager,
+            metrics=GCS('dht_metrics')
         )
 
         self.dht_node.start_listening()
@@ -419,6 +426,7 @@ class DHTComponent(Component):
     @defer.inlineCallbacks
     def stop(self):
         yield self.dht_node.stop()
+        yield self.peer_manager.stop()
 
 
 class HashAnnouncerComponent(Component):
@@ -462,6 +470,8 @@ class RateLimiterComponent(Component):
         return self.rate_limiter
 
     def start(self):
+        self.rate_limiter.set_dl_limit(GCS('max_download_rate'))
+        self.rate_limiter.set_ul_limit(GCS('max_upload_rate'))
         self.rate_limiter.start()
         return defer.succeed(None)
 
@@ -571,23 +581,29 @@ class PeerProtocolServerComponent(Component):
     def __init__(self, component_manager):
         Component.__init__(self, component_manager)
         self.lbry_server_port = None
+        self.upload_scheduler = None
 
     @property
     def component(self):
         return self.lbry_server_port
 
+    def get_status(self):
+        return {} if not self.upload_scheduler else self.upload_scheduler.get_stats()
+
     @defer.inlineCallbacks
     def start(self):
         wallet = self.component_manager.get_component(WALLET_COMPONENT)
         upnp = self.component_manager.get_component(UPNP_COMPONENT)
         peer_port = GCS('peer_port')
+        self.upload_scheduler = UploadScheduler(GCS('max_upload_slots'), GCS('max_queued_uploads'))
         query_handlers = {
             handler.get_primary_query_identifier(): handler for handler in [
                 BlobRequestHandlerFactory(
                     self.component_manager.get_component(BLOB_COMPONENT),
                     wallet,
                     self.component_manager.get_component(PAYMENT_RATE_COMPONENT),
-                    self.component_manager.analytics_manager
+                    self.component_manager.analytics_manager,
+                    self.upload_scheduler
                 ),
                 wallet.get_wallet_info_query_handler_factory(),
             ]
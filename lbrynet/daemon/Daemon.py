@@ -40,6 +40,7 @@ from lbrynet.core.Error import NullFundsError, NegativeFundsError
 from lbrynet.dht.error import TimeoutError
 from lbrynet.core.Peer import Peer
 from lbrynet.core.SinglePeerDownloader import SinglePeerDownloader
+from lbrynet.core.client.AvailabilityProbe import probe_peers
 from lbrynet.core.client.StandaloneBlobDownloader import StandaloneBlobDownloader
 
 log = logging.getLogger(__name__)
@@ -614,8 +615,8 @@ class Daemon(AuthJSONRPCServer):
         return downloader
 
     @defer.inlineCallbacks
-    def _blob_availability(self, blob_hash, search_timeout, blob_timeout, downloader=None):
-        if not downloader:
+    def _blob_availability(self, blob_hash, search_timeout, blob_timeout, downloader=None, full_download=False):
+        if not downloader and full_download:
             downloader = self._get_single_peer_downloader()
         result = {}
         search_timeout = search_timeout or conf.settings['peer_search_timeout']
@@ -628,15 +629,17 @@ class Daemon(AuthJSONRPCServer):
             peer_infos = [{"peer": Peer(x[0], x[1]),
                            "blob_hash": blob_hash,
                            "timeout": blob_timeout} for x in peers if x[2]]
-            dl = []
-            dl_peers = []
+            dl_peers = ["%s:%i" % (peer_info['peer'].host, peer_info['peer'].port) for peer_info in peer_infos]
             dl_results = []
-            for peer_info in peer_infos:
-                d = downloader.download_temp_blob_from_peer(**peer_info)
-                dl.append(d)
-                dl_peers.append("%s:%i" % (peer_info['peer'].host, peer_info['peer'].port))
-            for dl_peer, (success, download_result) in zip(dl_peers,
-                                                           (yield defer.DeferredList(dl))):
+            if full_download:
+                dl = [downloader.download_temp_blob_from_peer(**peer_info) for peer_info in peer_infos]
+                results = yield defer.DeferredList(dl)
+            else:
+                # only ask the peers whether they have the blob, sharing the timeout between them
+                available = yield probe_peers([peer_info['peer'] for peer_info in peer_infos], [blob_hash],
+                                              blob_timeout)
+                results = [(True, bool(available[peer_info['peer']])) for peer_info in peer_infos]
+            for dl_peer, (success, download_result) in zip(dl_peers, results):
                 if success:
                     if download_result:
                         reachable_peers.append(dl_peer)
@@ -720,6 +723,16 @@ class Daemon(AuthJSONRPCServer):
                 },
                 'file_manager': {
                     'managed_files': (int) count of files in the file manager,
+                },
+                'peer_protocol_server': {
+                    'max_upload_slots': (int) number of blobs that can be uploaded at once,
+                    'active_uploads': (list) the uploads in progress, each a dict of
+                        'peer': (str) host and port of the peer the blob is uploaded to,
+                        'blob_hash': (str) hash of the blob,
+                        'bytes_uploaded': (int) bytes of the blob uploaded so far,
+                        'throughput': (float) bytes per second uploaded in the slot,
+                    'queued_uploads': (int) number of requests waiting for an upload slot,
+                    'uploads_refused': (int) number of requests told to retry because the slots were busy,
                 }
             }
         """
@@ -831,6 +844,8 @@ class Daemon(AuthJSONRPCServer):
                          [--peer_search_timeout=<peer_search_timeout>]
                          [--sd_download_timeout=<sd_download_timeout>]
                          [--auto_renew_claim_height_delta=<auto_renew_claim_height_delta>]
+                         [--max_download_rate=<max_download_rate>]
+                         [--max_upload_rate=<max_upload_rate>]
 
         Options:
             --download_directory=<download_directory>  : (str) path of download directory
@@ -857,6 +872,10 @@ class Daemon(AuthJSONRPCServer):
                 claims set to expire within this many blocks will be
                 automatically renewed after startup (if set to 0, renews
                 will not be made automatically)
+            --max_download_rate=<max_download_rate>  : (int) 0
+                bytes per second that can be downloaded from peers, 0 for no limit
+            --max_upload_rate=<max_upload_rate>  : (int) 0
+                bytes per second that can be uploaded to peers, 0 for no limit
 
 
         Returns:
@@ -880,9 +899,15 @@ class Daemon(AuthJSONRPCServer):
             'disable_max_key_fee': bool,
             'peer_search_timeout': int,
             'sd_download_timeout': int,
-            'auto_renew_claim_height_delta': int
+            'auto_renew_claim_height_delta': int,
+            'max_download_rate': int,
+            'max_upload_rate': int,
         }
 
+        for key in ('max_download_rate', 'max_upload_rate'):
+            if key in new_settings and int(new_settings[key]) < 0:
+                raise ValueError("%s can't be negative" % key)
+
         for key, setting_type in setting_types.iteritems():
             if key in new_settings:
                 if isinstance(new_settings[key], setting_type):
@@ -897,6 +922,9 @@ class Daemon(AuthJSONRPCServer):
                     conf.settings.update({key: converted},
                                          data_types=(conf.TYPE_RUNTIME, conf.TYPE_PERSISTED))
         conf.settings.save_conf_file_settings()
+        if self.rate_limiter is not None:
+            self.rate_limiter.set_dl_limit(conf.settings['max_download_rate'])
+            self.rate_limiter.set_ul_limit(conf.settings['max_upload_rate'])
         return self._render_response(conf.settings.get_adjustable_settings_dict())
 
     def jsonrpc_help(self, command=None):
@@ -2939,21 +2967,98 @@ class Daemon(AuthJSONRPCServer):
         result['node_id'] = self.dht_node.node_id.encode('hex')
         return self._render_response(result)
 
-    # the single peer downloader needs wallet access
+    @requires(DHT_COMPONENT)
+    def jsonrpc_dht_stats(self):
+        """
+        Get DHT node statistics, rpc and lookup metrics are only recorded if the dht_metrics setting is enabled
+
+        Usage:
+            dht_stats
+
+        Options:
+            None
+
+        Returns:
+            (dict) dictionary containing the state of the node and its metrics
+            {
+                "contacts": (int) contacts in the routing table,
+                "knownContacts": (int) contacts tracked by the node,
+                "pendingRPCs": (int) requests waiting for a response,
+                "storedBlobs": (int) blob hashes stored for other peers,
+                "droppedRequests": (dict) requests dropped by the rate limiter, by method,
+                "droppedDatagrams": (dict) datagrams of multi-datagram messages dropped, by reason,
+                "pingQueue": {
+                    "queued": (int) contacts waiting to be pinged,
+                    "inFlight": (int) pings waiting for a response,
+                    "pinged": (int) pings sent,
+                    "timeouts": (int) pings that timed out,
+                    "latencyMedian": (float) median round trip time of the last 100 pings
+                },
+                "metrics": (dict) null if dht_metrics is disabled, otherwise
+                {
+                    "since": (float) time the metrics were started,
+                    "rpcsSent": (dict) requests sent, by method,
+                    "rpcsReceived": (dict) requests received, by method,
+                    "timeouts": (dict) requests that timed out, by method,
+                    "remoteErrors": (dict) requests that returned an error, by method,
+                    "rtt": (dict) round trip time histogram of each method
+                    {
+                        <method>: {
+                            "buckets": (list) [upper bound in seconds, count] pairs,
+                            "count": (int) responses,
+                            "mean": (float) mean round trip time
+                        }
+                    },
+                    "datagramsSent": (int),
+                    "datagramsReceived": (int),
+                    "bytesSent": (int),
+                    "bytesReceived": (int),
+                    "fragmentsSent": (int) datagrams sent as part of a multi-datagram message,
+                    "fragmentsReceived": (int) datagrams received as part of a multi-datagram message,
+                    "invalidDatagrams": (int) datagrams that couldn't be decoded,
+                    "lookups": (dict) iterative lookups, by rpc
+                    {
+                        <findNode or findValue>: {
+                            "count": (int) lookups,
+                            "hops": (dict) lookups by the number of hops to the result,
+                            "contacted": (dict) histogram of the contacts queried per lookup
+                        }
+                    },
+                    "lookupTraces": (list) the last 100 lookups
+                    [
+                        {
+                            "rpc": (str) findNode or findValue,
+                            "key": (str) the key looked up,
+                            "started": (float) time the lookup started,
+                            "duration": (float) seconds the lookup took,
+                            "hops": (int) hops to the result,
+                            "contacted": (int) contacts queried,
+                            "found": (int) contacts or peers found
+                        }
+                    ]
+                }
+            }
+        """
+
+        return self._render_response(self.dht_node.get_stats())
+
+    # the single peer downloader used by --full_download needs wallet access
     @requires(DHT_COMPONENT, WALLET_COMPONENT, conditions=[WALLET_IS_UNLOCKED])
-    def jsonrpc_blob_availability(self, blob_hash, search_timeout=None, blob_timeout=None):
+    def jsonrpc_blob_availability(self, blob_hash, search_timeout=None, blob_timeout=None, full_download=False):
         """
         Get blob availability
 
         Usage:
             blob_availability (<blob_hash>) [<search_timeout> | --search_timeout=<search_timeout>]
-                              [<blob_timeout> | --blob_timeout=<blob_timeout>]
+                              [<blob_timeout> | --blob_timeout=<blob_timeout>] [--full_download]
 
         Options:
             --blob_hash=<blob_hash>           : (str) check availability for this blob hash
             --search_timeout=<search_timeout> : (int) how long to search for peers for the blob
                                                 in the dht
-            --blob_timeout=<blob_timeout>     : (int) how long to try downloading from a peer
+            --blob_timeout=<blob_timeout>     : (int) how long to wait for the peers to answer
+            --full_download                   : (bool) download the blob from each peer instead of
+                                                asking the peers if they have it
 
         Returns:
             (dict) {
@@ -2963,7 +3068,7 @@ class Daemon(AuthJSONRPCServer):
             }
         """
 
-        return self._blob_availability(blob_hash, search_timeout, blob_timeout)
+        return self._blob_availability(blob_hash, search_timeout, blob_timeout, full_download=full_download)
 
     @requires(UPNP_COMPONENT, WALLET_COMPONENT, DHT_COMPONENT, conditions=[WALLET_IS_UNLOCKED])
     @AuthJSONRPCServer.deprecated("stream_availability")
@@ -2988,20 +3093,22 @@ class Daemon(AuthJSONRPCServer):
 
     @requires(UPNP_COMPONENT, WALLET_COMPONENT, DHT_COMPONENT, conditions=[WALLET_IS_UNLOCKED])
     @defer.inlineCallbacks
-    def jsonrpc_stream_availability(self, uri, search_timeout=None, blob_timeout=None):
+    def jsonrpc_stream_availability(self, uri, search_timeout=None, blob_timeout=None, full_download=False):
         """
         Get stream availability for lbry uri
 
         Usage:
             stream_availability (<uri> | --uri=<uri>)
                                 [<search_timeout> | --search_timeout=<search_timeout>]
-                                [<blob_timeout> | --blob_timeout=<blob_timeout>]
+                                [<blob_timeout> | --blob_timeout=<blob_timeout>] [--full_download]
 
         Options:
             --uri=<uri>                       : (str) check availability for this uri
             --search_timeout=<search_timeout> : (int) how long to search for peers for the blob
                                                 in the dht
-            --blob_timeout=<blob_timeout>   : (int) how long to try downloading from a peer
+            --blob_timeout=<blob_timeout>   : (int) how long to wait for the peers to answer
+            --full_download                   : (bool) download the sd and head blobs from each peer
+                                                instead of asking the peers if they have them
 
         Returns:
             (dict) {
@@ -3063,7 +3170,7 @@ class Daemon(AuthJSONRPCServer):
         sd_hash = claim_obj.source_hash
         response['sd_hash'] = sd_hash
         head_blob_hash = None
-        downloader = self._get_single_peer_downloader()
+        downloader = self._get_single_peer_downloader() if full_download else None
         have_sd_blob = sd_hash in self.blob_manager.blobs
         try:
             sd_blob = yield self.jsonrpc_blob_get(sd_hash, timeout=blob_timeout,
@@ -3076,7 +3183,8 @@ class Daemon(AuthJSONRPCServer):
                 head_blob_availability = yield self._blob_availability(head_blob_hash,
                                                                        search_timeout,
                                                                        blob_timeout,
-                                                                       downloader)
+                                                                       downloader,
+                                                                       full_download)
                 response['head_blob_availability'] = head_blob_availability
         except Exception as err:
             response['error'] = err
@@ -3084,7 +3192,8 @@ class Daemon(AuthJSONRPCServer):
         response['sd_blob_availability'] = yield self._blob_availability(sd_hash,
                                                                          search_timeout,
                                                                          blob_timeout,
-                                                                         downloader)
+                                                                         downloader,
+                                                                         full_download)
         response['is_available'] = response['sd_blob_availability'].get('is_available') and \
                                    response['head_blob_availability'].get('is_available')
         defer.returnValue(response)
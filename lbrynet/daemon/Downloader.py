@@ -9,6 +9,7 @@ from lbrynet.core.Error import InsufficientFundsError, KeyFeeAboveMaxAllowed, In
 from lbrynet.core.Error import DownloadDataTimeout, DownloadCanceledError, DownloadSDTimeout
 from lbrynet.core.utils import safe_start_looping_call, safe_stop_looping_call
 from lbrynet.core.StreamDescriptor import download_sd_blob
+from lbrynet.core.RateLimiter import PRIORITY_STREAMING
 from lbrynet.file_manager.EncryptedFileDownloader import ManagedEncryptedFileDownloaderFactory
 from lbrynet import conf
 
@@ -186,6 +187,8 @@ class GetStream(object):
     @defer.inlineCallbacks
     def _download(self, sd_blob, name, key_fee, txid, nout, file_name=None):
         self.downloader = yield self._create_downloader(sd_blob, file_name=file_name)
+        # the stream was asked for to be watched, it goes before downloads resumed in the background
+        self.downloader.rate_limit_priority = PRIORITY_STREAMING
         yield self.pay_key_fee(key_fee, name)
         yield self.storage.save_content_claim(self.downloader.stream_hash, "%s:%i" % (txid, nout))
         log.info("Downloading lbry://%s (%s) --> %s", name, self.sd_hash[:6], self.download_path)
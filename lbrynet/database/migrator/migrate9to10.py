@@ -0,0 +1,25 @@
+import sqlite3
+import os
+
+
+def do_migration(db_dir):
+    db_path = os.path.join(db_dir, "lbrynet.sqlite")
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+
+    cursor.executescript(
+        """
+        create table if not exists peer_reputation (
+            host text not null,
+            port integer not null,
+            throughput real,
+            time_to_first_byte real,
+            blob_downloads integer not null,
+            failures integer not null,
+            last_seen integer,
+            primary key (host, port)
+        );
+        """
+    )
+    connection.commit()
+    connection.close()
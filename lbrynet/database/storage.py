@@ -164,6 +164,17 @@ class SQLiteStorage(object):
                 timestamp integer,
                 primary key (sd_hash, reflector_address)
             );
+
+            create table if not exists peer_reputation (
+                host text not null,
+                port integer not null,
+                throughput real,
+                time_to_first_byte real,
+                blob_downloads integer not null,
+                failures integer not null,
+                last_seen integer,
+                primary key (host, port)
+            );
     """
 
     def __init__(self, db_dir, reactor=None):
@@ -856,6 +867,30 @@ class SQLiteStorage(object):
             self.clock.seconds() - conf.settings['auto_re_reflect_interval']
         )
 
+    # # # # # # # # # peer reputation functions # # # # # # # # #
+
+    def save_peer_reputations(self, reputations):
+        """
+        :param reputations: [(host, port, throughput, time_to_first_byte, blob_downloads, failures, last_seen)]
+        """
+        def _save_peer_reputations(transaction):
+            transaction.executemany(
+                "insert or replace into peer_reputation values (?, ?, ?, ?, ?, ?, ?)", reputations
+            )
+        return self.db.runInteraction(_save_peer_reputations)
+
+    def get_peer_reputations(self, seen_since):
+        """
+        Delete the reputations of peers not seen since seen_since and return the rest
+
+        :return: [(host, port, throughput, time_to_first_byte, blob_downloads, failures, last_seen)]
+        """
+        def _get_peer_reputations(transaction):
+            transaction.execute("delete from peer_reputation where last_seen is null or last_seen<?", (seen_since,))
+            return transaction.execute("select host, port, throughput, time_to_first_byte, blob_downloads, "
+                                       "failures, last_seen from peer_reputation").fetchall()
+        return self.db.runInteraction(_get_peer_reputations)
+
 
 # Helper functions
 def _format_claim_response(outpoint, claim_id, name, amount, height, serialized, channel_id, address, claim_sequence):
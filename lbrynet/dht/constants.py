@@ -27,12 +27,17 @@ replacementCacheSize = 8
 #: Timeout for network operations (in seconds)
 rpcTimeout = 5
 
+#: Bounds for the timeouts derived from the measured round trip times of a contact (in seconds)
+rpcTimeoutFloor = 1
+rpcTimeoutCeiling = rpcTimeout
+
 # number of rpc attempts to make before a timeout results in the node being removed as a contact
 rpcAttempts = 5
 # time window to count failures (in seconds)
 rpcAttemptsPruningTimeWindow = 600
 
-# Delay between iterations of iterative node lookups (for loose parallelism)  (in seconds)
+# Maximum delay between iterations of iterative node lookups (for loose parallelism)  (in seconds), the actual
+# delay depends on the number of outstanding probes and the round trip times of the contacts they were sent to
 iterativeLookupDelay = rpcTimeout / 2
 
 #: If a k-bucket has not been used for this amount of time, refresh it (in seconds)
@@ -50,12 +55,51 @@ tokenSecretChangeInterval = 300  # 5 minutes
 #: The interval for the node to check whether any buckets need refreshing
 checkRefreshInterval = refreshTimeout / 5
 
+#: Maximum number of lookups to run at once when refreshing k-buckets
+maxConcurrentRefreshLookups = alpha
+
 #: Max size of a single UDP datagram, in bytes. If a message is larger than this, it will
 #: be spread across several UDP packets.
 udpDatagramMaxSize = 8192  # 8 KB
 
+#: Maximum number of datagrams a single message may be spread over
+maxMessageFragments = 32
+
+#: Time to wait for the next datagram of a partially received message (in seconds)
+reassemblyTimeout = rpcTimeout
+
+#: Time after the first datagram of a message arrived after which arriving datagrams stop extending its
+#: reassembly timeout (in seconds)
+maxReassemblyTime = 6 * reassemblyTimeout
+
+#: Maximum number of bytes of partially received messages to hold at once
+reassemblyBufferSize = 2 * 1024 * 1024  # 2 MB
+
+#: Maximum number of partially received messages to hold from a single IP address
+maxPartialMessagesPerAddress = 8
+
+#: Sustained rate and burst size of requests handled from a single IP address and port (requests per second,
+#: requests)
+rpcRatePerAddress = 20
+rpcBurstPerAddress = 100
+
+#: Sustained rate and burst size of requests handled from all addresses together (requests per second, requests)
+rpcRate = 1000
+rpcBurst = 2000
+
+#: Fraction of the global request budget that has to be left for a request to be handled, when the node is
+#: overloaded requests are dropped in this order: store, findValue, findNode, ping
+rpcLoadSheddingThresholds = {
+    'store': 0.5,
+    'findValue': 0.25,
+    'findNode': 0.1,
+    'ping': 0.0
+}
+
 key_bits = 384
 
 rpc_id_length = 20
 
-protocolVersion = 1
+#: Version 1 passes the protocol version with every request and findValue response, version 2 adds the binary
+#: message format (see msgformat.BinaryFormat)
+protocolVersion = 2
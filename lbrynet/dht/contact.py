@@ -10,6 +10,13 @@ def is_valid_ipv4(address):
         return False
 
 
+def _rpc_method(name):
+    def _sendRPC(self, *args):
+        return self._networkProtocol.sendRPC(self, name, args)
+    _sendRPC.__name__ = name
+    return _sendRPC
+
+
 class _Contact(object):
     """ Encapsulation for remote contact
 
@@ -17,6 +24,9 @@ class _Contact(object):
     provides a direct RPC API to the remote node which it represents
     """
 
+    __slots__ = ('_contactManager', '_id', 'int_id', 'address', 'port', '_networkProtocol', 'commTime', 'getTime',
+                 'lastReplied', 'lastRequested', 'protocolVersion', '_token', 'rtt', 'rttVariance')
+
     def __init__(self, contactManager, id, ipAddress, udpPort, networkProtocol, firstComm):
         if id is not None:
             if not len(id) == constants.key_bits / 8:
@@ -27,6 +37,8 @@ class _Contact(object):
             raise ValueError("invalid ip address")
         self._contactManager = contactManager
         self._id = id
+        # the node id as a number, to calculate distances with
+        self.int_id = None if id is None else long(id.encode('hex'), 16)
         self.address = ipAddress
         self.port = udpPort
         self._networkProtocol = networkProtocol
@@ -36,6 +48,9 @@ class _Contact(object):
         self.lastRequested = None
         self.protocolVersion = 0
         self._token = (None, 0)  # token, timestamp
+        # smoothed round trip time and its variance (in seconds), None until the contact has replied
+        self.rtt = None
+        self.rttVariance = None
 
     def update_token(self, token):
         self._token = token, self.getTime()
@@ -65,7 +80,8 @@ class _Contact(object):
 
     @property
     def lastFailed(self):
-        return self._contactManager._rpc_failures.get((self.address, self.port), [None])[-1]
+        failures = self.failures
+        return failures[-1] if failures else None
 
     @property
     def failures(self):
@@ -117,7 +133,9 @@ class _Contact(object):
 
     def set_id(self, id):
         if not self._id:
+            self._contactManager._update_contact_id(self, id)
             self._id = id
+            self.int_id = long(id.encode('hex'), 16)
 
     def update_last_replied(self):
         self.lastReplied = int(self.getTime())
@@ -128,7 +146,36 @@ class _Contact(object):
     def update_last_failed(self):
         failures = self._contactManager._rpc_failures.get((self.address, self.port), [])
         failures.append(self.getTime())
+        # more failures than this are never needed to tell if the contact is ignored or bad
+        del failures[:-(constants.rpcAttempts + 1)]
         self._contactManager._rpc_failures[(self.address, self.port)] = failures
+        # back off to the default timeout until the contact replies again
+        self.rtt = None
+        self.rttVariance = None
+
+    def update_rtt(self, sample):
+        """
+        Update the smoothed round trip time and its variance with a new measurement, as done for TCP (RFC 6298)
+
+        @param sample: the time between sending a request to the contact and receiving its reply (in seconds)
+        @type sample: float
+        """
+        if self.rtt is None:
+            self.rtt = sample
+            self.rttVariance = sample / 2.0
+        else:
+            self.rttVariance = 0.75 * self.rttVariance + 0.25 * abs(self.rtt - sample)
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+
+    @property
+    def rpcTimeout(self):
+        """
+        Time to wait for a reply from this contact before considering the request to have timed out (in seconds)
+        """
+        if self.rtt is None:
+            return constants.rpcTimeout
+        timeout = self.rtt + 4 * self.rttVariance
+        return min(max(timeout, constants.rpcTimeoutFloor), constants.rpcTimeoutCeiling)
 
     def update_protocol_version(self, version):
         self.protocolVersion = version
@@ -137,28 +184,17 @@ class _Contact(object):
         return '<%s.%s object; IP address: %s, UDP port: %d>' % (
             self.__module__, self.__class__.__name__, self.address, self.port)
 
-    def __getattr__(self, name):
-        """ This override allows the host node to call a method of the remote
-        node (i.e. this contact) as if it was a local function.
-
-        For instance, if C{remoteNode} is a instance of C{Contact}, the
-        following will result in C{remoteNode}'s C{test()} method to be
-        called with argument C{123}::
-         remoteNode.test(123)
-
-        Such a RPC method call will return a Deferred, which will callback
-        when the contact responds with the result (or an error occurs).
-        This happens via this contact's C{_networkProtocol} object (i.e. the
-        host Node's C{_protocol} object).
-        """
-
-        if name not in ['ping', 'findValue', 'findNode', 'store']:
-            raise AttributeError("unknown command: %s" % name)
-
-        def _sendRPC(*args, **kwargs):
-            return self._networkProtocol.sendRPC(self, name, args)
+    # The RPC methods of the remote node, calling one of them returns a Deferred, which will callback when the
+    # contact responds with the result (or an error occurs). This happens via this contact's C{_networkProtocol}
+    # object (i.e. the host Node's C{_protocol} object).
+    ping = _rpc_method('ping')
+    findNode = _rpc_method('findNode')
+    findValue = _rpc_method('findValue')
+    store = _rpc_method('store')
 
-        return _sendRPC
+    def __getattr__(self, name):
+        """ Only the RPC methods above can be called on the remote node """
+        raise AttributeError("unknown command: %s" % name)
 
 
 class ContactManager(object):
@@ -171,9 +207,11 @@ class ContactManager(object):
         self._rpc_failures = {}
 
     def get_contact(self, id, address, port):
-        for contact in self._contacts.itervalues():
-            if contact.id == id and contact.address == address and contact.port == port:
-                return contact
+        return self._contacts.get((id, address, port))
+
+    def _update_contact_id(self, contact, id):
+        self._contacts.pop((contact.id, contact.address, contact.port), None)
+        self._contacts[(id, contact.address, contact.port)] = contact
 
     def make_contact(self, id, ipAddress, udpPort, networkProtocol, firstComm=0):
         ipAddress = str(ipAddress)
@@ -184,6 +222,37 @@ class ContactManager(object):
         self._contacts[(id, ipAddress, udpPort)] = contact
         return contact
 
+    def __len__(self):
+        return len(self._contacts)
+
+    def prune(self, in_use):
+        """
+        Forget the contacts that aren't in use and haven't been interacted with recently, and the failures of
+        addresses that are too old to matter
+
+        @param in_use: contacts to keep regardless, for instance the ones in the routing table, storing values in
+                       the datastore or waiting on an rpc
+        @type in_use: iterable of contacts
+
+        @return: the number of contacts forgotten
+        @rtype: int
+        """
+        now = self._get_time()
+        in_use = {id(contact) for contact in in_use}
+        keep_after = now - constants.checkRefreshInterval
+        pruned = [
+            key for key, contact in self._contacts.iteritems()
+            if id(contact) not in in_use and max(contact.commTime, contact.lastInteracted) < keep_after
+        ]
+        for key in pruned:
+            del self._contacts[key]
+        known_addresses = {(address, port) for (_, address, port) in self._contacts}
+        failures_after = now - constants.rpcAttemptsPruningTimeWindow
+        for address in [address for address, failures in self._rpc_failures.iteritems()
+                        if address not in known_addresses and (not failures or failures[-1] < failures_after)]:
+            del self._rpc_failures[address]
+        return len(pruned)
+
     def is_ignored(self, origin_tuple):
         failed_rpc_count = len(self._prune_failures(origin_tuple))
         return failed_rpc_count > constants.rpcAttempts
@@ -192,5 +261,8 @@ class ContactManager(object):
         # Prunes recorded failures to the last time window of attempts
         pruning_limit = self._get_time() - constants.rpcAttemptsPruningTimeWindow
         pruned = list(filter(lambda t: t >= pruning_limit, self._rpc_failures.get(origin_tuple, [])))
-        self._rpc_failures[origin_tuple] = pruned
+        if pruned:
+            self._rpc_failures[origin_tuple] = pruned
+        else:
+            self._rpc_failures.pop(origin_tuple, None)
         return pruned
@@ -23,5 +23,5 @@ class Distance(object):
         return self(a) < self(b)
 
     def to_contact(self, contact):
-        """A convenience function for calculating the distance to a contact"""
-        return self(contact.id)
+        """A convenience function for calculating the distance to a contact, using its precomputed integer id"""
+        return self.val_key_one ^ contact.int_id
@@ -1,5 +1,9 @@
+import bisect
+import heapq
+import itertools
 import logging
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from distance import Distance
 from error import TimeoutError
 import constants
@@ -35,23 +39,35 @@ class _IterativeFind(object):
         # The closest known and active node yet found
         self.closest_node = None if not shortlist else shortlist[0]
         self.prev_closest_node = None
-        # Shortlist of contact objects (the k closest known contacts to the key from the routing table)
-        self.shortlist = shortlist
         # The search key
         self.key = str(key)
         # The rpc method name (findValue or findNode)
         self.rpc = rpc
-        # List of active queries; len() indicates number of active probes
-        self.active_probes = []
-        # List of contact (address, port) tuples that have already been queried, includes contacts that didn't reply
-        self.already_contacted = []
-        # A list of found and known-to-be-active remote nodes (Contact objects)
-        self.active_contacts = []
+        # Active queries and the contacts they were sent to; len() indicates number of active probes
+        self.active_probes = {}
+        # Set of contact (address, port) tuples that have already been queried, includes contacts that didn't reply
+        self.already_contacted = set()
+        # Found and known-to-be-active remote nodes (Contact objects) by (address, port)
+        self.active_contacts = {}
+        # The active contacts as (distance, contact) tuples, sorted from closest to furthest
+        self._active_by_distance = []
+        # Distance to the key of every contact that has been added to the shortlist, by (address, port)
+        self._distances = {}
+        # Heap of (distance, insertion count, contact) tuples for contacts that haven't been queried yet
+        self.shortlist = []
+        self._shortlist_count = itertools.count()
+        # Number of hops from us to every contact added to the shortlist, by (address, port)
+        self._hops = {}
+        # Hops to the closest contact found, or to the contact that returned the value
+        self.hops = 0
         # Ensure only one searchIteration call is running at a time
         self._search_iteration_semaphore = defer.DeferredSemaphore(1)
         self._iteration_count = 0
         self.find_value_result = {}
         self.pending_iteration_calls = []
+        self.finished_deferred.addBoth(self._cancel_pending_iterations)
+        for contact in shortlist:
+            self.addToShortlist(contact)
 
     @property
     def is_find_node_request(self):
@@ -76,25 +92,29 @@ class _IterativeFind(object):
                 raise ValueError("invalid contact triple")
         return contact_triples
 
-    def sortByDistance(self, contact_list):
-        """Sort the list of contacts in order by distance from key"""
-        contact_list.sort(key=lambda c: self.distance(c.id))
+    def addToShortlist(self, contact, hops=1):
+        """Add a contact to the shortlist unless it has been added before"""
+        address = (contact.address, contact.port)
+        if address in self._distances:
+            return
+        distance = self.distance.to_contact(contact)
+        self._distances[address] = distance
+        self._hops[address] = hops
+        heapq.heappush(self.shortlist, (distance, next(self._shortlist_count), contact))
 
-    @defer.inlineCallbacks
     def extendShortlist(self, contact, result):
         # The "raw response" tuple contains the response message and the originating address info
         originAddress = (contact.address, contact.port)
         if self.finished_deferred.called:
-            defer.returnValue(contact.id)
+            return contact.id
         if self.node.contact_manager.is_ignored(originAddress):
             raise ValueError("contact is ignored")
         if contact.id == self.node.node_id:
-            defer.returnValue(contact.id)
+            return contact.id
 
-        if contact not in self.active_contacts:
-            self.active_contacts.append(contact)
-        if contact not in self.shortlist:
-            self.shortlist.append(contact)
+        if originAddress not in self.active_contacts:
+            self.active_contacts[originAddress] = contact
+            bisect.insort(self._active_by_distance, (self._distances[originAddress], contact))
 
         # Now grow extend the (unverified) shortlist with the returned contacts
         # TODO: some validation on the result (for guarding against attacks)
@@ -107,6 +127,7 @@ class _IterativeFind(object):
                 if (host, port) not in self.exclude:
                     self.find_value_result.setdefault(self.key, []).append(peer)
             if self.find_value_result:
+                self.hops = self._hops[originAddress]
                 self.finished_deferred.callback(self.find_value_result)
         else:
             if self.is_find_value_request:
@@ -119,22 +140,18 @@ class _IterativeFind(object):
                 else:
                     self.find_value_result['closestNodeNoValue'] = contact
             contactTriples = self.getContactTriples(result)
-            for contactTriple in contactTriples:
-                if (contactTriple[1], contactTriple[2]) in ((c.address, c.port) for c in self.already_contacted):
+            for node_id, address, port in contactTriples:
+                if (address, port) in self._distances or node_id == self.node.node_id:
                     continue
-                elif self.node.contact_manager.is_ignored((contactTriple[1], contactTriple[2])):
+                elif self.node.contact_manager.is_ignored((address, port)):
                     continue
                 else:
-                    found_contact = self.node.contact_manager.make_contact(contactTriple[0], contactTriple[1],
-                                                                           contactTriple[2], self.node._protocol)
-                    if found_contact not in self.shortlist:
-                        self.shortlist.append(found_contact)
-
-            if not self.finished_deferred.called and self.should_stop():
-                self.sortByDistance(self.active_contacts)
-                self.finished_deferred.callback(self.active_contacts[:min(constants.k, len(self.active_contacts))])
+                    self.addToShortlist(
+                        self.node.contact_manager.make_contact(node_id, address, port, self.node._protocol),
+                        self._hops[originAddress] + 1
+                    )
 
-        defer.returnValue(contact.id)
+        return contact.id
 
     @defer.inlineCallbacks
     def probeContact(self, contact):
@@ -146,7 +163,24 @@ class _IterativeFind(object):
         except (TimeoutError, defer.CancelledError, ValueError, IndexError):
             defer.returnValue(contact.id)
 
+    def closest_have_replied(self):
+        """
+        Returns True once the k closest contacts known so far have all replied, at that point the lookup can't
+        improve anymore
+        """
+        if len(self._active_by_distance) < constants.k:
+            return False
+        kth_closest_distance = self._active_by_distance[constants.k - 1][0]
+        if self.shortlist and self.shortlist[0][0] < kth_closest_distance:
+            return False
+        for contact in self.active_probes.itervalues():
+            if self._distances[(contact.address, contact.port)] < kth_closest_distance:
+                return False
+        return True
+
     def should_stop(self):
+        if self.closest_have_replied():
+            return True
         if self.is_find_value_request:
             # search stops when it finds a value, let it run
             return False
@@ -154,78 +188,106 @@ class _IterativeFind(object):
                                                                                     self.closest_node.id):
             # we're getting further away
             return True
-        if len(self.active_contacts) >= constants.k:
-            # we have enough results
-            return True
         return False
 
+    def finish(self):
+        if self._active_by_distance:
+            closest = self._active_by_distance[0][1]
+            self.hops = self._hops[(closest.address, closest.port)]
+        if self.is_find_value_request:
+            self.finished_deferred.callback(self.find_value_result)
+        else:
+            self.finished_deferred.callback([contact for _, contact in self._active_by_distance[:constants.k]])
+
     # Send parallel, asynchronous FIND_NODE RPCs to the shortlist of contacts
     def _searchIteration(self):
-        # Sort the discovered active nodes from closest to furthest
-        if len(self.active_contacts):
-            self.sortByDistance(self.active_contacts)
+        if self.finished_deferred.called:
+            return
+        if self._active_by_distance:
             self.prev_closest_node = self.closest_node
-            self.closest_node = self.active_contacts[0]
+            self.closest_node = self._active_by_distance[0][1]
 
-        # Sort the current shortList before contacting other nodes
-        self.sortByDistance(self.shortlist)
-        probes = []
-        already_contacted_addresses = {(c.address, c.port) for c in self.already_contacted}
-        to_remove = []
-        for contact in self.shortlist:
+        # Take the alpha closest contacts that haven't been queried yet from the shortlist
+        candidates = []
+        while self.shortlist and len(candidates) < constants.alpha:
+            contact = heapq.heappop(self.shortlist)[2]
             if self.node.contact_manager.is_ignored((contact.address, contact.port)):
-                to_remove.append(contact)  # a contact became bad during iteration
-                continue
-            if (contact.address, contact.port) not in already_contacted_addresses:
-                self.already_contacted.append(contact)
-                to_remove.append(contact)
-                probe = self.probeContact(contact)
-                probes.append(probe)
-                self.active_probes.append(probe)
-            if len(probes) == constants.alpha:
-                break
-        for contact in to_remove:  # these contacts will be re-added to the shortlist when they reply successfully
-            self.shortlist.remove(contact)
-
-        # run the probes
-        if probes:
+                continue  # a contact became bad during iteration
+            candidates.append(contact)
+        # the distance decides which contacts are probed, round trip times only the order the probes are sent in,
+        # contacts that haven't replied to us yet are given the benefit of the doubt
+        candidates.sort(key=lambda c: c.rpcTimeout if c.rtt is not None else constants.rpcTimeoutFloor)
+        probes = []
+        for contact in candidates:
+            self.already_contacted.add((contact.address, contact.port))
+            probe = self.probeContact(contact)
+            probes.append(probe)
+            self.active_probes[probe] = contact
+            probe.addBoth(self._remove_probe, probe)
+
+        if self.finished_deferred.called:
+            return
+        elif probes:
             # Schedule the next iteration if there are any active
             # calls (Kademlia uses loose parallelism)
             self.searchIteration()
-
-            d = defer.DeferredList(probes, consumeErrors=True)
-
-            def _remove_probes(results):
-                for probe in probes:
-                    self.active_probes.remove(probe)
-                return results
-
-            d.addCallback(_remove_probes)
-
-        elif not self.finished_deferred.called and not self.active_probes or self.should_stop():
+        elif not self.active_probes or self.should_stop():
             # If no probes were sent, there will not be any improvement, so we're done
-            if self.is_find_value_request:
-                self.finished_deferred.callback(self.find_value_result)
-            else:
-                self.sortByDistance(self.active_contacts)
-                self.finished_deferred.callback(self.active_contacts[:min(constants.k, len(self.active_contacts))])
-        elif not self.finished_deferred.called:
+            self.finish()
+        else:
             # Force the next iteration
             self.searchIteration()
 
-    def searchIteration(self, delay=constants.iterativeLookupDelay):
-        def _cancel_pending_iterations(result):
-            while self.pending_iteration_calls:
-                canceller = self.pending_iteration_calls.pop()
-                canceller()
-            return result
-        self.finished_deferred.addBoth(_cancel_pending_iterations)
+    def _remove_probe(self, result, probe):
+        contact = self.active_probes.pop(probe)
+        if isinstance(result, Failure):
+            # the remote node answered with an error, or with something that couldn't be handled
+            log.debug("%s probe of %s failed: %s", self.rpc, contact.log_id(), result.getErrorMessage())
+            result = contact.id
+        if not self.finished_deferred.called and self.should_stop():
+            self.finish()
+        return result
+
+    def _iteration_delay(self):
+        """
+        Delay before the next iteration, shorter when fewer probes are outstanding or when the contacts they were
+        sent to are known to reply quickly
+        """
+        if not self.active_probes:
+            return 0
+        fastest = min(contact.rpcTimeout for contact in self.active_probes.itervalues())
+        outstanding = min(len(self.active_probes), constants.alpha)
+        return min(fastest / 2.0, constants.iterativeLookupDelay) * outstanding / float(constants.alpha)
+
+    def _cancel_pending_iterations(self, result):
+        while self.pending_iteration_calls:
+            canceller = self.pending_iteration_calls.pop()
+            canceller()
+        return result
+
+    def searchIteration(self, delay=None):
+        if self.finished_deferred.called:
+            return
+        if delay is None:
+            delay = self._iteration_delay()
         self._iteration_count += 1
         call, cancel = self.node.reactor_callLater(delay, self._search_iteration_semaphore.run, self._searchIteration)
         self.pending_iteration_calls.append(cancel)
 
 
+def _record_lookup(result, helper, started):
+    if helper.is_find_value_request:
+        found = len(result.get(helper.key, [])) if isinstance(result, dict) else 0
+    else:
+        found = len(result)
+    helper.node.metrics.lookup_finished(helper.rpc, helper.key, started, helper.hops, len(helper.already_contacted),
+                                        found)
+    return result
+
+
 def iterativeFind(node, shortlist, key, rpc, exclude=None):
     helper = _IterativeFind(node, shortlist, key, rpc, exclude)
+    if getattr(node, 'metrics', None) is not None:
+        helper.finished_deferred.addCallback(_record_lookup, helper, node.clock.seconds())
     helper.searchIteration(0)
     return helper.finished_deferred
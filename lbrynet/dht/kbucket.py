@@ -102,7 +102,7 @@ class KBucket(object):
             pass
         else:
             sort_distance_to = sort_distance_to or self._node_id
-            contacts.sort(key=lambda c: Distance(sort_distance_to)(c.id))
+            contacts.sort(key=Distance(sort_distance_to).to_contact)
 
         return contacts[:min(currentLen, count)]
 
@@ -0,0 +1,136 @@
+import bisect
+from collections import Counter, deque
+
+#: upper bounds (in seconds) of the round trip time histogram buckets, the last bucket is unbounded
+RTT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+#: upper bounds of the histogram buckets for the number of contacts queried by an iterative lookup
+LOOKUP_RPC_BUCKETS = (3, 6, 9, 12, 16, 24, 32, 48, 64)
+
+
+class Histogram(object):
+    """ Counts values in buckets with fixed upper bounds """
+
+    __slots__ = ('bounds', 'counts', 'count', 'total')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def to_dict(self):
+        return {
+            'buckets': [[bound, count] for bound, count in zip(self.bounds + ('+inf',), self.counts)],
+            'count': self.count,
+            'mean': None if not self.count else float(self.total) / self.count
+        }
+
+
+class DHTMetrics(object):
+    """
+    Opt-in counters of the RPCs, datagrams and iterative lookups of a node, enabled with the C{metrics} argument of
+    L{lbrynet.dht.node.Node}
+
+    The recorded values are exposed as a JSON serializable dictionary by C{to_dict}.
+    """
+
+    def __init__(self, get_time, max_traces=100):
+        self._get_time = get_time
+        self.started = get_time()
+        self.rpcs_sent = Counter()
+        self.rpcs_received = Counter()
+        self.timeouts = Counter()
+        self.remote_errors = Counter()
+        self.rtt = {}
+        self.datagrams_sent = 0
+        self.datagrams_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.fragments_sent = 0
+        self.fragments_received = 0
+        self.invalid_datagrams = 0
+        self.lookups = Counter()
+        self.lookup_hops = {}
+        self.lookup_rpcs = {}
+        self.lookup_traces = deque(maxlen=max_traces)
+
+    def rpc_sent(self, method):
+        self.rpcs_sent[method] += 1
+
+    def rpc_received(self, method):
+        self.rpcs_received[method] += 1
+
+    def rpc_replied(self, method, rtt):
+        if method not in self.rtt:
+            self.rtt[method] = Histogram(RTT_BUCKETS)
+        self.rtt[method].add(rtt)
+
+    def rpc_timed_out(self, method):
+        self.timeouts[method] += 1
+
+    def rpc_failed(self, method):
+        self.remote_errors[method] += 1
+
+    def datagram_sent(self, size):
+        self.datagrams_sent += 1
+        self.bytes_sent += size
+
+    def datagram_received(self, size, fragment=False):
+        self.datagrams_received += 1
+        self.bytes_received += size
+        self.fragments_received += int(fragment)
+
+    def lookup_finished(self, rpc, key, started, hops, contacted, found):
+        """
+        Record an iterative lookup
+
+        @param started: the time the lookup was started
+        @param hops: the number of hops to the contact(s) that gave the result
+        @param contacted: the number of contacts the lookup queried
+        @param found: the number of contacts or peers found
+        """
+        self.lookups[rpc] += 1
+        self.lookup_hops.setdefault(rpc, Counter())[hops] += 1
+        if rpc not in self.lookup_rpcs:
+            self.lookup_rpcs[rpc] = Histogram(LOOKUP_RPC_BUCKETS)
+        self.lookup_rpcs[rpc].add(contacted)
+        self.lookup_traces.append({
+            'rpc': rpc,
+            'key': key.encode('hex'),
+            'started': started,
+            'duration': self._get_time() - started,
+            'hops': hops,
+            'contacted': contacted,
+            'found': found
+        })
+
+    def to_dict(self):
+        return {
+            'since': self.started,
+            'rpcsSent': dict(self.rpcs_sent),
+            'rpcsReceived': dict(self.rpcs_received),
+            'timeouts': dict(self.timeouts),
+            'remoteErrors': dict(self.remote_errors),
+            'rtt': {method: histogram.to_dict() for method, histogram in self.rtt.iteritems()},
+            'datagramsSent': self.datagrams_sent,
+            'datagramsReceived': self.datagrams_received,
+            'bytesSent': self.bytes_sent,
+            'bytesReceived': self.bytes_received,
+            'fragmentsSent': self.fragments_sent,
+            'fragmentsReceived': self.fragments_received,
+            'invalidDatagrams': self.invalid_datagrams,
+            'lookups': {
+                rpc: {
+                    'count': count,
+                    'hops': dict(self.lookup_hops[rpc]),
+                    'contacted': self.lookup_rpcs[rpc].to_dict()
+                } for rpc, count in self.lookups.iteritems()
+            },
+            'lookupTraces': list(self.lookup_traces)
+        }
@@ -7,7 +7,12 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
+import struct
+import socket
+
+import constants
 import msgtypes
+from error import DecodeError
 
 
 class MessageTranslator(object):
@@ -88,3 +93,218 @@ class DefaultFormat(MessageTranslator):
             msg[self.headerType] = self.typeResponse
             msg[self.headerPayload] = message.response
         return msg
+
+
+class BinaryFormat(MessageTranslator):
+    """ A fixed layout binary message format, used with contacts reporting a protocol version of at least
+    C{BinaryFormat.protocolVersion}
+
+    Unlike L{DefaultFormat} this translates directly between message objects and the datagram, there is no separate
+    encoding step. Every message starts with a header of::
+        |  marker  | message | RPC ID   | node ID  |
+        | (1 byte) |  type   |(20 bytes)|(48 bytes)|
+        |   0x02   |(1 byte) |          |          |
+
+    The marker can't start a bencoded message ('d') or a multi-datagram packet (0x00), so both formats can be told
+    apart when they are received. The header is followed by:
+      - requests: a method byte and the fixed layout arguments of that method
+      - responses: a response type byte followed by a string, a list of contact triples or a findValue result
+      - errors: the exception type and the error message as length prefixed strings
+
+    Node IDs, keys and compact peer addresses are sent raw and contact triples are packed into 54 bytes. Messages
+    that don't fit this layout make C{encode} raise a C{ValueError}, the caller should send those using
+    L{DefaultFormat} instead.
+    """
+
+    protocolVersion = 2
+    marker = '\x02'
+    typeRequest, typeResponse, typeError = range(3)
+    methods = ('ping', 'store', 'findNode', 'findValue')
+    responseString, responseContacts, responseFindValue = range(3)
+    findValueContacts, findValueKey = range(2)
+
+    _header = struct.Struct('>cB%is%is' % (constants.rpc_id_length, constants.key_bits / 8))
+    _byte = struct.Struct('>B')
+    _short = struct.Struct('>H')
+    _contact = struct.Struct('>%is4sH' % (constants.key_bits / 8))
+    _store = struct.Struct('>HI')
+    _id_length = constants.key_bits / 8
+    _peer_length = 6 + _id_length
+
+    def __init__(self):
+        self._methodCodes = {method: i for i, method in enumerate(self.methods)}
+
+    def fromPrimitive(self, msgPrimitive):
+        return self.decode(msgPrimitive)
+
+    def toPrimitive(self, message):
+        return self.encode(message)
+
+    @classmethod
+    def _fixed(cls, value, length):
+        if not isinstance(value, str) or len(value) != length:
+            raise ValueError("expected a %i byte string" % length)
+        return value
+
+    @classmethod
+    def _string(cls, value):
+        if not isinstance(value, str):
+            raise ValueError("expected a string, got %s" % type(value).__name__)
+        return cls._short.pack(len(value)) + value
+
+    @classmethod
+    def _contacts(cls, contacts):
+        packed = [cls._short.pack(len(contacts))]
+        for contact_id, address, port in contacts:
+            packed.append(cls._contact.pack(cls._fixed(contact_id, cls._id_length), socket.inet_aton(address), port))
+        return ''.join(packed)
+
+    def _request(self, method, args):
+        if method not in self._methodCodes:
+            raise ValueError("no binary layout for %s" % method)
+        packed = self._byte.pack(self._methodCodes[method])
+        if method in ('findNode', 'findValue'):
+            key, = args
+            return packed + self._fixed(key, self._id_length)
+        elif method == 'store':
+            blob_hash, token, port, originalPublisherID, age = args
+            return packed + self._fixed(blob_hash, self._id_length) + self._string(token) + \
+                self._store.pack(port, age) + self._fixed(originalPublisherID, self._id_length)
+        elif args:
+            raise ValueError("unexpected arguments for %s" % method)
+        return packed
+
+    def _findValueResponse(self, response):
+        response = dict(response)
+        token = response.pop('token')
+        packed = self._byte.pack(self.responseFindValue) + self._byte.pack(response.pop('protocolVersion')) + \
+            self._string(token)
+        if 'contacts' in response:
+            packed += self._byte.pack(self.findValueContacts) + self._contacts(response.pop('contacts'))
+        elif len(response) == 1:
+            key, peers = response.popitem()
+            packed += self._byte.pack(self.findValueKey) + self._fixed(key, self._id_length) + \
+                self._short.pack(len(peers)) + ''.join(self._fixed(peer, self._peer_length) for peer in peers)
+            response = None
+        if response:
+            raise ValueError("unexpected findValue response fields")
+        return packed
+
+    def _response(self, response):
+        if isinstance(response, str):
+            return self._byte.pack(self.responseString) + self._string(response)
+        elif isinstance(response, (list, tuple)):
+            return self._byte.pack(self.responseContacts) + self._contacts(response)
+        elif isinstance(response, dict):
+            return self._findValueResponse(response)
+        raise ValueError("no binary layout for a %s response" % type(response).__name__)
+
+    def encode(self, message):
+        """ Encode a message into a datagram
+
+        @raise ValueError: if the message can't be expressed in this format
+        """
+        try:
+            if isinstance(message, msgtypes.RequestMessage):
+                msgType, payload = self.typeRequest, self._request(message.request, message.args)
+            elif isinstance(message, msgtypes.ErrorMessage):
+                msgType, payload = self.typeError, self._string(message.exceptionType) + self._string(message.response)
+            elif isinstance(message, msgtypes.ResponseMessage):
+                msgType, payload = self.typeResponse, self._response(message.response)
+            else:
+                raise ValueError("unknown message type")
+            return self._header.pack(self.marker, msgType, message.id, message.nodeID) + payload
+        except (struct.error, socket.error, KeyError, TypeError) as err:
+            raise ValueError("can't encode message: %s" % err)
+
+    def decode(self, data):
+        """ Decode a datagram into a message
+
+        @raise DecodeError: if the datagram is malformed
+        """
+        try:
+            message, position = self._decode(data)
+        except (struct.error, IndexError) as err:
+            raise DecodeError("truncated binary message: %s" % err)
+        if position != len(data):
+            raise DecodeError("%i trailing bytes after binary message" % (len(data) - position))
+        return message
+
+    def _read(self, data, position, length):
+        if position + length > len(data):
+            raise DecodeError("truncated binary message")
+        return data[position:position + length], position + length
+
+    def _readString(self, data, position):
+        length, = self._short.unpack_from(data, position)
+        return self._read(data, position + self._short.size, length)
+
+    def _readContacts(self, data, position):
+        count, = self._short.unpack_from(data, position)
+        position += self._short.size
+        contacts = []
+        for _ in xrange(count):
+            contact_id, address, port = self._contact.unpack_from(data, position)
+            contacts.append((contact_id, socket.inet_ntoa(address), port))
+            position += self._contact.size
+        return contacts, position
+
+    def _readFindValueResponse(self, data, position):
+        version, = self._byte.unpack_from(data, position)
+        token, position = self._readString(data, position + self._byte.size)
+        kind, = self._byte.unpack_from(data, position)
+        position += self._byte.size
+        response = {'token': token, 'protocolVersion': version}
+        if kind == self.findValueContacts:
+            response['contacts'], position = self._readContacts(data, position)
+        elif kind == self.findValueKey:
+            key, position = self._read(data, position, self._id_length)
+            count, = self._short.unpack_from(data, position)
+            peers, position = self._read(data, position + self._short.size, count * self._peer_length)
+            response[key] = [peers[i:i + self._peer_length] for i in xrange(0, len(peers), self._peer_length)]
+        else:
+            raise DecodeError("unknown findValue response type %i" % kind)
+        return response, position
+
+    def _decode(self, data):
+        marker, msgType, rpcID, nodeID = self._header.unpack_from(data)
+        if marker != self.marker:
+            raise DecodeError("not a binary message")
+        position = self._header.size
+        if msgType == self.typeRequest:
+            code, = self._byte.unpack_from(data, position)
+            position += self._byte.size
+            if code >= len(self.methods):
+                raise DecodeError("unknown method %i" % code)
+            method = self.methods[code]
+            if method in ('findNode', 'findValue'):
+                key, position = self._read(data, position, self._id_length)
+                args = (key,)
+            elif method == 'store':
+                blob_hash, position = self._read(data, position, self._id_length)
+                token, position = self._readString(data, position)
+                port, age = self._store.unpack_from(data, position)
+                originalPublisherID, position = self._read(data, position + self._store.size, self._id_length)
+                args = (blob_hash, token, port, originalPublisherID, age)
+            else:
+                args = ()
+            # the format implies the protocol version, pass it on like a DefaultFormat request would
+            return msgtypes.RequestMessage(nodeID, method, args + ({'protocolVersion': self.protocolVersion},),
+                                           rpcID), position
+        elif msgType == self.typeResponse:
+            responseType, = self._byte.unpack_from(data, position)
+            position += self._byte.size
+            if responseType == self.responseString:
+                response, position = self._readString(data, position)
+            elif responseType == self.responseContacts:
+                response, position = self._readContacts(data, position)
+            elif responseType == self.responseFindValue:
+                response, position = self._readFindValueResponse(data, position)
+            else:
+                raise DecodeError("unknown response type %i" % responseType)
+            return msgtypes.ResponseMessage(rpcID, nodeID, response), position
+        elif msgType == self.typeError:
+            exceptionType, position = self._readString(data, position)
+            errorMessage, position = self._readString(data, position)
+            return msgtypes.ErrorMessage(rpcID, nodeID, exceptionType, errorMessage), position
+        raise DecodeError("unknown message type %i" % msgType)
@@ -22,6 +22,7 @@ import datastore
 import protocol
 from peerfinder import DHTPeerFinder
 from contact import ContactManager
+from metrics import DHTMetrics
 from iterativefind import iterativeFind
 
 
@@ -99,7 +100,7 @@ class Node(MockKademliaHelper):
                  routingTableClass=None, networkProtocol=None,
                  externalIP=None, peerPort=3333, listenUDP=None,
                  callLater=None, resolve=None, clock=None, peer_finder=None,
-                 peer_manager=None, interface='', externalUDPPort=None):
+                 peer_manager=None, interface='', externalUDPPort=None, metrics=False):
         """
         @param dataStore: The data store to use. This must be class inheriting
                           from the C{DataStore} interface (or providing the
@@ -123,11 +124,13 @@ class Node(MockKademliaHelper):
         @type networkProtocol: entangled.kademlia.protocol.KademliaProtocol
         @param externalIP: the IP at which this node can be contacted
         @param peerPort: the port at which this node announces it has a blob for
+        @param metrics: count the RPCs, datagrams and lookups of this node, see C{get_stats}
         """
 
         MockKademliaHelper.__init__(self, clock, callLater, resolve, listenUDP)
         self.node_id = node_id or self._generateID()
         self.port = udpPort
+        self.metrics = DHTMetrics(self.clock.seconds) if metrics else None
         self._listen_interface = interface
         self._change_token_lc = self.get_looping_call(self.change_token)
         self._refresh_node_lc = self.get_looping_call(self._refreshNode)
@@ -650,9 +653,6 @@ class Node(MockKademliaHelper):
 
         if startupShortlist is None:
             shortlist = self._routingTable.findCloseNodes(key)
-            # if key != self.node_id:
-            #     # Update the "last accessed" timestamp for the appropriate k-bucket
-            #     self._routingTable.touchKBucket(key)
             if len(shortlist) == 0:
                 log.warning("This node doesnt know any other nodes")
                 # This node doesn't know of any other nodes
@@ -665,6 +665,9 @@ class Node(MockKademliaHelper):
             shortlist = startupShortlist
 
         result = yield iterativeFind(self, shortlist, key, rpc, exclude=exclude)
+        if startupShortlist is None:
+            # Update the "last accessed" timestamp for the appropriate k-bucket, the lookup refreshed it
+            self._routingTable.touchKBucket(key)
         defer.returnValue(result)
 
     @defer.inlineCallbacks
@@ -674,23 +677,59 @@ class Node(MockKademliaHelper):
         yield self._refreshRoutingTable()
         self._dataStore.removeExpiredPeers()
         yield self._refreshStoringPeers()
+        self._pruneContacts()
         defer.returnValue(None)
 
+    def get_stats(self):
+        """
+        Get the state of the routing table, queues and limits of this node, and the recorded metrics if they are
+        enabled
+
+        @rtype: dict
+        """
+        return {
+            "contacts": len(self.contacts),
+            "knownContacts": len(self.contact_manager),
+            "pendingRPCs": len(self._protocol._sentMessages),
+            "storedBlobs": len(self._dataStore.keys()),
+            "droppedRequests": dict(self._protocol._requestLimiter.dropped),
+            "droppedDatagrams": dict(self._protocol._partialMessages.dropped),
+            "pingQueue": self._protocol._ping_queue.stats(),
+            "metrics": None if self.metrics is None else self.metrics.to_dict()
+        }
+
+    def _pruneContacts(self):
+        in_use = self.contacts + self._dataStore.getStoringContacts()
+        in_use.extend(sent[0] for sent in self._protocol._sentMessages.itervalues())
+        in_use.extend(self._protocol._ping_queue._enqueued_contacts)
+        pruned = self.contact_manager.prune(in_use)
+        if pruned:
+            log.debug("forgot %i contacts, %i remaining", pruned, len(self.contact_manager))
+
+    def _enqueue_spread_pings(self, contacts):
+        # spread the pings over the refresh interval rather than sending them all at once
+        step = float(constants.checkRefreshInterval) / max(1, len(contacts))
+        return defer.DeferredList([
+            self._protocol._ping_queue.enqueue_maybe_ping(contact, delay=step * (i + 1))
+            for i, contact in enumerate(contacts)
+        ])
+
     def _refreshContacts(self):
-        return defer.DeferredList(
-            [self._protocol._ping_queue.enqueue_maybe_ping(contact, delay=0) for contact in self.contacts]
-        )
+        return self._enqueue_spread_pings(self.contacts)
 
     def _refreshStoringPeers(self):
-        storing_contacts = self._dataStore.getStoringContacts()
-        return defer.DeferredList(
-            [self._protocol._ping_queue.enqueue_maybe_ping(contact, delay=0) for contact in storing_contacts]
-        )
+        return self._enqueue_spread_pings(self._dataStore.getStoringContacts())
 
     @defer.inlineCallbacks
     def _refreshRoutingTable(self):
+        # buckets that were looked up in recently are not in the refresh list
         nodeIDs = self._routingTable.getRefreshList(0, False)
-        while nodeIDs:
-            searchID = nodeIDs.pop()
-            yield self.iterativeFindNode(searchID)
+        if not nodeIDs:
+            defer.returnValue(None)
+        started = self.clock.seconds()
+        semaphore = defer.DeferredSemaphore(constants.maxConcurrentRefreshLookups)
+        yield defer.DeferredList(
+            [semaphore.run(self.iterativeFindNode, searchID) for searchID in nodeIDs], consumeErrors=True
+        )
+        log.info("refreshed %i buckets in %.1f seconds", len(nodeIDs), self.clock.seconds() - started)
         defer.returnValue(None)
@@ -1,7 +1,9 @@
+import heapq
 import logging
 import socket
 import errno
-from collections import deque
+import itertools
+from collections import deque, OrderedDict
 
 from twisted.internet import protocol, defer
 from error import BUILTIN_EXCEPTIONS, UnknownRemoteException, TimeoutError, TransportNotConnected
@@ -18,74 +20,286 @@ class PingQueue(object):
     """
     Schedules a 15 minute delayed ping after a new node sends us a query. This is so the new node gets added to the
     routing table after having been given enough time for a pinhole to expire.
+
+    Contacts are kept in a heap ordered by the time they are due to be pinged, with a single delayed call set for the
+    first of them. Up to C{constants.alpha} pings are in flight at once.
     """
 
-    def __init__(self, node):
+    def __init__(self, node, max_concurrent_pings=None):
         self._node = node
         self._get_time = self._node.clock.seconds
-        self._queue = deque()
+        self._queue = []  # heap of (due time, sequence number, contact)
+        self._count = itertools.count()
         self._enqueued_contacts = {}
-        self._semaphore = defer.DeferredSemaphore(1)
-        self._ping_semaphore = defer.DeferredSemaphore(constants.alpha)
-        self._process_lc = node.get_looping_call(self._semaphore.run, self._process)
+        self._ping_semaphore = defer.DeferredSemaphore(max_concurrent_pings or constants.alpha)
+        self._running = False
+        self._next_call = None  # (due time, canceller) of the delayed call processing the queue
+        self._in_flight = 0
+        self.pinged = 0
+        self.timeouts = 0
+        self._latencies = deque(maxlen=100)
+
+    def __len__(self):
+        return len(self._enqueued_contacts)
 
     def _add_contact(self, contact, delay=None):
         if contact in self._enqueued_contacts:
-            return defer.succeed(None)
-        delay = delay or constants.checkRefreshInterval
-        self._enqueued_contacts[contact] = self._get_time() + delay
-        self._queue.append(contact)
-        return defer.succeed(None)
+            return
+        if delay is None:
+            delay = constants.checkRefreshInterval
+        due = self._get_time() + delay
+        self._enqueued_contacts[contact] = due
+        heapq.heappush(self._queue, (due, next(self._count), contact))
+        self._schedule()
+
+    def _schedule(self):
+        if not self._running or not self._queue:
+            return
+        due = self._queue[0][0]
+        if self._next_call is not None:
+            if self._next_call[0] <= due:
+                return
+            self._next_call[1]()
+        _, cancel = self._node.reactor_callLater(max(0, due - self._get_time()), self._process)
+        self._next_call = (due, cancel)
 
-    @defer.inlineCallbacks
     def _process(self):
-        if not len(self._queue):
-            defer.returnValue(None)
-        contact = self._queue.popleft()
+        self._next_call = None
         now = self._get_time()
+        while self._queue and self._queue[0][0] <= now:
+            _, _, contact = heapq.heappop(self._queue)
+            if contact.contact_is_good:
+                del self._enqueued_contacts[contact]
+            else:
+                self._ping_semaphore.run(self._ping, contact)
+        self._schedule()
 
-        # if the oldest contact in the queue isn't old enough to be pinged, add it back to the queue and return
-        if now < self._enqueued_contacts[contact]:
-            self._queue.appendleft(contact)
-            defer.returnValue(None)
-
-        pinged = []
-        checked = []
-        while now > self._enqueued_contacts[contact]:
-            checked.append(contact)
-            if not contact.contact_is_good:
-                pinged.append(contact)
-            if not len(self._queue):
+    @defer.inlineCallbacks
+    def _ping(self, contact):
+        self._in_flight += 1
+        sent = self._get_time()
+        try:
+            yield contact.ping()
+            self._latencies.append(self._get_time() - sent)
+        except TimeoutError:
+            self.timeouts += 1
+        except Exception as err:
+            log.warning("unexpected error: %s", err)
+        finally:
+            self._in_flight -= 1
+            self.pinged += 1
+            # the contact can't be enqueued again until its ping is done
+            self._enqueued_contacts.pop(contact, None)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'queued': len(self),
+            'inFlight': self._in_flight,
+            'pinged': self.pinged,
+            'timeouts': self.timeouts,
+            'latencyMedian': latencies[len(latencies) / 2] if latencies else None
+        }
+
+    def start(self):
+        self._running = True
+        self._schedule()
+
+    def stop(self):
+        self._running = False
+        if self._next_call is not None:
+            self._next_call[1]()
+            self._next_call = None
+
+    def enqueue_maybe_ping(self, contact, delay=None):
+        self._add_contact(contact, delay)
+        return defer.succeed(None)
+
+
+class PartialMessageBuffer(object):
+    """
+    Holds the datagrams of messages that were spread over several UDP packets until all of them have arrived.
+
+    A partial message is dropped once no datagram of it has arrived for the timeout, the same way the RPC it
+    answers keeps being extended while it makes progress. Datagrams only push the deadline back until the
+    max_time after the first one arrived, so a message can't be held for longer than max_time plus the timeout.
+    The total size of the buffered datagrams is capped, and so is the number of messages in progress from a single
+    IP address. Datagrams that would break one of these limits are dropped and counted in C{dropped}.
+    """
+
+    def __init__(self, get_time, timeout=None, max_size=None, max_per_address=None, max_fragments=None,
+                 max_time=None):
+        self._get_time = get_time
+        self._timeout = timeout or constants.reassemblyTimeout
+        self._max_time = max_time or constants.maxReassemblyTime
+        self._max_size = max_size or constants.reassemblyBufferSize
+        self._max_per_address = max_per_address or constants.maxPartialMessagesPerAddress
+        self._max_fragments = max_fragments or constants.maxMessageFragments
+        # msgID: [address, total packets, deadline, {sequence number: data}, datagrams at last progress check,
+        # time the deadline can't be extended after], in order of the deadlines
+        self._messages = OrderedDict()
+        self._per_address = {}
+        self.size = 0
+        self.dropped = {
+            'invalid': 0,
+            'expired': 0,
+            'address_limit': 0,
+            'buffer_full': 0
+        }
+
+    def __contains__(self, msgID):
+        return msgID in self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def has_progress(self, msgID):
+        """ Whether more datagrams of the message have arrived since the last time this was checked """
+        if msgID not in self._messages:
+            return False
+        message = self._messages[msgID]
+        received = len(message[3])
+        progress, message[4] = received != message[4], received
+        return progress
+
+    def remove(self, msgID):
+        address, _, _, fragments, _, _ = self._messages.pop(msgID)
+        self.size -= sum(len(data) for data in fragments.itervalues())
+        self._per_address[address] -= 1
+        if not self._per_address[address]:
+            del self._per_address[address]
+        return fragments
+
+    def remove_expired(self):
+        now = self._get_time()
+        while self._messages:
+            msgID, (_, _, deadline, fragments, _, _) = next(self._messages.iteritems())
+            if deadline > now:
                 break
-            contact = self._queue.popleft()
-            if not now > self._enqueued_contacts[contact]:
-                checked.append(contact)
+            self.remove(msgID)
+            self.dropped['expired'] += len(fragments)
 
-        @defer.inlineCallbacks
-        def _ping(contact):
-            try:
-                yield contact.ping()
-            except TimeoutError:
-                pass
-            except Exception as err:
-                log.warning("unexpected error: %s", err)
+    def add(self, msgID, address, totalPackets, seqNumber, data):
+        """
+        Add a datagram of a multi-datagram message
 
-        yield defer.DeferredList([_ping(contact) for contact in pinged])
+        @param address: the IP address the datagram was received from
+        @type address: str
 
-        for contact in checked:
-            if contact in self._enqueued_contacts:
-                del self._enqueued_contacts[contact]
+        @return: The reassembled message if this was its last missing datagram, otherwise None
+        @rtype: str or None
+        """
+        self.remove_expired()
+        if not 0 < totalPackets <= self._max_fragments or not 0 <= seqNumber < totalPackets:
+            self.dropped['invalid'] += 1
+            return None
+        if msgID in self._messages:
+            message = self._messages[msgID]
+            # the sender and the packet count must match the first datagram of the message
+            if message[0] != address or message[1] != totalPackets:
+                self.dropped['invalid'] += 1
+                return None
+            if seqNumber in message[3]:
+                return None
+        elif self._per_address.get(address, 0) >= self._max_per_address:
+            self.dropped['address_limit'] += 1
+            return None
+        if self.size + len(data) > self._max_size:
+            self.dropped['buffer_full'] += 1
+            return None
+        now = self._get_time()
+        if msgID not in self._messages:
+            self._messages[msgID] = [address, totalPackets, now + self._timeout, {}, 0, now + self._max_time]
+            self._per_address[address] = self._per_address.get(address, 0) + 1
+        elif now < self._messages[msgID][5]:
+            # push the deadline back, moving the message to the end to keep the deadlines in order
+            message = self._messages.pop(msgID)
+            message[2] = now + self._timeout
+            self._messages[msgID] = message
+        fragments = self._messages[msgID][3]
+        fragments[seqNumber] = data
+        self.size += len(data)
+        if len(fragments) < totalPackets:
+            return None
+        self.remove(msgID)
+        return ''.join(fragments[seq] for seq in range(totalPackets))
+
+
+class RequestRateLimiter(object):
+    """
+    Token buckets limiting the rate of requests handled from each source and from all sources together.
+
+    A source is an IP address and port, so nodes sharing an IP address, like the nodes of a multi-process seed or
+    users behind the same NAT, each get their own budget. Every handled request takes a token from the bucket of
+    its source and from the global bucket, which bounds the load sources can put on the node together. As the
+    global bucket runs low, requests are shed by method according to C{constants.rpcLoadSheddingThresholds}, so an
+    overloaded node stops accepting stores before it stops answering lookups and pings. Dropped requests are
+    counted in C{dropped}.
+    """
 
-        defer.returnValue(None)
+    def __init__(self, get_time, rate_per_address=None, burst_per_address=None, rate=None, burst=None,
+                 thresholds=None):
+        self._get_time = get_time
+        self._rate_per_address = rate_per_address or constants.rpcRatePerAddress
+        self._burst_per_address = burst_per_address or constants.rpcBurstPerAddress
+        self._rate = rate or constants.rpcRate
+        self._burst = burst or constants.rpcBurst
+        self._thresholds = thresholds or constants.rpcLoadSheddingThresholds
+        # requests for methods without a threshold are shed first
+        self._default_threshold = max(self._thresholds.itervalues())
+        # (address, port): [tokens, time of the last update]
+        self._buckets = {}
+        self._prune_at = 1024
+        self._tokens = float(self._burst)
+        self._last_update = get_time()
+        self.dropped = {method: 0 for method in self._thresholds}
+        self.dropped['address_limit'] = 0
+        self.dropped['other'] = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _prune(self, now):
+        # buckets that have refilled completely hold no more information than a new bucket would
+        refill_time = float(self._burst_per_address) / self._rate_per_address
+        for address in [a for a, (_, updated) in self._buckets.iteritems() if now - updated >= refill_time]:
+            del self._buckets[address]
+        self._prune_at = max(1024, 2 * len(self._buckets))
+
+    def allow(self, address, method):
+        """
+        Take a token for a request from the given source if it should be handled
 
-    def start(self):
-        return self._node.safe_start_looping_call(self._process_lc, 60)
+        @param address: the (IP address, port) the request was received from
+        @type address: tuple
 
-    def stop(self):
-        return self._node.safe_stop_looping_call(self._process_lc)
+        @return: True if the request should be handled, False if it should be dropped
+        @rtype: bool
+        """
+        now = self._get_time()
+        self._tokens = min(self._burst, self._tokens + (now - self._last_update) * self._rate)
+        self._last_update = now
 
-    def enqueue_maybe_ping(self, contact, delay=None):
-        return self._semaphore.run(self._add_contact, contact, delay)
+        if address in self._buckets:
+            tokens, updated = self._buckets[address]
+            tokens = min(self._burst_per_address, tokens + (now - updated) * self._rate_per_address)
+        else:
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+            tokens = self._burst_per_address
+        if tokens < 1:
+            self._buckets[address] = [tokens, now]
+            self.dropped['address_limit'] += 1
+            return False
+
+        threshold = self._thresholds.get(method, self._default_threshold)
+        if self._tokens - 1 < threshold * self._burst:
+            self._buckets[address] = [tokens, now]
+            self.dropped[method if method in self._thresholds else 'other'] += 1
+            return False
+        self._buckets[address] = [tokens - 1, now]
+        self._tokens -= 1
+        return True
 
 
 class KademliaProtocol(protocol.DatagramProtocol):
@@ -97,9 +311,10 @@ class KademliaProtocol(protocol.DatagramProtocol):
         self._node = node
         self._encoder = encoding.Bencode()
         self._translator = msgformat.DefaultFormat()
+        self._binaryFormat = msgformat.BinaryFormat()
         self._sentMessages = {}
-        self._partialMessages = {}
-        self._partialMessagesProgress = {}
+        self._partialMessages = PartialMessageBuffer(self._node.clock.seconds)
+        self._requestLimiter = RequestRateLimiter(self._node.clock.seconds)
         self._listening = defer.Deferred(None)
         self._ping_queue = PingQueue(self._node)
         self._protocolVersion = constants.protocolVersion
@@ -153,10 +368,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
                  C{ErrorMessage}).
         @rtype: twisted.internet.defer.Deferred
         """
-        msg = msgtypes.RequestMessage(self._node.node_id, method, self._migrate_outgoing_rpc_args(contact, method,
-                                                                                                  *args))
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        msg = msgtypes.RequestMessage(self._node.node_id, method, args)
+        encodedMsg = self._encodeMessage(contact, msg)
 
         if args:
             log.debug("%s:%i SEND CALL %s(%s) TO %s:%i", self._node.externalIP, self._node.port, method,
@@ -168,6 +381,11 @@ class KademliaProtocol(protocol.DatagramProtocol):
         df = defer.Deferred()
 
         def _remove_contact(failure):  # remove the contact from the routing table and track the failure
+            if self._node.metrics is not None:
+                if failure.check(TimeoutError):
+                    self._node.metrics.rpc_timed_out(method)
+                else:
+                    self._node.metrics.rpc_failed(method)
             try:
                 self._node.removeContact(contact)
             except (ValueError, IndexError):
@@ -175,8 +393,13 @@ class KademliaProtocol(protocol.DatagramProtocol):
             contact.update_last_failed()
             return failure
 
+        sent_time = self._node.clock.seconds()
+
         def _update_contact(result):  # refresh the contact in the routing table
             contact.update_last_replied()
+            contact.update_rtt(self._node.clock.seconds() - sent_time)
+            if self._node.metrics is not None:
+                self._node.metrics.rpc_replied(method, self._node.clock.seconds() - sent_time)
             if method == 'findValue':
                 if 'protocolVersion' not in result:
                     contact.update_protocol_version(0)
@@ -189,9 +412,11 @@ class KademliaProtocol(protocol.DatagramProtocol):
         df.addCallbacks(_update_contact, _remove_contact)
 
         # Set the RPC timeout timer
-        timeoutCall, cancelTimeout = self._node.reactor_callLater(constants.rpcTimeout, self._msgTimeout, msg.id)
+        timeoutCall, cancelTimeout = self._node.reactor_callLater(contact.rpcTimeout, self._msgTimeout, msg.id)
 
         # Transmit the data
+        if self._node.metrics is not None:
+            self._node.metrics.rpc_sent(method)
         self._send(encodedMsg, msg.id, (contact.address, contact.port))
         self._sentMessages[msg.id] = (contact, df, timeoutCall, cancelTimeout, method, args)
 
@@ -213,37 +438,41 @@ class KademliaProtocol(protocol.DatagramProtocol):
                receives a UDP datagram
         """
 
-        if datagram[0] == '\x00' and datagram[25] == '\x00':
+        isFragment = len(datagram) > 26 and datagram[0] == '\x00' and datagram[25] == '\x00'
+        if self._node.metrics is not None:
+            self._node.metrics.datagram_received(len(datagram), isFragment)
+        if isFragment:
             totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
             msgID = datagram[5:25]
             seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
-            if msgID not in self._partialMessages:
-                self._partialMessages[msgID] = {}
-            self._partialMessages[msgID][seqNumber] = datagram[26:]
-            if len(self._partialMessages[msgID]) == totalPackets:
-                keys = self._partialMessages[msgID].keys()
-                keys.sort()
-                data = ''
-                for key in keys:
-                    data += self._partialMessages[msgID][key]
-                    datagram = data
-                del self._partialMessages[msgID]
-            else:
+            datagram = self._partialMessages.add(msgID, address[0], totalPackets, seqNumber, datagram[26:])
+            if datagram is None:
                 return
         try:
-            msgPrimitive = self._encoder.decode(datagram)
-            message = self._translator.fromPrimitive(msgPrimitive)
+            isBinary = datagram[:1] == self._binaryFormat.marker
+            if isBinary:
+                message = self._binaryFormat.decode(datagram)
+            else:
+                msgPrimitive = self._encoder.decode(datagram)
+                message = self._translator.fromPrimitive(msgPrimitive)
         except (encoding.DecodeError, ValueError) as err:
             # We received some rubbish here
-            log.warning("Error decoding datagram %s from %s:%i - %s", datagram.encode('hex'),
-                        address[0], address[1], err)
+            log.warning("Error decoding %i byte datagram from %s:%i - %s", len(datagram), address[0], address[1],
+                        err)
+            if self._node.metrics is not None:
+                self._node.metrics.invalid_datagrams += 1
             return
         except (IndexError, KeyError):
             log.warning("Couldn't decode dht datagram from %s", address)
+            if self._node.metrics is not None:
+                self._node.metrics.invalid_datagrams += 1
             return
 
         if isinstance(message, msgtypes.RequestMessage):
             # This is an RPC method request
+            if not self._requestLimiter.allow(address, message.request):
+                log.debug("dropping %s request from %s:%i", message.request, address[0], address[1])
+                return
             remoteContact = self._node.contact_manager.make_contact(message.nodeID, address[0], address[1], self)
             remoteContact.update_last_requested()
             # only add a requesting contact to the routing table if it has replied to one of our requests
@@ -310,6 +539,9 @@ class KademliaProtocol(protocol.DatagramProtocol):
                     return
                 elif not remoteContact.id:
                     remoteContact.set_id(message.nodeID)
+                # only nodes supporting the binary format reply with it
+                if isBinary and remoteContact.protocolVersion < self._binaryFormat.protocolVersion:
+                    remoteContact.update_protocol_version(self._binaryFormat.protocolVersion)
 
                 # We got a result from the RPC
                 df.callback(message.response)
@@ -353,6 +585,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
                 packetData = data[startPos:startPos + self.msgSizeLimit]
                 encSeqNumber = chr(seqNumber >> 8) + chr(seqNumber & 0xff)
                 txData = '\x00%s%s%s\x00%s' % (encTotalPackets, encSeqNumber, rpcID, packetData)
+                if self._node.metrics is not None:
+                    self._node.metrics.fragments_sent += 1
                 self._scheduleSendNext(txData, address)
 
                 startPos += self.msgSizeLimit
@@ -366,6 +600,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
 
     def _write(self, txData, address):
         if self.transport:
+            if self._node.metrics is not None:
+                self._node.metrics.datagram_sent(len(txData))
             try:
                 self.transport.write(txData, address)
             except socket.error as err:
@@ -383,24 +619,42 @@ class KademliaProtocol(protocol.DatagramProtocol):
         else:
             raise TransportNotConnected()
 
+    def _encodeMessage(self, contact, msg):
+        """ Encode a message in the binary format if the contact supports it, otherwise bencode it
+
+        Request arguments are migrated to the format expected by the contact's protocol version when the message
+        is bencoded.
+        """
+        binaryVersion = self._binaryFormat.protocolVersion
+        if contact.protocolVersion >= binaryVersion and self._protocolVersion >= binaryVersion:
+            try:
+                return self._binaryFormat.encode(msg)
+            except ValueError as err:
+                log.debug("sending %s to %s:%i bencoded: %s", type(msg).__name__, contact.address, contact.port,
+                          err)
+        if isinstance(msg, msgtypes.RequestMessage):
+            msg.args = self._migrate_outgoing_rpc_args(contact, msg.request, *msg.args)
+        msgPrimitive = self._translator.toPrimitive(msg)
+        return self._encoder.encode(msgPrimitive)
+
     def _sendResponse(self, contact, rpcID, response):
         """ Send a RPC response to the specified contact
         """
         msg = msgtypes.ResponseMessage(rpcID, self._node.node_id, response)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        encodedMsg = self._encodeMessage(contact, msg)
         self._send(encodedMsg, rpcID, (contact.address, contact.port))
 
     def _sendError(self, contact, rpcID, exceptionType, exceptionMessage):
         """ Send an RPC error message to the specified contact
         """
         msg = msgtypes.ErrorMessage(rpcID, self._node.node_id, exceptionType, exceptionMessage)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        encodedMsg = self._encodeMessage(contact, msg)
         self._send(encodedMsg, rpcID, (contact.address, contact.port))
 
     def _handleRPC(self, senderContact, rpcID, method, args):
         """ Executes a local function in response to an RPC request """
+        if self._node.metrics is not None:
+            self._node.metrics.rpc_received(method)
 
         # Set up the deferred callchain
         def handleError(f):
@@ -452,7 +706,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
             log.error("deferred timed out, but is not present in sent messages list!")
             return
         remoteContact, df, timeout_call, timeout_canceller, method, args = self._sentMessages[messageID]
-        if self._partialMessages.has_key(messageID):
+        self._partialMessages.remove_expired()
+        if messageID in self._partialMessages:
             # We are still receiving this message
             self._msgTimeoutInProgress(messageID, timeout_canceller, remoteContact, df, method, args)
             return
@@ -466,24 +721,17 @@ class KademliaProtocol(protocol.DatagramProtocol):
         if self._hasProgressBeenMade(messageID):
             # Reset the RPC timeout timer
             timeoutCanceller()
-            timeoutCall, cancelTimeout = self._node.reactor_callLater(constants.rpcTimeout, self._msgTimeout, messageID)
+            timeoutCall, cancelTimeout = self._node.reactor_callLater(remoteContact.rpcTimeout, self._msgTimeout,
+                                                                      messageID)
             self._sentMessages[messageID] = (remoteContact, df, timeoutCall, cancelTimeout, method, args)
         else:
             # No progress has been made
-            if messageID in self._partialMessagesProgress:
-                del self._partialMessagesProgress[messageID]
-            if messageID in self._partialMessages:
-                del self._partialMessages[messageID]
+            self._partialMessages.remove(messageID)
+            del self._sentMessages[messageID]
             df.errback(TimeoutError(remoteContact.id))
 
     def _hasProgressBeenMade(self, messageID):
-        return (
-            self._partialMessagesProgress.has_key(messageID) and
-            (
-                len(self._partialMessagesProgress[messageID]) !=
-                len(self._partialMessages[messageID])
-            )
-        )
+        return self._partialMessages.has_progress(messageID)
 
     def stopProtocol(self):
         """ Called when the transport is disconnected.
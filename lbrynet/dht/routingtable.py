@@ -62,9 +62,9 @@ class TreeRoutingTable(object):
             return True
         contacts = self.get_contacts()
         distance = Distance(self._parentNodeID)
-        contacts.sort(key=lambda c: distance(c.id))
+        contacts.sort(key=distance.to_contact)
         kth_contact = contacts[-1] if len(contacts) < constants.k else contacts[constants.k-1]
-        return distance(toAdd) < distance(kth_contact.id)
+        return distance(toAdd) < distance.to_contact(kth_contact)
 
     def addContact(self, contact):
         """ Add the given contact to the correct k-bucket; if it already
@@ -170,7 +170,7 @@ class TreeRoutingTable(object):
         distance = Distance(key)
         contacts = self.get_contacts()
         contacts = [c for c in contacts if c.id not in exclude]
-        contacts.sort(key=lambda c: distance(c.id))
+        contacts.sort(key=distance.to_contact)
         return contacts[:min(count, len(contacts))]
 
     def getContact(self, contactID):
@@ -40,7 +40,11 @@ class IRequestSender(Interface):
 
         This will cause the protocol to call blob_request.write(data)
         for all incoming data, after the response message has been
-        parsed out, until blob_request.finished_deferred fires.
+        parsed out, until the length of the blob given in the response
+        has been received or blob_request.finished_deferred fires.
+
+        If the peer supports pipelining, blob requests can be added while
+        the data of earlier ones is still being received.
 
         @param blob_request: the request for the blob
         @type blob_request: ClientBlobRequest
@@ -157,7 +161,7 @@ class IDownloadManager(Interface):
 
     def needed_blobs(self):
         """Returns a list of BlobInfos representing all of the blobs that the
-        stream still needs to download.
+        stream still needs to download, in stream order.
 
         @return: the list of BlobInfos representing blobs that the stream still needs to download.
         @rtype: [BlobInfo]
@@ -241,7 +245,7 @@ class IProgressManager(Interface):
 
     def needed_blobs(self):
         """Returns a list of BlobInfos representing all of the blobs that the
-        stream still needs to download.
+        stream still needs to download, in stream order.
 
         @return: the list of BlobInfos representing blobs that the stream still needs to download.
         @rtype: [BlobInfo]
@@ -318,34 +322,75 @@ class IRateLimiter(Interface):
     """
     Can keep track of download and upload rates and can throttle objects which implement the
     IRateLimited interface.
+
+    Registered objects belong to a group, such as the stream or upload slot they transfer data for, and each group
+    has a priority class, one of PRIORITY_STREAMING, PRIORITY_DOWNLOAD or PRIORITY_UPLOAD in
+    lbrynet.core.RateLimiter. When every group wants more than the limit allows, the limit is shared between the
+    groups by their priority classes, streams being watched getting the most and seeding the least.
     """
-    def report_dl_bytes(self, num_bytes):
+    def set_dl_limit(self, limit):
+        """
+        Set the most bytes per second that can be downloaded.
+
+        @param limit: the bytes per second that can be downloaded, None or 0 for no limit
+        @type limit: integer
+
+        @return: None
+        """
+
+    def set_ul_limit(self, limit):
+        """
+        Set the most bytes per second that can be uploaded.
+
+        @param limit: the bytes per second that can be uploaded, None or 0 for no limit
+        @type limit: integer
+
+        @return: None
+        """
+
+    def report_dl_bytes(self, num_bytes, protocol=None):
         """
         Inform the IRateLimiter that num_bytes have been downloaded.
 
         @param num_bytes: the number of bytes that have been downloaded
         @type num_bytes: integer
 
+        @param protocol: the registered IRateLimited object that downloaded them, which may be throttled if it
+            or its group is over its share of the limit. If None the bytes only count against the limit.
+        @type protocol: Object implementing IRateLimited
+
         @return: None
         """
 
-    def report_ul_bytes(self, num_bytes):
+    def report_ul_bytes(self, num_bytes, protocol=None):
         """
         Inform the IRateLimiter that num_bytes have been uploaded.
 
         @param num_bytes: the number of bytes that have been uploaded
         @type num_bytes: integer
 
+        @param protocol: the registered IRateLimited object that uploaded them, which may be throttled if it
+            or its group is over its share of the limit. If None the bytes only count against the limit.
+        @type protocol: Object implementing IRateLimited
+
         @return: None
         """
 
-    def register_protocol(self, protocol):
+    def register_protocol(self, protocol, group=None, priority=1):
         """Register an IRateLimited object with the IRateLimiter so that the
-        IRateLimiter can throttle it
+        IRateLimiter can throttle it, or move a registered one to another group
 
         @param protocol: An object implementing the interface IRateLimited
         @type protocol: Object implementing IRateLimited
 
+        @param group: the stream or upload slot the protocol transfers data for, whose share of the limit is
+            split evenly between its protocols. If None the protocol is a group of its own.
+        @type group: any hashable object
+
+        @param priority: the priority class of the group, PRIORITY_STREAMING, PRIORITY_DOWNLOAD (the default) or
+            PRIORITY_UPLOAD
+        @type priority: integer
+
         @return: None
 
         """
@@ -412,6 +457,15 @@ class IBlobSender(Interface):
         @rtype: Deferred which fires with anything
         """
 
+    def cancel_send(self, err):
+        """
+        Stop sending the requested blob, if any, because the connection is closing
+
+        @param err: the reason the send is cancelled, returned as is
+
+        @return: err
+        """
+
 
 class IQueryHandler(Interface):
     """
@@ -10,6 +10,7 @@ from lbrynet.lbry_file.client.EncryptedFileMetadataHandler import EncryptedFileM
 import os
 from twisted.internet import defer, threads
 import logging
+import threading
 import traceback
 
 
@@ -134,6 +135,8 @@ class EncryptedFileSaver(EncryptedFileDownloader):
         self.download_directory = binascii.unhexlify(download_directory)
         self.file_written_to = os.path.join(self.download_directory, binascii.unhexlify(file_name))
         self.file_handle = None
+        # the blobs are decrypted and written in a thread, the file isn't closed while one is writing to it
+        self._write_lock = threading.Lock()
 
     def __str__(self):
         return str(self.file_written_to)
@@ -168,7 +171,8 @@ class EncryptedFileSaver(EncryptedFileDownloader):
         def close_file():
             if file_handle is not None:
                 name = file_handle.name
-                file_handle.close()
+                with self._write_lock:
+                    file_handle.close()
                 if self.completed is False:
                     os.remove(name)
 
@@ -176,8 +180,9 @@ class EncryptedFileSaver(EncryptedFileDownloader):
 
     def _get_write_func(self):
         def write_func(data):
-            if self.stopped is False and self.file_handle is not None:
-                self.file_handle.write(data)
+            with self._write_lock:
+                if self.stopped is False and self.file_handle is not None:
+                    self.file_handle.write(data)
         return write_func
 
 
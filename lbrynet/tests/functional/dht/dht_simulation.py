@@ -0,0 +1,213 @@
+"""
+An in process simulation of a DHT network of thousands of nodes, running on a virtual clock over the mock
+transport, used by scripts/dht_simulation_benchmark.py
+"""
+
+import heapq
+import random
+import logging
+import itertools
+from zope.interface import implements
+from twisted.internet import base, defer
+from twisted.internet.interfaces import IReactorTime
+from lbrynet.dht import node as node_module
+from lbrynet.dht.node import Node
+from lbrynet.dht.iterativefind import _IterativeFind
+from mock_transport import resolve, listenUDP, MockNetwork, MOCK_DHT_SEED_DNS, mock_node_generator
+
+log = logging.getLogger(__name__)
+
+
+class VirtualClock(object):
+    """
+    Provides the same interface as twisted.internet.task.Clock, but keeps the delayed calls in a heap so that
+    scheduling and cancelling calls stays cheap with thousands of nodes running on it
+    """
+    implements(IReactorTime)
+
+    def __init__(self):
+        self.rightNow = 0.0
+        self._calls = []
+        self._count = itertools.count()
+
+    def seconds(self):
+        return self.rightNow
+
+    def callLater(self, when, what, *a, **kw):
+        call = base.DelayedCall(self.seconds() + when, what, a, kw, self._cancelled, self._reset,
+                                seconds=self.seconds)
+        heapq.heappush(self._calls, (call.getTime(), next(self._count), call))
+        return call
+
+    def _cancelled(self, call):
+        pass  # cancelled calls are dropped when they reach the top of the heap
+
+    def _reset(self, call):
+        # the old heap entry is dropped because its time no longer matches the call
+        heapq.heappush(self._calls, (call.getTime(), next(self._count), call))
+
+    def getDelayedCalls(self):
+        return [call for (_, _, call) in self._calls if call.active()]
+
+    def _next_call(self):
+        while self._calls:
+            when, _, call = self._calls[0]
+            if call.cancelled or call.called or when != call.getTime():
+                heapq.heappop(self._calls)
+                continue
+            return call
+        return None
+
+    def run_next(self, deadline=None):
+        """
+        Advance the clock to the next delayed call and run it
+
+        @return: False if there was no call to run before the deadline
+        """
+        call = self._next_call()
+        if call is None or (deadline is not None and call.getTime() > deadline):
+            return False
+        heapq.heappop(self._calls)
+        self.rightNow = max(self.rightNow, call.getTime())
+        call.called = 1
+        try:
+            call.func(*call.args, **call.kw)
+        except Exception:
+            log.exception("error running delayed call")
+        return True
+
+    def advance(self, amount):
+        deadline = self.rightNow + amount
+        while self.run_next(deadline):
+            pass
+        self.rightNow = deadline
+
+    def run_until(self, condition, timeout):
+        """
+        Run delayed calls until condition() is true or the timeout (in virtual seconds) has passed
+
+        @return: True if the condition was met
+        """
+        deadline = self.rightNow + timeout
+        while not condition():
+            if not self.run_next(deadline):
+                self.rightNow = max(self.rightNow, deadline)
+                return condition()
+        return True
+
+
+class LookupRecorder(object):
+    """
+    Replaces lbrynet.dht.node.iterativeFind while installed, to record the hops, rpcs and duration of every
+    iterative lookup
+    """
+
+    def __init__(self):
+        self.lookups = []
+        self._original = None
+
+    def install(self):
+        self._original = node_module.iterativeFind
+        node_module.iterativeFind = self
+
+    def uninstall(self):
+        node_module.iterativeFind = self._original
+
+    def clear(self):
+        del self.lookups[:]
+
+    def __call__(self, node, shortlist, key, rpc, exclude=None):
+        helper = _IterativeFind(node, shortlist, key, rpc, exclude)
+        record = {'rpc': rpc, 'started': node.clock.seconds(), 'finished': None, 'helper': helper}
+
+        def _finished(result):
+            record['finished'] = node.clock.seconds()
+            record['hops'] = helper.hops
+            record['rpcs'] = len(helper.already_contacted)
+            return result
+
+        helper.finished_deferred.addBoth(_finished)
+        self.lookups.append(record)
+        helper.searchIteration(0)
+        return helper.finished_deferred
+
+
+class DHTSimulation(object):
+    """
+    A network of nodes talking to each other over the mock transport, with configurable latency and packet loss
+    """
+
+    def __init__(self, seeds=8, latency=0.0, jitter=0.0, packet_loss=0.0, seed=None):
+        if not 0 < seeds <= len(MOCK_DHT_SEED_DNS):
+            raise ValueError("between 1 and %i seed nodes are supported" % len(MOCK_DHT_SEED_DNS))
+        MockNetwork.reset()
+        self.clock = VirtualClock()
+        MockNetwork.configure(self.clock, latency, jitter, packet_loss, seed)
+        self.rng = random.Random(seed)
+        self.seed_names = ["lbrynet%i.lbry.io" % (i + 1) for i in range(seeds)]
+        self.known_addresses = [(seed_name, 4444) for seed_name in self.seed_names]
+        self.seeds = []
+        self.nodes = []
+        self.join_times = []
+        self._node_generator = mock_node_generator()
+
+    def _make_node(self):
+        node_id, node_ip = next(self._node_generator)
+        return Node(node_id=node_id.decode('hex'), udpPort=4444, peerPort=3333, externalIP=node_ip,
+                    resolve=resolve, listenUDP=listenUDP, callLater=self.clock.callLater, clock=self.clock)
+
+    def run(self, deferreds, timeout):
+        """
+        Run the clock until the deferreds have all fired or the timeout (in virtual seconds) has passed
+        """
+        dl = defer.DeferredList(deferreds, consumeErrors=True)
+        finished = []
+        dl.addCallback(finished.append)
+        self.clock.run_until(lambda: finished, timeout)
+        return finished[0] if finished else None
+
+    def start_seeds(self, timeout=600):
+        seed_dl = []
+        for _ in self.seed_names:
+            seed = self._make_node()
+            self.seeds.append(seed)
+            seed_dl.append(seed.start(self.known_addresses))
+        return self.run(seed_dl, timeout)
+
+    def add_nodes(self, count, batch_size=50, timeout=600):
+        """
+        Start nodes in batches, waiting for every batch to join the network before starting the next one
+        """
+        while count > 0:
+            batch = []
+            for _ in range(min(batch_size, count)):
+                node = self._make_node()
+                self.nodes.append(node)
+                d = node.start(self.known_addresses)
+                d.addCallback(lambda _, started=self.clock.seconds(): self.join_times.append(
+                    self.clock.seconds() - started))
+                batch.append(d)
+            self.run(batch, timeout)
+            count -= len(batch)
+
+    def remove_nodes(self, count):
+        removed = self.rng.sample(self.nodes, min(count, len(self.nodes)))
+        for node in removed:
+            self.nodes.remove(node)
+            node.stop()
+        return removed
+
+    def churn(self, count, timeout=600):
+        """
+        Replace nodes with new ones
+        """
+        self.remove_nodes(count)
+        self.add_nodes(count, timeout=timeout)
+
+    @property
+    def all_nodes(self):
+        return self.seeds + self.nodes
+
+    def stop(self):
+        self.run([node.stop() for node in self.all_nodes], 60)
+        MockNetwork.reset()
@@ -1,4 +1,5 @@
 import struct
+import random
 import hashlib
 import logging
 from twisted.internet import defer, error
@@ -52,12 +53,24 @@ class MockUDPTransport(object):
         self._node = protocol._node
 
     def write(self, data, address):
+        MockNetwork.datagrams_sent += 1
+        MockNetwork.bytes_sent += len(data)
+        if MockNetwork.packet_loss and MockNetwork.rng.random() < MockNetwork.packet_loss:
+            MockNetwork.datagrams_lost += 1
+            return
+        if MockNetwork.clock is not None and (MockNetwork.latency or MockNetwork.jitter):
+            delay = MockNetwork.latency + MockNetwork.rng.random() * MockNetwork.jitter
+            MockNetwork.clock.callLater(delay, self._deliver, data, address)
+        else:
+            self._deliver(data, address)
+
+    def _deliver(self, data, address):
         if address in MockNetwork.peers:
             dest = MockNetwork.peers[address][0]
             debug_kademlia_packet(data, (self.address, self.port), address, self._node)
             dest.datagramReceived(data, (self.address, self.port))
         else:  # the node is sending to an address that doesnt currently exist, act like it never arrived
-            pass
+            MockNetwork.datagrams_lost += 1
 
 
 class MockUDPPort(object):
@@ -77,6 +90,33 @@ class MockUDPPort(object):
 class MockNetwork(object):
     peers = {}  # (interface, port): (protocol, max_packet_size)
 
+    # network conditions, by default datagrams are delivered immediately and never lost
+    clock = None  # the clock used to delay datagrams, required for latency
+    latency = 0.0  # seconds
+    jitter = 0.0  # maximum additional random delay, in seconds
+    packet_loss = 0.0  # probability of a datagram being dropped
+    rng = random.Random()
+
+    datagrams_sent = 0
+    datagrams_lost = 0
+    bytes_sent = 0
+
+    @classmethod
+    def configure(cls, clock=None, latency=0.0, jitter=0.0, packet_loss=0.0, seed=None):
+        cls.clock = clock
+        cls.latency = latency
+        cls.jitter = jitter
+        cls.packet_loss = packet_loss
+        cls.rng = random.Random(seed)
+
+    @classmethod
+    def reset(cls):
+        cls.peers.clear()
+        cls.configure()
+        cls.datagrams_sent = 0
+        cls.datagrams_lost = 0
+        cls.bytes_sent = 0
+
     @classmethod
     def add_peer(cls, port, protocol, interface, maxPacketSize):
         interface = protocol._node.externalIP
@@ -7,6 +7,7 @@ import lbrynet.dht.protocol
 import lbrynet.dht.contact
 from lbrynet.dht.error import TimeoutError
 from lbrynet.dht.node import Node, rpcmethod
+from lbrynet.dht.metrics import DHTMetrics
 from mock_transport import listenUDP, resolve
 
 log = logging.getLogger()
@@ -160,6 +161,21 @@ class KademliaProtocolTest(unittest.TestCase):
                              'The protocol is still waiting for a RPC result, '
                              'but the transaction is already done!')
 
+    @defer.inlineCallbacks
+    def testMetrics(self):
+        self.node.metrics = DHTMetrics(self._reactor.seconds)
+        self.remote_node.metrics = DHTMetrics(self._reactor.seconds)
+        d = self.remote_contact.ping()
+        self._reactor.advance(2)
+        result = yield d
+        self.assertEqual(result, 'pong')
+        stats = self.node.get_stats()['metrics']
+        self.assertDictEqual(stats['rpcsSent'], {'ping': 1})
+        self.assertEqual(stats['rtt']['ping']['count'], 1)
+        self.assertEqual(stats['datagramsSent'], 1)
+        self.assertEqual(stats['datagramsReceived'], 1)
+        self.assertDictEqual(self.remote_node.get_stats()['metrics']['rpcsReceived'], {'ping': 1})
+
     @defer.inlineCallbacks
     def testDetectProtocolVersion(self):
         original_findvalue = self.remote_node.findValue
@@ -182,7 +198,7 @@ class KademliaProtocolTest(unittest.TestCase):
         d = self.remote_contact.findValue(fake_blob)
         self._reactor.advance(3)
         find_value_response = yield d
-        self.assertEquals(self.remote_contact.protocolVersion, 1)
+        self.assertEquals(self.remote_contact.protocolVersion, lbrynet.dht.constants.protocolVersion)
         self.assertTrue('protocolVersion' not in find_value_response)
 
         self.remote_node.findValue = findValue
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import urllib2
+import subprocess
+from twisted.trial import unittest
+
+import lbrynet
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(lbrynet.__file__)))
+SEED_NODE_SCRIPT = os.path.join(REPO_DIR, 'scripts', 'seed_node.py')
+
+
+def find_free_ports(count, socket_type):
+    # find a range of consecutive ports nothing is bound to
+    for _ in range(100):
+        start = random.randint(20000, 60000 - count)
+        sockets = []
+        try:
+            for port in range(start, start + count):
+                s = socket.socket(socket.AF_INET, socket_type)
+                sockets.append(s)
+                s.bind(('127.0.0.1', port))
+            return start
+        except socket.error:
+            pass
+        finally:
+            for s in sockets:
+                s.close()
+    raise Exception("failed to find %i free ports" % count)
+
+
+class SeedNodeWorkersTest(unittest.TestCase):
+    workers = 2
+    nodes = 4
+    timeout = 60
+
+    def setUp(self):
+        self.rpc_port = find_free_ports(self.workers + 1, socket.SOCK_STREAM)
+        starting_port = find_free_ports(self.nodes, socket.SOCK_DGRAM)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in (REPO_DIR, env.get('PYTHONPATH')) if path)
+        self.process = subprocess.Popen([
+            sys.executable, SEED_NODE_SCRIPT, '--workers', str(self.workers), '--nodes', str(self.nodes),
+            '--rpc_port', str(self.rpc_port), '--starting_port', str(starting_port), '--external_ip', '127.0.0.1'
+        ], env=env)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+    def _call(self, method, **params):
+        request = urllib2.Request('http://127.0.0.1:%i' % self.rpc_port,
+                                  json.dumps({'method': method, 'params': params}))
+        return json.loads(urllib2.urlopen(request, timeout=5).read())['result']
+
+    def _wait_for(self, method, ready):
+        started = time.time()
+        while time.time() - started < self.timeout - 5:
+            self.assertIsNone(self.process.poll(), "the seed node exited")
+            try:
+                result = self._call(method)
+                if ready(result):
+                    return result
+            except (IOError, KeyError, ValueError):
+                pass
+            time.sleep(0.5)
+        self.fail("%s didn't report every worker's nodes in time" % method)
+
+    def test_workers_stats_are_merged(self):
+        workers = self._wait_for('worker_status', lambda result: all(result.values()))
+        self.assertEqual(self.workers, len(workers))
+        self.assertEqual(self.nodes, sum(stats['nodes'] for stats in workers.values()))
+        self.assertEqual(len(set(stats['pid'] for stats in workers.values())), self.workers)
+        nodes = self._wait_for('node_status', lambda result: len(result) == self.nodes)
+        self.assertEqual([True] * self.nodes, nodes.values())
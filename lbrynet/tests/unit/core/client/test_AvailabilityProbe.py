@@ -0,0 +1,69 @@
+import json
+from twisted.internet import defer, reactor
+from twisted.internet.protocol import Protocol, ServerFactory
+from twisted.trial import unittest
+
+from lbrynet.core.Peer import Peer
+from lbrynet.core.json_framing import JSONMessageDecoder
+from lbrynet.core.client.AvailabilityProbe import probe_peers
+
+
+class FakeServerProtocol(Protocol):
+    def connectionMade(self):
+        self.decoder = JSONMessageDecoder()
+
+    def dataReceived(self, data):
+        self.decoder.feed(data)
+        request = self.decoder.next_message()
+        if request is None:
+            return
+        self.factory.requests.append(request)
+        if self.factory.answer:
+            available = [blob_hash for blob_hash in request['requested_blobs'] if blob_hash in self.factory.blobs]
+            response = json.dumps({'available_blobs': available})
+            # split the response to check that it is read in pieces
+            self.transport.write(response[:5])
+            self.transport.write(response[5:])
+
+
+class FakeServerFactory(ServerFactory):
+    protocol = FakeServerProtocol
+
+    def __init__(self, blobs, answer=True):
+        self.blobs = blobs
+        self.answer = answer
+        self.requests = []
+
+
+class TestAvailabilityProbe(unittest.TestCase):
+    def setUp(self):
+        self.blob_hashes = ['a' * 96, 'b' * 96]
+        self.ports = []
+
+    def tearDown(self):
+        return defer.DeferredList([port.stopListening() for port in self.ports])
+
+    def _listen(self, factory):
+        port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+        self.ports.append(port)
+        return Peer('127.0.0.1', port.getHost().port)
+
+    @defer.inlineCallbacks
+    def test_peers_are_asked_for_the_blobs(self):
+        has_both = FakeServerFactory(self.blob_hashes)
+        has_one = FakeServerFactory(self.blob_hashes[1:])
+        peers = [self._listen(has_both), self._listen(has_one)]
+        result = yield probe_peers(peers, self.blob_hashes, 5)
+        self.assertEqual({peers[0]: self.blob_hashes, peers[1]: self.blob_hashes[1:]}, result)
+        self.assertEqual([{'requested_blobs': self.blob_hashes}], has_both.requests)
+
+    @defer.inlineCallbacks
+    def test_peers_that_dont_answer_in_time_are_given_up_on(self):
+        answers = FakeServerFactory(self.blob_hashes)
+        silent = FakeServerFactory(self.blob_hashes, answer=False)
+        # nothing listens on the port of the last peer once its listener has been closed
+        peers = [self._listen(answers), self._listen(silent), self._listen(ServerFactory())]
+        yield self.ports.pop().stopListening()
+        result = yield probe_peers(peers, self.blob_hashes[:1], 0.5)
+        self.assertEqual({peers[0]: self.blob_hashes[:1], peers[1]: None, peers[2]: None}, result)
+        self.assertEqual(1, len(silent.requests))
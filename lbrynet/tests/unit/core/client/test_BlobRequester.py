@@ -0,0 +1,132 @@
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core.Peer import Peer
+from lbrynet.core.client.BlobRequester import BlobRequester, PriceRequest
+
+
+class FakeBlob(object):
+    def __init__(self, blob_hash):
+        self.blob_hash = blob_hash
+
+    def is_downloading(self):
+        return False
+
+
+class FakeDownloadManager(object):
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def needed_blobs(self):
+        return self.blobs
+
+    def get_head_blob_hash(self):
+        return None
+
+
+class FakeStrategy(object):
+    def __init__(self):
+        self.pending_sent_offers = {}
+
+
+class FakePaymentRateManager(object):
+    def __init__(self, rate):
+        self.rate = rate
+        self.strategy = FakeStrategy()
+        self.limit_reached = False
+
+    def price_limit_reached(self, peer):
+        return self.limit_reached
+
+    def get_rate_blob_data(self, peer, blobs):
+        return self.rate
+
+    def record_offer_reply(self, peer, offer):
+        pass
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.blob_data_payment_rate = None
+        self.blob_data_payment_rate_offer = None
+        self.connection_closed = False
+        self.requests = []
+
+    def add_request(self, request):
+        d = defer.Deferred()
+        self.requests.append((request, d))
+        return d
+
+
+class BlobRequesterIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.blobs = [FakeBlob(str(i)) for i in range(3)]
+        self.requester = BlobRequester(None, None, None, None, FakeDownloadManager(self.blobs))
+
+    def test_availability_indexes(self):
+        self.requester._set_hash_unavailable('0', 'peer 1')
+        self.requester._set_hash_available('0', 'peer 1')
+        self.requester._set_hash_available('0', 'peer 2')
+        self.requester._set_hash_available('1', 'peer 2')
+        self.requester._set_hash_unavailable('2', 'peer 2')
+        self.assertSetEqual(self.requester._blob_peers['0'], {'peer 1', 'peer 2'})
+        self.assertSetEqual(self.requester._available_blobs['peer 2'], {'0', '1'})
+        self.assertSetEqual(self.requester._unavailable_blobs['peer 1'], set())
+        self.assertTrue(self.requester._hash_available_on('1', 'peer 2'))
+        self.assertFalse(self.requester._hash_available_on('1', 'peer 1'))
+        self.assertEqual(self.requester._blobs_without_sources(), [self.blobs[2]])
+        self.assertEqual(self.requester._get_hash_for_peer_search().result, '2')
+
+    def test_bad_peers(self):
+        self.requester._update_local_score('peer 1', -10.0)
+        self.requester._add_price_disagreement('peer 2')
+        self.requester._add_incompatible_peer('peer 3')
+        self.requester._update_local_score('peer 4', -1.0)
+        self.assertSetEqual(self.requester._bad_peers, {'peer 1', 'peer 2', 'peer 3'})
+        self.requester._update_local_score('peer 1', 6.0)
+        self.assertSetEqual(self.requester._bad_peers, {'peer 2', 'peer 3'})
+
+
+class SharedConnectionPriceTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = FakeProtocol()
+        self.peer = Peer('1.2.3.4', 3333)
+
+    def _price_request(self, rate):
+        payment_rate_manager = FakePaymentRateManager(rate)
+        requester = BlobRequester(None, None, payment_rate_manager, None, FakeDownloadManager([]))
+        requester._set_hash_available('0', self.peer)
+        return PriceRequest(requester, self.peer, self.protocol, payment_rate_manager)
+
+    def test_streams_share_the_rate_agreed_on_a_connection(self):
+        first, second, cheaper = self._price_request(1.0), self._price_request(1.0), self._price_request(0.5)
+        self.assertTrue(first.can_make_request())
+        first.make_request_and_handle_response()
+        # the others wait for the answer instead of making their own offers
+        self.assertFalse(second.can_make_request())
+        self.assertFalse(cheaper.can_make_request())
+        self.assertEqual(1, len(self.protocol.requests))
+        self.protocol.requests[0][1].callback({'blob_data_payment_rate': 'RATE_ACCEPTED'})
+        self.assertEqual(1.0, self.protocol.blob_data_payment_rate)
+        self.assertIsNone(self.protocol.blob_data_payment_rate_offer)
+        self.assertFalse(second.can_make_request())
+        self.assertFalse(second.connection_rate_too_high())
+        second.use_connection_rate()
+        self.assertEqual(1.0, second.protocol_prices[self.protocol])
+        # a stream that won't pay the rate doesn't use the connection while it is open, without giving up on the peer
+        self.assertFalse(cheaper.can_make_request())
+        self.assertTrue(cheaper.connection_rate_too_high())
+        self.assertFalse(self.successResultOf(cheaper.requestor._send_next_request(self.peer, self.protocol)))
+        self.assertEqual(1, len(self.protocol.requests))
+        self.assertTrue(cheaper.requestor.is_connection_unaffordable(self.peer))
+        self.assertNotIn(self.peer, cheaper.requestor._bad_peers)
+        self.protocol.connection_closed = True
+        self.assertFalse(cheaper.requestor.is_connection_unaffordable(self.peer))
+
+    def test_reaching_the_price_limit_doesnt_give_up_on_the_peer(self):
+        self.protocol.blob_data_payment_rate = 1.0
+        price_request = self._price_request(1.0)
+        price_request.payment_rate_manager.limit_reached = True
+        self.assertTrue(price_request.connection_rate_too_high())
+        self.assertFalse(self.successResultOf(price_request.requestor._send_next_request(self.peer, self.protocol)))
+        self.assertNotIn(self.peer, price_request.requestor._bad_peers)
@@ -0,0 +1,121 @@
+import json
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core import utils
+from lbrynet.core.Peer import Peer
+from lbrynet.core.RateLimiter import DummyRateLimiter
+from lbrynet.core.client.ClientProtocol import ClientProtocolFactory
+from lbrynet.core.client.ClientRequest import ClientBlobRequest
+
+
+class FakeBlob(object):
+    def __init__(self, blob_hash, length):
+        self.blob_hash = blob_hash
+        self.length = length
+        self.data = ''
+        self.finished_deferred = defer.Deferred()
+
+    def write(self, data):
+        self.data += data
+        if len(self.data) == self.length:
+            self.finished_deferred.callback(self)
+
+    def cancel(self, err):
+        if not self.finished_deferred.called:
+            self.finished_deferred.errback(err)
+
+
+class FakeConnectionManager(object):
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def get_next_request(self, peer, protocol):
+        if not self.blobs:
+            return defer.succeed(False)
+        blob = self.blobs.pop(0)
+        protocol.add_blob_request(ClientBlobRequest({'requested_blob': blob.blob_hash}, 'incoming_blob',
+                                                    blob.write, blob.finished_deferred, blob.cancel, blob))
+        return defer.succeed(True)
+
+
+class TestClientProtocolBlobRequests(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings(False)
+        self.clock = task.Clock()
+        self.patch(utils, 'call_later', self.clock.callLater)
+        self.patch(utils, 'timestamp', self.clock.seconds)
+        self.blob_a = FakeBlob('a' * 96, 10)
+        self.blob_b = FakeBlob('b' * 96, 5)
+        factory = ClientProtocolFactory(Peer('1.2.3.4', 3333), DummyRateLimiter(),
+                                        FakeConnectionManager([self.blob_a, self.blob_b]))
+        self.protocol = factory.buildProtocol(('1.2.3.4', 3333))
+        self.transport = proto_helpers.StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def _sent(self):
+        sent = self.transport.value()
+        self.transport.clear()
+        return sent
+
+    def _response(self, blob, **extra):
+        response = {'incoming_blob': {'blob_hash': blob.blob_hash, 'length': blob.length}}
+        response.update(extra)
+        return json.dumps(response)
+
+    def test_pipelined_blob_requests(self):
+        self.assertDictEqual(json.loads(self._sent()), {'requested_blob': self.blob_a.blob_hash,
+                                                        'blob_pipelining': 3, 'blob_offsets': True})
+        self.protocol.dataReceived(self._response(self.blob_a, blob_pipelining=2) + 'aaaa')
+        self.assertEqual(self.protocol.pipelined_blob_requests, 2)
+        # the next blob is requested while the first is being received
+        self.assertDictEqual(json.loads(self._sent()), {'requested_blob': self.blob_b.blob_hash})
+        self.protocol.dataReceived('aaaaaa' + self._response(self.blob_b) + 'bbb')
+        self.assertEqual(self.blob_a.data, 'a' * 10)
+        self.assertEqual(self.blob_b.data, 'bbb')
+        self.assertFalse(self.transport.disconnecting)
+        self.protocol.dataReceived('bb')
+        self.assertEqual(self.blob_b.data, 'b' * 5)
+        self.assertEqual(self._sent(), '')
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_server_without_pipelining(self):
+        self._sent()
+        self.protocol.dataReceived(self._response(self.blob_a) + 'aaaa')
+        self.assertEqual(self.protocol.pipelined_blob_requests, 1)
+        self.assertEqual(self._sent(), '')
+        self.protocol.dataReceived('aaaaaa')
+        self.assertEqual(self.blob_a.data, 'a' * 10)
+        self.assertDictEqual(json.loads(self._sent()), {'requested_blob': self.blob_b.blob_hash})
+        self.protocol.dataReceived(self._response(self.blob_b) + 'bbbbb')
+        self.assertEqual(self.blob_b.data, 'b' * 5)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_blob_from_offset(self):
+        self._sent()
+        self.assertFalse(self.protocol.supports_blob_offsets)
+        response = json.loads(self._response(self.blob_a, blob_offsets=True))
+        response['incoming_blob']['offset'] = 6
+        self.protocol.dataReceived(json.dumps(response) + 'aaaa')
+        self.assertTrue(self.protocol.supports_blob_offsets)
+        # only the rest of the blob follows the response
+        self.assertEqual(self.blob_a.data, 'aaaa')
+        self.assertFalse(self.protocol._downloading_blob)
+
+    def test_blob_download_timings(self):
+        self._sent()
+        self.clock.advance(0.5)
+        self.protocol.dataReceived(self._response(self.blob_a, blob_pipelining=2))
+        self._sent()
+        self.clock.advance(2)
+        self.protocol.dataReceived('a' * 10)
+        peer = self.protocol.peer
+        self.assertEqual((peer.throughput, peer.time_to_first_byte, peer.blob_downloads), (5, 0.5, 1))
+        # the pipelined request waited for the first blob at the server, that time isn't counted
+        self.clock.advance(1)
+        self.protocol.dataReceived(self._response(self.blob_b))
+        self.clock.advance(1)
+        self.protocol.dataReceived('b' * 5)
+        self.assertEqual((peer.throughput, peer.time_to_first_byte, peer.blob_downloads), (5, 0.625, 2))
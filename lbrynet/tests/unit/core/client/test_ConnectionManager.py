@@ -55,6 +55,9 @@ class MocRequestCreator(object):
     def get_new_peers_for_head_blob(self):
         return self.peers_to_return_head_blob
 
+    def is_connection_unaffordable(self, peer):
+        return False
+
 class MocFunctionalQueryHandler(object):
     implements(IQueryHandler)
 
@@ -0,0 +1,153 @@
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core import utils
+from lbrynet.core.Peer import Peer
+from lbrynet.core.RateLimiter import PRIORITY_STREAMING, PRIORITY_DOWNLOAD
+from lbrynet.core.client import ConnectionPool
+from lbrynet.core.client.ConnectionManager import ConnectionManager
+
+
+class FakeConnectionManager(object):
+    def __init__(self, requests=0, rate_limit_priority=PRIORITY_DOWNLOAD):
+        self.requests = requests
+        self.rate_limit_priority = rate_limit_priority
+        self.disconnected = []
+
+    def get_next_request(self, peer, protocol):
+        if not self.requests:
+            return defer.succeed(False)
+        self.requests -= 1
+        protocol.requests.append(self)
+        return defer.succeed(True)
+
+    def peer_disconnected(self, connection_was_made, peer):
+        self.disconnected.append((peer, connection_was_made))
+
+
+class FakeRequestCreator(object):
+    def __init__(self, connection_unaffordable):
+        self.connection_unaffordable = connection_unaffordable
+
+    def send_next_request(self, peer, protocol):
+        return defer.succeed(False)
+
+    def is_connection_unaffordable(self, peer):
+        return self.connection_unaffordable
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.requests = []
+        self.connection_closed = False
+
+    def is_idle(self):
+        return True
+
+
+class FakeConnector(object):
+    def disconnect(self):
+        pass
+
+
+class FakeRateLimiter(object):
+    def __init__(self):
+        self.groups = {}
+
+    def register_protocol(self, protocol, group=None, priority=PRIORITY_DOWNLOAD):
+        self.groups[protocol] = (group, priority)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(utils, 'call_later', self.clock.callLater)
+        self.patch(ConnectionPool.reactor, 'connectTCP', lambda *args, **kwargs: FakeConnector())
+        self.pool = ConnectionPool.ConnectionPool(max_connections=2, idle_timeout=30)
+        self.peers = [Peer('1.2.3.%i' % i, 3333) for i in range(3)]
+        self.protocol = FakeProtocol()
+        self.rate_limiter = FakeRateLimiter()
+
+    def _get_next_request(self, pooled_connection):
+        results = []
+        pooled_connection.get_next_request(pooled_connection.peer, self.protocol).addCallback(results.append)
+        return results
+
+    def test_streams_take_turns(self):
+        stream_a, stream_b = FakeConnectionManager(3), FakeConnectionManager(1)
+        pooled_connection = self.pool.connect(self.peers[0], stream_a, self.rate_limiter)
+        self.assertIs(self.pool.connect(self.peers[0], stream_b, self.rate_limiter), pooled_connection)
+        self.assertEqual(self.pool.num_connections(), 1)
+        for _ in range(4):
+            self.assertEqual(self._get_next_request(pooled_connection), [True])
+        self.assertEqual(self.protocol.requests, [stream_a, stream_b, stream_a, stream_a])
+
+    def test_rate_limited_with_the_highest_priority_stream(self):
+        background = FakeConnectionManager(1)
+        stream = FakeConnectionManager(rate_limit_priority=PRIORITY_STREAMING)
+        pooled_connection = self.pool.connect(self.peers[0], background, self.rate_limiter)
+        self._get_next_request(pooled_connection)
+        self.assertEqual(self.rate_limiter.groups[self.protocol], (background, PRIORITY_DOWNLOAD))
+        self.pool.connect(self.peers[0], stream, self.rate_limiter)
+        self.assertEqual(self.rate_limiter.groups[self.protocol], (stream, PRIORITY_STREAMING))
+        self.pool.release(self.peers[0], stream)
+        self.assertEqual(self.rate_limiter.groups[self.protocol], (background, PRIORITY_DOWNLOAD))
+
+    def test_idle_connection_is_reused(self):
+        stream_a, stream_b = FakeConnectionManager(), FakeConnectionManager(1)
+        pooled_connection = self.pool.connect(self.peers[0], stream_a, self.rate_limiter)
+        results = self._get_next_request(pooled_connection)
+        self.assertEqual(results, [])
+        self.assertTrue(pooled_connection.is_idle())
+        self.clock.advance(20)
+        self.assertIs(self.pool.connect(self.peers[0], stream_b, self.rate_limiter), pooled_connection)
+        pooled_connection.wake()
+        self.assertEqual(results, [True])
+        self.assertEqual(self.protocol.requests, [stream_b])
+        # it's closed once no stream has had a request for it for the idle timeout
+        results = self._get_next_request(pooled_connection)
+        self.clock.advance(30)
+        self.assertEqual(results, [False])
+
+    def test_connection_cap(self):
+        streams = [FakeConnectionManager() for _ in self.peers]
+        idle = self.pool.connect(self.peers[0], streams[0], self.rate_limiter)
+        idle_results = self._get_next_request(idle)
+        self.pool.connect(self.peers[1], streams[1], self.rate_limiter)
+        # the idle connection is closed to make room for the new one
+        self.assertIsNotNone(self.pool.connect(self.peers[2], streams[2], self.rate_limiter))
+        self.assertEqual(idle_results, [False])
+        self.assertFalse(self.pool.has_connection(self.peers[0]))
+        # neither of the others is idle
+        self.assertIsNone(self.pool.connect(self.peers[0], streams[0], self.rate_limiter))
+        self.assertEqual(self.pool.num_connections(), 2)
+
+    def test_release_and_connection_lost(self):
+        stream_a, stream_b = FakeConnectionManager(), FakeConnectionManager()
+        pooled_connection = self.pool.connect(self.peers[0], stream_a, self.rate_limiter)
+        self.pool.connect(self.peers[0], stream_b, self.rate_limiter)
+        self.assertFalse(self.pool.release(self.peers[0], stream_a))
+        self.assertTrue(self.pool.release(self.peers[0], stream_b))
+        pooled_connection.factory.connection_was_made_deferred.callback(True)
+        self.assertFalse(self.pool.has_connection(self.peers[0]))
+        self.assertEqual(stream_b.disconnected, [(self.peers[0], True)])
+        self.assertEqual(stream_a.disconnected, [])
+
+    def test_stream_leaves_a_connection_it_wont_pay_for(self):
+        conf.initialize_settings(False)
+        other = FakeConnectionManager(1)
+        streams = [ConnectionManager(None, self.rate_limiter, [FakeRequestCreator(unaffordable)], [], self.pool)
+                   for unaffordable in (True, False)]
+        self.pool.connect(self.peers[0], other, self.rate_limiter)
+        for stream in streams:
+            stream.stopped = False
+            stream._connect_to_peer(self.peers[0])
+        results = [self.successResultOf(stream.get_next_request(self.peers[0], self.protocol))
+                   for stream in streams]
+        self.assertEqual([False, False], results)
+        # the stream that won't pay the rate of the connection frees its place for another peer, the other waits
+        # for the connection to have something for it
+        self.assertNotIn(self.peers[0], streams[0]._peer_connections)
+        self.assertIn(self.peers[0], streams[1]._peer_connections)
+        self.assertEqual([other, streams[1]], self.pool._connections[self.peers[0]].connection_managers)
@@ -0,0 +1,65 @@
+from twisted.trial import unittest
+
+from lbrynet.core.client.DownloadScheduler import DownloadScheduler
+
+
+class FakeWriter(object):
+    def __init__(self, len_so_far):
+        self.len_so_far = len_so_far
+
+
+class FakeBlob(object):
+    def __init__(self, blob_hash):
+        self.blob_hash = blob_hash
+        self.writers = {}
+
+    def is_downloading(self):
+        return bool(self.writers)
+
+    def add_writer(self, peer, len_so_far=0):
+        self.writers[peer] = (FakeWriter(len_so_far), None)
+
+
+class DownloadSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DownloadScheduler(window_size=2, max_endgame_writers=2)
+        self.blobs = [FakeBlob(str(i)) for i in range(6)]
+        all_hashes = [blob.blob_hash for blob in self.blobs]
+        self.available = {'peer 1': all_hashes, 'peer 2': all_hashes, 'peer 3': ['4', '5']}
+
+    def _hashes(self, peer, blobs=None):
+        blob_peers = {}
+        for available_peer, blob_hashes in self.available.iteritems():
+            for blob_hash in blob_hashes:
+                blob_peers.setdefault(blob_hash, set()).add(available_peer)
+        return [blob.blob_hash for blob in
+                self.scheduler.blobs_for_peer(peer, self.blobs if blobs is None else blobs, blob_peers)]
+
+    def test_window_in_order_then_rarest_first(self):
+        self.assertEqual(self._hashes('peer 1'), ['0', '1', '2', '3', '4', '5'])
+        self.assertEqual(self._hashes('peer 3'), ['4', '5'])
+        del self.available['peer 3']
+        self.available['peer 2'] = ['0', '1', '2', '4']
+        self.assertEqual(self._hashes('peer 1'), ['0', '1', '3', '5', '2', '4'])
+
+    def test_blobs_in_flight_are_skipped(self):
+        self.blobs[0].add_writer('peer 2')
+        self.blobs[2].add_writer('peer 1')
+        self.assertEqual(self._hashes('peer 1'), ['1', '3', '4', '5'])
+        self.assertEqual(self._hashes('peer 2'), ['1', '3', '4', '5'])
+
+    def test_endgame(self):
+        self.blobs[0].add_writer('peer 1', 100)
+        self.blobs[4].add_writer('peer 1', 50)
+        self.blobs[5].add_writer('peer 1')
+        self.blobs[5].add_writer('peer 2')
+        # peer 3 has no blobs left that aren't being downloaded, the one with the least data received goes first
+        self.assertEqual(self._hashes('peer 3'), ['4'])
+        self.blobs[5].writers.clear()
+        self.blobs[5].add_writer('peer 1', 10)
+        self.assertEqual(self._hashes('peer 3'), ['5', '4'])
+        # peer 2 still has blobs nobody is downloading
+        self.assertEqual(self._hashes('peer 2'), ['1', '2', '3'])
+        for blob in self.blobs[1:4]:
+            blob.add_writer('peer 1')
+        self.assertEqual(self._hashes('peer 2'), ['1', '2', '3', '5', '4', '0'])
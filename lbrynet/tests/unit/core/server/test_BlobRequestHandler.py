@@ -7,6 +7,7 @@ from twisted.trial import unittest
 
 from lbrynet.core import Peer
 from lbrynet.core.server import BlobRequestHandler
+from lbrynet.core.server.UploadScheduler import UploadScheduler
 from lbrynet.core.PaymentRateManager import NegotiatedPaymentRateManager, BasePaymentRateManager
 from lbrynet.tests.mocks\
     import BlobAvailabilityTracker as DummyBlobAvailabilityTracker, mock_conf_settings
@@ -24,6 +25,10 @@ class TestBlobRequestHandlerQueries(unittest.TestCase):
     def test_empty_response_when_empty_query(self):
         self.assertEqual({}, self.successResultOf(self.handler.handle_queries({})))
 
+    def test_pipelined_blob_requests_are_capped(self):
+        deferred = self.handler.handle_queries({'blob_pipelining': 10})
+        self.assertEqual({'blob_pipelining': 3}, self.successResultOf(deferred))
+
     def test_error_set_when_rate_is_missing(self):
         query = {'requested_blob': 'blob'}
         deferred = self.handler.handle_queries(query)
@@ -108,6 +113,53 @@ class TestBlobRequestHandlerQueries(unittest.TestCase):
         result = self.successResultOf(deferred)
         self.assertEqual(response, result)
 
+    def test_offsets_are_advertised(self):
+        deferred = self.handler.handle_queries({'blob_offsets': True})
+        self.assertEqual({'blob_offsets': True}, self.successResultOf(deferred))
+
+    def test_blob_is_sent_from_the_requested_offset(self):
+        blob = mock.Mock()
+        blob.get_is_verified.return_value = True
+        blob.blob_hash = 'DEADBEEF'
+        blob.length = 42
+        self.handler.peer = mock.Mock()
+        self.blob_manager.get_blob.return_value = defer.succeed(blob)
+        query = {
+            'blob_data_payment_rate': 1.0,
+            'requested_blob': 'blob',
+            'requested_blob_offset': 40
+        }
+        result = self.successResultOf(self.handler.handle_queries(query))
+        self.assertEqual({'blob_hash': 'DEADBEEF', 'length': 42, 'offset': 40}, result['incoming_blob'])
+        blob.open_for_reading.return_value.seek.assert_called_once_with(40)
+        self.assertEqual(40, self.handler.upload_offset)
+
+        query['requested_blob_offset'] = 42
+        result = self.successResultOf(self.handler.handle_queries(query))
+        self.assertEqual({'error': 'INVALID_OFFSET'}, result['incoming_blob'])
+
+    def test_busy_when_upload_slots_are_busy(self):
+        blob = mock.Mock()
+        blob.get_is_verified.return_value = True
+        blob.blob_hash = 'DEADBEEF'
+        blob.length = 42
+        self.handler.peer = Peer.Peer('1.2.3.4', 3333)
+        self.handler.upload_scheduler = UploadScheduler(1)
+        self.blob_manager.get_blob.side_effect = lambda _: defer.succeed(blob)
+        query = {
+            'blob_data_payment_rate': 1.0,
+            'requested_blob': 'blob'
+        }
+        self.successResultOf(self.handler.handle_queries(query))
+        self.assertEqual(1, self.handler.upload_scheduler.num_active())
+        self.handler.cancel_send(None)
+        self.assertEqual(0, self.handler.upload_scheduler.num_active())
+
+        self.handler.upload_scheduler.request_slot(Peer.Peer('1.2.3.5', 3333), 'CAFEBABE')
+        result = self.successResultOf(self.handler.handle_queries(query))
+        self.assertEqual({'error': 'BUSY', 'retry_in': 2}, result['incoming_blob'])
+        self.assertIsNone(self.handler.upload_slot)
+
 
 class TestBlobRequestHandlerSender(unittest.TestCase):
     def test_nothing_happens_if_not_currently_uploading(self):
@@ -0,0 +1,110 @@
+import StringIO
+
+from twisted.internet import defer
+from twisted.protocols.basic import FileSender
+from twisted.trial import unittest
+
+from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
+
+
+class PausingConsumer(object):
+    """ Pauses its producer once more than buffer_size bytes have been written since it was last resumed """
+
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self.buffered = 0
+        self.written = []
+        self.producer = None
+        self.unregistered = False
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.unregistered = True
+
+    def write(self, data):
+        self.written.append(data)
+        self.buffered += len(data)
+        if self.buffered > self.buffer_size:
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.buffered = 0
+        self.producer.resumeProducing()
+
+
+class TestServerRequestHandlerUpload(unittest.TestCase):
+    def setUp(self):
+        self.consumer = PausingConsumer(2 ** 16)
+        self.handler = ServerRequestHandler(self.consumer)
+        self.data = ''.join(chr(i % 256) for i in range(2 ** 20 + 1000))
+
+    def _send_file(self):
+        return FileSender().beginFileTransfer(StringIO.StringIO(self.data), self.handler)
+
+    def test_write_until_paused(self):
+        self.handler.send_response({'incoming_blob': {'length': len(self.data)}})
+        d = self._send_file()
+        self.assertNoResult(d)
+        written = sum(len(chunk) for chunk in self.consumer.written)
+        self.assertGreater(written, self.consumer.buffer_size)
+        self.assertLessEqual(written, self.consumer.buffer_size + 2 * self.handler.CHUNK_SIZE)
+        while self.handler.producer is not None:
+            self.consumer.drain()
+        self.successResultOf(d)
+        self.assertEqual(''.join(self.consumer.written), '{"incoming_blob": {"length": 1049576}}' + self.data)
+        self.assertTrue(all(len(chunk) <= self.handler.CHUNK_SIZE for chunk in self.consumer.written))
+
+    def test_large_write_is_split(self):
+        self.handler.pauseProducing()
+        self.handler.write(self.data)
+        self.assertEqual(self.consumer.written, [])
+        self.handler.resumeProducing()
+        self.assertEqual(len(self.consumer.written), 5)
+        while self.handler.response_buff:
+            self.consumer.drain()
+        self.assertEqual(''.join(self.consumer.written), self.data)
+
+    def test_stop_producing(self):
+        d = self._send_file()
+        self.handler.stopProducing()
+        self.assertTrue(self.consumer.unregistered)
+        self.failureResultOf(d)
+        self.assertIsNone(self.handler.producer)
+
+
+class FakeBlobSender(object):
+    # answers requests for a blob with its length and uploads it after the response
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.requested = None
+
+    def handle_queries(self, queries):
+        self.requested = queries['requested_blob']
+        return defer.succeed({'incoming_blob': {'length': len(self.blobs[self.requested])}})
+
+    def send_blob_if_requested(self, consumer):
+        blob, self.requested = self.blobs[self.requested], None
+        return FileSender().beginFileTransfer(StringIO.StringIO(blob), consumer)
+
+    def cancel_send(self, err):
+        return err
+
+
+class TestServerRequestHandlerPipelining(unittest.TestCase):
+    def setUp(self):
+        self.consumer = PausingConsumer(2 ** 16)
+        self.handler = ServerRequestHandler(self.consumer)
+        self.blobs = {'a': 'a' * 100000, 'b': 'b' * 1000}
+        blob_sender = FakeBlobSender(self.blobs)
+        self.handler.register_query_handler(blob_sender, ['requested_blob'])
+        self.handler.register_blob_sender(blob_sender)
+
+    def test_requests_are_answered_in_order(self):
+        self.handler.data_received('{"requested_blob": "a"}{"requested_blob": "b"}')
+        while self.handler.producer is not None or self.handler.request_received:
+            self.consumer.drain()
+        self.assertEqual(''.join(self.consumer.written),
+                         '{"incoming_blob": {"length": 100000}}' + self.blobs['a'] +
+                         '{"incoming_blob": {"length": 1000}}' + self.blobs['b'])
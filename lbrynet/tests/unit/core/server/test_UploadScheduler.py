@@ -0,0 +1,80 @@
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet.core import utils
+from lbrynet.core.Peer import Peer
+from lbrynet.core.Error import UploadSlotsBusyError
+from lbrynet.core.server.UploadScheduler import UploadScheduler
+
+
+class TestUploadScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(utils, 'call_later', self.clock.callLater)
+        self.patch(utils, 'timestamp', self.clock.seconds)
+        self.scheduler = UploadScheduler(2, 3)
+        self.peers = [Peer('1.2.3.%i' % i, 3333) for i in range(3)]
+
+    def _request(self, peer, blob_hash='a' * 96):
+        return self.scheduler.request_slot(peer, blob_hash)
+
+    def test_slots_are_given_until_they_are_used_up(self):
+        first = self.successResultOf(self._request(self.peers[0]))
+        self.successResultOf(self._request(self.peers[1]))
+        waiting = self._request(self.peers[2])
+        self.assertNoResult(waiting)
+        self.assertEqual(1, self.scheduler.num_queued())
+        first.release()
+        self.assertEqual(self.peers[2], self.successResultOf(waiting).peer)
+        self.assertEqual(2, self.scheduler.num_active())
+        self.assertEqual(0, self.scheduler.num_queued())
+
+    def test_waiting_hosts_take_turns(self):
+        slots = [self.successResultOf(self._request(peer)) for peer in self.peers[:2]]
+        # the first host queues two requests before the second host queues one
+        waiting = [self._request(self.peers[0]), self._request(self.peers[0]), self._request(self.peers[1])]
+        slots[0].release()
+        self.successResultOf(waiting[0]).release()
+        self.assertNoResult(waiting[1])
+        self.successResultOf(waiting[2])
+
+    def test_busy_when_the_queue_is_full(self):
+        for peer in self.peers[:2]:
+            self._request(peer)
+        for _ in range(3):
+            self._request(self.peers[2])
+        err = self.failureResultOf(self._request(self.peers[2]), UploadSlotsBusyError)
+        self.assertEqual(int(UploadScheduler.DEFAULT_UPLOAD_SECONDS * 2), err.value.retry_in)
+        self.assertEqual(1, self.scheduler.uploads_refused)
+
+    def test_busy_when_waiting_too_long(self):
+        for peer in self.peers[:2]:
+            self._request(peer)
+        waiting = self._request(self.peers[2])
+        self.clock.advance(UploadScheduler.QUEUE_TIMEOUT)
+        self.failureResultOf(waiting, UploadSlotsBusyError)
+        self.assertEqual(0, self.scheduler.num_queued())
+
+    def test_cancelled_request_leaves_the_queue(self):
+        slot = self.successResultOf(self._request(self.peers[0]))
+        self._request(self.peers[1])
+        waiting = self._request(self.peers[2])
+        waiting.cancel()
+        self.failureResultOf(waiting, defer.CancelledError)
+        self.assertEqual(0, self.scheduler.num_queued())
+        slot.release()
+        self.assertEqual(1, self.scheduler.num_active())
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_retry_time_follows_upload_times(self):
+        slot = self.successResultOf(self._request(self.peers[0]))
+        slot.report_bytes(2 ** 20)
+        self.clock.advance(10)
+        self.assertEqual(2 ** 20 / 10.0, slot.throughput)
+        stats = self.scheduler.get_stats()
+        self.assertEqual([str(self.peers[0])], [upload['peer'] for upload in stats['active_uploads']])
+        slot.release()
+        slot.release()
+        self.assertEqual(0, self.scheduler.num_active())
+        # the moving average of upload times moves a quarter of the way to 10 seconds
+        self.assertEqual(4, self.scheduler.retry_in())
@@ -1,15 +1,19 @@
+import random
 from mock import MagicMock
 
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
 from lbrynet.blob import BlobFile
+from lbrynet.core import utils
+from lbrynet.core import HTTPBlobDownloader as mirror_downloader
 from lbrynet.core.HTTPBlobDownloader import HTTPBlobDownloader
 from lbrynet.tests.util import mk_db_and_blob_dir, rm_db_and_blob_dir
 
 
 class HTTPBlobDownloaderTest(unittest.TestCase):
     def setUp(self):
+        self.patch(mirror_downloader, '_mirrors', {})
         self.db_dir, self.blob_dir = mk_db_and_blob_dir()
         self.blob_manager = MagicMock()
         self.client = MagicMock()
@@ -59,6 +63,7 @@ class HTTPBlobDownloaderTest(unittest.TestCase):
         self.client.collect.side_effect = lambda response, write: defer.fail(Exception())
         yield self.downloader.start()
         self.assertEqual(len(self.client.collect.mock_calls), self.downloader.max_failures)
+        self.assertEqual(self.downloader.MIN_CONCURRENCY, self.downloader.concurrency)
         self.blob_manager.get_blob.assert_called_with(self.blob_hash)
         self.assertEqual(self.blob.get_length(), self.response.length)
         self.assertEqual(self.blob.get_is_verified(), False)
@@ -67,10 +72,13 @@ class HTTPBlobDownloaderTest(unittest.TestCase):
     @defer.inlineCallbacks
     def test_blob_not_found(self):
         self.response.code = 404
+        self.downloader.servers = ['server1', 'server2']
         yield self.downloader.start()
         self.blob_manager.get_blob.assert_called_with(self.blob_hash)
-        self.client.get.assert_called_with('http://{}/{}'.format('server1', self.blob_hash))
+        self.assertEqual(2, len(self.client.get.mock_calls))
         self.client.collect.assert_not_called()
+        # a mirror not having the blob isn't a failure to back off from
+        self.assertEqual(self.downloader.INITIAL_CONCURRENCY, self.downloader.concurrency)
         self.assertEqual(self.blob.get_is_verified(), False)
         self.assertEqual(self.blob.writers, {})
 
@@ -86,6 +94,58 @@ class HTTPBlobDownloaderTest(unittest.TestCase):
         self.assertEqual(self.blob.get_is_verified(), False)
         self.assertEqual(self.blob.writers, {})
 
+    @defer.inlineCallbacks
+    def test_slow_download_is_hedged(self):
+        clock = task.Clock()
+        self.patch(utils, 'call_later', clock.callLater)
+        self.downloader.servers = ['server1', 'server2']
+        collects = [lambda response, write: defer.Deferred(), collect]
+        # the first mirror asked stalls and the second one sends the blob
+        self.client.collect.side_effect = lambda response, write: collects.pop(0)(response, write)
+        d = self.downloader.start()
+        self.assertEqual(1, len(self.client.get.mock_calls))
+        clock.advance(self.downloader.MIN_HEDGE_DELAY)
+        self.assertEqual(1, len(self.client.get.mock_calls))
+        clock.advance(self.downloader.HEDGE_FACTOR * 5)
+        self.assertEqual(2, len(self.client.get.mock_calls))
+        self.assertNotEqual(self.client.get.mock_calls[0], self.client.get.mock_calls[1])
+        yield d
+        self.assertEqual(self.blob.get_is_verified(), True)
+        # the stalled download was cancelled
+        self.assertEqual(self.blob.writers, {})
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_faster_mirrors_are_chosen_more(self):
+        self.downloader.servers = ['fast', 'slow']
+        mirror_downloader.get_mirror('fast').report_blob_download(2 ** 21, 1.0, 0.1)
+        mirror_downloader.get_mirror('slow').report_blob_download(2 ** 21, 10.0, 1.0)
+        random.seed(0)
+        chosen = [self.downloader._choose_mirror(self.blob).server for _ in range(1000)]
+        self.assertGreater(chosen.count('fast'), 850)
+        fast = mirror_downloader.get_mirror('fast')
+        self.assertEqual('slow', self.downloader._choose_mirror(self.blob, [fast]).server)
+
+    def test_concurrency_follows_throughput(self):
+        clock = task.Clock()
+        self.patch(utils, 'timestamp', clock.seconds)
+        downloader = self.downloader
+
+        def download_round(throughput):
+            blobs = downloader.concurrency
+            for _ in range(blobs):
+                clock.advance(1)
+                downloader._report_downloaded(throughput, 1)
+
+        download_round(2 ** 20)
+        self.assertEqual(3, downloader.concurrency)
+        download_round(2 ** 21)
+        self.assertEqual(4, downloader.concurrency)
+        # more connections stopped helping, so use fewer
+        download_round(2 ** 21)
+        self.assertEqual(3, downloader.concurrency)
+        downloader._set_concurrency(100)
+        self.assertEqual(downloader.MAX_CONCURRENCY, downloader.concurrency)
+
 
 def collect(response, write):
     write('f' * response.length)
@@ -5,6 +5,8 @@ from lbrynet.core.Error import DownloadCanceledError, InvalidDataError
 from lbrynet.tests.util import mk_db_and_blob_dir, rm_db_and_blob_dir, random_lbry_hash
 from twisted.trial import unittest
 from twisted.internet import defer
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
 
 class BlobFileTest(unittest.TestCase):
     def setUp(self):
@@ -154,3 +156,35 @@ class BlobFileTest(unittest.TestCase):
         # second write should fail to save
         yield self.assertFailure(blob_file.save_verified_blob(writer_2), DownloadCanceledError)
 
+    @defer.inlineCallbacks
+    def test_resume_interrupted_write(self):
+        blob_file = BlobFile(self.blob_dir, self.fake_content_hash, self.fake_content_len)
+        writer_1, finished_d_1 = blob_file.open_for_writing(peer=1)
+        writer_1.write(self.fake_content[:10])
+        writer_1.close(Failure(ConnectionLost()))
+        yield self.assertFailure(finished_d_1, ConnectionLost)
+
+        # a writer that doesn't resume starts from the beginning and leaves the partial download for the next one
+        writer_2, finished_d_2 = blob_file.open_for_writing(peer=2)
+        self.assertEqual(0, writer_2.offset)
+        writer_3, finished_d_3 = blob_file.open_for_writing(peer=3, resume=True)
+        self.assertEqual(10, writer_3.offset)
+        writer_3.write(self.fake_content[10:])
+        out = yield finished_d_3
+        self.assertTrue(out.verified)
+        yield self.assertFailure(finished_d_2, DownloadCanceledError)
+        f = blob_file.open_for_reading()
+        self.assertEqual(self.fake_content, bytearray(f.read()))
+        f.close()
+
+    @defer.inlineCallbacks
+    def test_bad_data_is_not_resumed(self):
+        blob_file = BlobFile(self.blob_dir, self.fake_content_hash, self.fake_content_len)
+        writer_1, finished_d_1 = blob_file.open_for_writing(peer=1)
+        writer_1.write(self.fake_content[:10])
+        writer_1.close(Failure(InvalidDataError()))
+        yield self.assertFailure(finished_d_1, InvalidDataError)
+        writer_2, finished_d_2 = blob_file.open_for_writing(peer=2, resume=True)
+        self.assertEqual(0, writer_2.offset)
+        writer_2.close()
+        yield self.assertFailure(finished_d_2, DownloadCanceledError)
@@ -0,0 +1,71 @@
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core import utils
+from lbrynet.core.Peer import rank_peers
+from lbrynet.core.PeerManager import PeerManager
+
+
+class FakeStorage(object):
+    def __init__(self, reputations):
+        self.reputations = {(r[0], r[1]): r for r in reputations}
+
+    def get_peer_reputations(self, seen_since):
+        return defer.succeed([r for r in self.reputations.itervalues() if r[6] >= seen_since])
+
+    def save_peer_reputations(self, reputations):
+        self.reputations.update({(r[0], r[1]): r for r in reputations})
+        return defer.succeed(None)
+
+
+class PeerReputationTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000000000.0
+        self.patch(utils, 'timestamp', lambda: self.now)
+        self.peer_manager = PeerManager()
+
+    def test_moving_averages(self):
+        peer = self.peer_manager.get_peer('1.2.3.4', 3333)
+        self.assertIs(peer, self.peer_manager.get_peer('1.2.3.4', 3333))
+        peer.report_blob_download(2 ** 20, 1.0, 0.2)
+        self.assertEqual(peer.throughput, 2 ** 20)
+        self.assertEqual(peer.time_to_first_byte, 0.2)
+        peer.report_blob_download(2 ** 20, 0.5, 0.6)
+        self.assertEqual(peer.throughput, 2 ** 20 * 1.25)
+        self.assertAlmostEqual(peer.time_to_first_byte, 0.3)
+        self.assertEqual(peer.last_seen, self.now)
+        self.assertTrue(peer.reputation_changed)
+
+    def test_rank_peers(self):
+        fast, slow, unknown, failing = [self.peer_manager.get_peer('1.2.3.%i' % i, 3333) for i in range(4)]
+        fast.report_blob_download(2 ** 21, 2.0, 0.1)
+        slow.report_blob_download(2 ** 21, 200.0, 0.1)
+        failing.report_blob_download(2 ** 21, 2.0, 0.1)
+        for _ in range(20):
+            failing.report_down()
+        # retrying the failing peer is slower than trying an unknown one, but faster than downloading from the slow one
+        self.assertEqual(rank_peers([slow, failing, unknown, fast]), [fast, unknown, failing, slow])
+
+
+class PeerManagerStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000000000.0
+        self.patch(utils, 'timestamp', lambda: self.now)
+
+    @defer.inlineCallbacks
+    def test_save_and_load_reputations(self):
+        old = self.now - PeerManager.REPUTATION_MAX_AGE - 1
+        storage = FakeStorage([('1.2.3.4', 3333, 1000.0, 0.5, 3, 1, self.now - 10),
+                               ('1.2.3.5', 3333, 1000.0, 0.5, 3, 1, old)])
+        peer_manager = PeerManager(storage)
+        yield peer_manager.start()
+        peer = peer_manager.get_peer('1.2.3.4', 3333)
+        self.assertEqual(peer.get_reputation(), (1000.0, 0.5, 3, 1, self.now - 10))
+        self.assertIsNone(peer_manager.get_peer('1.2.3.5', 3333).throughput)
+
+        peer.report_blob_download(3000, 1.0, 0.5)
+        peer_manager.get_peer('1.2.3.6', 3333).report_down()
+        yield peer_manager.stop()
+        self.assertEqual(storage.reputations[('1.2.3.4', 3333)], ('1.2.3.4', 3333, 1500.0, 0.5, 4, 1, self.now))
+        self.assertEqual(storage.reputations[('1.2.3.6', 3333)], ('1.2.3.6', 3333, None, None, 0, 1, None))
+        self.assertFalse(peer.reputation_changed)
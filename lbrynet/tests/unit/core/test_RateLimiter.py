@@ -0,0 +1,91 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from lbrynet.core import utils
+from lbrynet.core import RateLimiter
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.download_paused = False
+        self.upload_paused = False
+        self.downloaded = 0
+
+    def throttle_download(self):
+        self.download_paused = True
+
+    def unthrottle_download(self):
+        self.download_paused = False
+
+    def throttle_upload(self):
+        self.upload_paused = True
+
+    def unthrottle_upload(self):
+        self.upload_paused = False
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(utils, 'call_later', self.clock.callLater)
+        self.patch(utils, 'timestamp', self.clock.seconds)
+        self.rate_limiter = RateLimiter.RateLimiter(max_dl_bytes=100000)
+
+    def _download(self, protocols, seconds, chunk_size=2000, step=0.01):
+        # protocols read as much as they can until they are paused
+        for _ in range(int(seconds / step)):
+            for protocol in protocols:
+                if not protocol.download_paused:
+                    protocol.downloaded += chunk_size
+                    self.rate_limiter.report_dl_bytes(chunk_size, protocol)
+            self.clock.advance(step)
+
+    def test_fair_share_by_priority(self):
+        stream, background = FakeProtocol(), FakeProtocol()
+        self.rate_limiter.register_protocol(stream, 'stream', RateLimiter.PRIORITY_STREAMING)
+        self.rate_limiter.register_protocol(background, 'background', RateLimiter.PRIORITY_DOWNLOAD)
+        self._download([stream, background], 20)
+        self.assertApproximates((stream.downloaded + background.downloaded) / 20.0, 100000, 5000)
+        self.assertApproximates(float(stream.downloaded) / background.downloaded, 4, 0.5)
+
+    def test_connections_of_a_group_share_it(self):
+        protocols = [FakeProtocol() for _ in range(3)]
+        for protocol in protocols:
+            self.rate_limiter.register_protocol(protocol, 'stream')
+        self._download(protocols, 20)
+        for protocol in protocols:
+            self.assertApproximates(protocol.downloaded / 20.0, 33333, 3000)
+
+    def test_unused_share_is_borrowed(self):
+        stream, background = FakeProtocol(), FakeProtocol()
+        self.rate_limiter.register_protocol(stream, 'stream', RateLimiter.PRIORITY_STREAMING)
+        self.rate_limiter.register_protocol(background, 'background', RateLimiter.PRIORITY_DOWNLOAD)
+        self._download([background], 20)
+        self.assertApproximates(background.downloaded / 20.0, 100000, 5000)
+
+    def test_unthrottled_when_unregistered_or_unlimited(self):
+        first, second = FakeProtocol(), FakeProtocol()
+        self.rate_limiter.register_protocol(first)
+        self.rate_limiter.register_protocol(second)
+        self.rate_limiter.report_dl_bytes(200000, first)
+        self.rate_limiter.report_dl_bytes(200000, second)
+        self.assertTrue(first.download_paused and second.download_paused)
+        self.assertFalse(first.upload_paused)
+        self.rate_limiter.unregister_protocol(first)
+        self.assertFalse(first.download_paused)
+        self.rate_limiter.set_dl_limit(None)
+        self.assertFalse(second.download_paused)
+        self.assertEqual(400000, self.rate_limiter.total_dl_bytes)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_zero_limit_is_unlimited(self):
+        protocol = FakeProtocol()
+        self.rate_limiter.register_protocol(protocol)
+        self.rate_limiter.report_dl_bytes(200000, protocol)
+        self.assertTrue(protocol.download_paused)
+        self.rate_limiter.set_dl_limit(0)
+        self.assertIsNone(self.rate_limiter.max_dl_bytes)
+        self.assertFalse(protocol.download_paused)
+        self.rate_limiter.report_dl_bytes(200000, protocol)
+        self.assertFalse(protocol.download_paused)
+        self.assertRaises(ValueError, self.rate_limiter.set_ul_limit, -1)
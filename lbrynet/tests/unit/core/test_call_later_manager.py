@@ -0,0 +1,46 @@
+from twisted.internet import task
+from twisted.trial import unittest
+from lbrynet.core.call_later_manager import CallLaterManager, QUEUE_SIZE_THRESHOLD
+
+
+class CallLaterManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.manager = CallLaterManager(self.clock.callLater)
+        self.called = []
+
+    def test_call_later(self):
+        call, _ = self.manager.call_later(1, self.called.append, 'a')
+        self.assertTrue(call.active())
+        self.clock.advance(1)
+        self.assertEqual(self.called, ['a'])
+        self.assertEqual(len(self.manager._pendingCallLaters), 0)
+
+    def test_cancel(self):
+        _, cancel = self.manager.call_later(1, self.called.append, 'a')
+        self.manager.call_later(2, self.called.append, 'b')
+        self.assertEqual(cancel('reason'), 'reason')
+        self.assertEqual(len(self.manager._pendingCallLaters), 1)
+        self.clock.advance(2)
+        self.assertEqual(self.called, ['b'])
+        # cancelling a call that already ran or was cancelled does nothing
+        cancel()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_stop_cancels_pending_calls(self):
+        for i in range(5):
+            self.manager.call_later(i, self.called.append, i)
+        self.clock.advance(1)
+        self.manager.stop()
+        self.clock.advance(5)
+        self.assertEqual(self.called, [0, 1])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+        self.assertEqual(len(self.manager._pendingCallLaters), 0)
+
+    def test_call_soon_delay_grows_with_pending_calls(self):
+        self.assertEqual(self.manager.get_min_delay(), 0)
+        for _ in range(QUEUE_SIZE_THRESHOLD + 1):
+            self.manager.call_later(10, self.called.append, None)
+        self.assertGreater(self.manager.get_min_delay(), 0)
+        self.manager.stop()
+        self.assertEqual(self.manager.get_min_delay(), 0)
@@ -0,0 +1,52 @@
+import json
+import random
+from twisted.trial import unittest
+from lbrynet.core.json_framing import JSONMessageDecoder
+
+
+class JSONMessageDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = JSONMessageDecoder()
+
+    def test_split_message(self):
+        message = {'available_blobs': ['a' * 96, 'b' * 96], 'blob_data_payment_rate': 'RATE_ACCEPTED',
+                   'text': 'braces } { and "quotes" \\ in strings'}
+        data = json.dumps(message)
+        rng = random.Random(0)
+        for _ in range(20):
+            position = 0
+            while position < len(data):
+                self.assertIsNone(self.decoder.next_message())
+                size = rng.randint(1, 10)
+                self.decoder.feed(data[position:position + size])
+                position += size
+            self.assertDictEqual(self.decoder.next_message(), message)
+            self.assertEqual(len(self.decoder), 0)
+
+    def test_escape_at_chunk_boundary(self):
+        self.decoder.feed('{"a": "\\')
+        self.decoder.feed('"}"}')
+        self.assertDictEqual(self.decoder.next_message(), {'a': '"}'})
+
+    def test_several_messages(self):
+        self.decoder.feed('{"a": {"b": 1}} {"c": 2}\n{"d"')
+        self.assertDictEqual(self.decoder.next_message(), {'a': {'b': 1}})
+        self.assertDictEqual(self.decoder.next_message(), {'c': 2})
+        self.assertIsNone(self.decoder.next_message())
+        self.decoder.feed(': 3}')
+        self.assertDictEqual(self.decoder.next_message(), {'d': 3})
+
+    def test_remaining_data_is_not_scanned(self):
+        self.decoder.feed('{"incoming_blob": {"length": 4}}bl}b')
+        self.assertDictEqual(self.decoder.next_message(), {'incoming_blob': {'length': 4}})
+        self.assertEqual(self.decoder.remaining(), 'bl}b')
+        self.assertEqual(len(self.decoder), 0)
+
+    def test_invalid_data(self):
+        self.decoder.feed('garbage{"a": 1}')
+        self.assertRaises(ValueError, self.decoder.next_message)
+        self.assertEqual(len(self.decoder), 0)
+        self.decoder.feed('{"a": nope}')
+        self.assertRaises(ValueError, self.decoder.next_message)
+        self.decoder.feed('{"a": 1}')
+        self.assertDictEqual(self.decoder.next_message(), {'a': 1})
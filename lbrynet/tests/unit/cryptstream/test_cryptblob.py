@@ -10,6 +10,7 @@ import random
 import string
 import StringIO
 import os
+import threading
 
 AES_BLOCK_SIZE_BYTES = AES.block_size / 8
 
@@ -79,3 +80,38 @@ class TestCryptBlob(unittest.TestCase):
         yield self._test_encrypt_decrypt(16*2)
         yield self._test_encrypt_decrypt(2000)
         yield self._test_encrypt_decrypt(2*2**20-1)
+
+    @defer.inlineCallbacks
+    def test_decrypt_in_chunks_in_a_thread(self):
+        blob = MocBlob()
+        key = os.urandom(AES_BLOCK_SIZE_BYTES)
+        iv = os.urandom(AES_BLOCK_SIZE_BYTES)
+        maker = CryptBlob.CryptStreamBlobMaker(key, iv, 0, blob)
+        string_to_encrypt = random_string(CryptBlob.StreamBlobDecryptor.CHUNK_SIZE * 3)
+        maker.write(string_to_encrypt)
+        yield maker.close()
+        writes = []
+
+        def write_func(data):
+            writes.append((data, threading.current_thread()))
+
+        decryptor = CryptBlob.StreamBlobDecryptor(blob, key, iv, len(string_to_encrypt))
+        yield decryptor.decrypt(write_func)
+        self.assertEqual(string_to_encrypt, ''.join(data for data, _ in writes))
+        self.assertEqual(4, len(writes))
+        self.assertTrue(all(len(data) <= CryptBlob.StreamBlobDecryptor.CHUNK_SIZE for data, _ in writes))
+        self.assertNotIn(threading.current_thread(), [thread for _, thread in writes])
+
+    @defer.inlineCallbacks
+    def test_decrypt_truncated_blob(self):
+        blob = MocBlob()
+        blob.blob_hash = 'a' * 96
+        key = os.urandom(AES_BLOCK_SIZE_BYTES)
+        iv = os.urandom(AES_BLOCK_SIZE_BYTES)
+        maker = CryptBlob.CryptStreamBlobMaker(key, iv, 0, blob)
+        maker.write(random_string(2000))
+        yield maker.close()
+        blob.data = blob.data[:-1]
+        decryptor = CryptBlob.StreamBlobDecryptor(blob, key, iv, 2000)
+        d = decryptor.decrypt(lambda _: None)
+        yield self.assertFailure(d, Exception)
@@ -342,3 +342,18 @@ class ContentClaimStorageTests(StorageTest):
         current_claim_info = yield self.storage.get_content_claim(stream_hash)
         # this should still be the previous update
         self.assertDictEqual(current_claim_info, update_info)
+
+
+class PeerReputationStorageTests(StorageTest):
+    @defer.inlineCallbacks
+    def test_peer_reputations(self):
+        yield self.storage.save_peer_reputations([
+            ('1.2.3.4', 3333, 1000.0, 0.5, 3, 1, 200),
+            ('1.2.3.5', 3333, None, None, 0, 2, 100),
+        ])
+        yield self.storage.save_peer_reputations([('1.2.3.4', 3333, 2000.0, 0.25, 4, 1, 300)])
+        reputations = yield self.storage.get_peer_reputations(150)
+        self.assertEqual([tuple(r) for r in reputations], [('1.2.3.4', 3333, 2000.0, 0.25, 4, 1, 300)])
+        # the reputations of peers not seen since then are deleted
+        reputations = yield self.storage.get_peer_reputations(0)
+        self.assertEqual(len(reputations), 1)
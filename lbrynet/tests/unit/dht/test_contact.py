@@ -51,6 +51,24 @@ class ContactOperatorsTest(unittest.TestCase):
                 self.firstContact != item,
                 msg.format('ne', type(item).__name__))
 
+    def testSetIdUpdatesContactManager(self):
+        contact = self.contact_manager.make_contact(None, '10.0.0.1', 1000, None)
+        contact.set_id(self.node_ids[2])
+        self.assertTrue(self.contact_manager.make_contact(self.node_ids[2], '10.0.0.1', 1000, None) is contact)
+        self.assertTrue(self.contact_manager.make_contact(None, '10.0.0.1', 1000, None) is not contact)
+
+    def testIntId(self):
+        self.assertEqual(self.firstContact.int_id, long(self.node_ids[1].encode('hex'), 16))
+        contact = self.contact_manager.make_contact(None, '10.0.0.1', 1000, None)
+        self.assertIsNone(contact.int_id)
+        contact.set_id(self.node_ids[2])
+        self.assertEqual(contact.int_id, long(self.node_ids[2].encode('hex'), 16))
+
+    def testRPCMethods(self):
+        self.assertFalse(hasattr(self.firstContact, '__dict__'))
+        self.assertEqual(self.firstContact.ping.__name__, 'ping')
+        self.assertRaises(AttributeError, getattr, self.firstContact, 'fakeMethod')
+
     def testCompactIP(self):
         self.assertEqual(self.firstContact.compact_ip(), '\x7f\x00\x00\x01')
         self.assertEqual(self.secondContact.compact_ip(), '\xc0\xa8\x00\x01')
@@ -170,3 +188,83 @@ class TestContactLastRequested(unittest.TestCase):
         self.assertTrue(self.contact.contact_is_good is False)
         self.clock.advance(1)
         self.assertTrue(self.contact.contact_is_good is False)
+
+
+class TestContactRPCTimeout(unittest.TestCase):
+    def setUp(self):
+        self.contact_manager = ContactManager(task.Clock().seconds)
+        self.contact = self.contact_manager.make_contact(generate_id(), "127.0.0.1", 4444, None)
+
+    def test_default_timeout(self):
+        self.assertEqual(self.contact.rpcTimeout, constants.rpcTimeout)
+
+    def test_timeout_from_rtt(self):
+        self.contact.update_rtt(0.8)
+        self.assertEqual(self.contact.rtt, 0.8)
+        self.assertEqual(self.contact.rttVariance, 0.4)
+        self.assertAlmostEqual(self.contact.rpcTimeout, 2.4)
+        self.contact.update_rtt(0.8)
+        self.assertAlmostEqual(self.contact.rtt, 0.8)
+        self.assertAlmostEqual(self.contact.rttVariance, 0.3)
+        self.assertAlmostEqual(self.contact.rpcTimeout, 2.0)
+
+    def test_timeout_bounds(self):
+        self.contact.update_rtt(0.01)
+        self.assertEqual(self.contact.rpcTimeout, constants.rpcTimeoutFloor)
+        self.contact.update_rtt(60)
+        self.assertEqual(self.contact.rpcTimeout, constants.rpcTimeoutCeiling)
+
+    def test_failure_resets_timeout(self):
+        self.contact.update_rtt(0.01)
+        self.contact.update_last_failed()
+        self.assertEqual(self.contact.rpcTimeout, constants.rpcTimeout)
+
+
+class TestContactManagerPruning(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.contact_manager = ContactManager(self.clock.seconds)
+
+    def test_failure_history_is_capped(self):
+        contact = self.contact_manager.make_contact(generate_id(), "127.0.0.1", 4444, None)
+        for _ in range(constants.rpcAttempts * 3):
+            contact.update_last_failed()
+            self.clock.advance(1)
+        self.assertEqual(contact.failedRPCs, constants.rpcAttempts + 1)
+        self.assertTrue(self.contact_manager.is_ignored(("127.0.0.1", 4444)))
+
+    def test_checking_unknown_address(self):
+        contact = self.contact_manager.make_contact(generate_id(), "127.0.0.1", 4444, None)
+        self.assertFalse(self.contact_manager.is_ignored(("127.0.0.1", 4444)))
+        self.assertIsNone(contact.lastFailed)
+        self.assertEqual(self.contact_manager._rpc_failures, {})
+
+    def test_prune(self):
+        in_use = self.contact_manager.make_contact(generate_id(), "127.0.0.1", 4444, None)
+        unused = self.contact_manager.make_contact(generate_id(), "127.0.0.2", 4444, None)
+        failed = self.contact_manager.make_contact(generate_id(), "127.0.0.3", 4444, None)
+        failed.update_last_failed()
+        self.clock.advance(constants.checkRefreshInterval - 1)
+        recent = self.contact_manager.make_contact(generate_id(), "127.0.0.4", 4444, None)
+        recent.update_last_requested()
+        self.assertEqual(self.contact_manager.prune([in_use]), 0)
+
+        self.clock.advance(2)
+        self.assertEqual(self.contact_manager.prune([in_use]), 2)
+        self.assertEqual(len(self.contact_manager), 2)
+        self.assertTrue(self.contact_manager.get_contact(in_use.id, "127.0.0.1", 4444) is in_use)
+        self.assertTrue(self.contact_manager.get_contact(recent.id, "127.0.0.4", 4444) is recent)
+        self.assertIsNone(self.contact_manager.get_contact(unused.id, "127.0.0.2", 4444))
+        self.assertEqual(self.contact_manager._rpc_failures, {})
+
+    def test_prune_keeps_recent_failures(self):
+        contact = self.contact_manager.make_contact(generate_id(), "127.0.0.1", 4444, None)
+        self.clock.advance(constants.checkRefreshInterval + 1)
+        contact.update_last_failed()
+        self.contact_manager._contacts.clear()
+        # the failures of a forgotten contact are kept as long as they count towards ignoring the address
+        self.contact_manager.prune([])
+        self.assertEqual(self.contact_manager._rpc_failures.keys(), [("127.0.0.1", 4444)])
+        self.clock.advance(constants.rpcAttemptsPruningTimeWindow + 1)
+        self.contact_manager.prune([])
+        self.assertEqual(self.contact_manager._rpc_failures, {})
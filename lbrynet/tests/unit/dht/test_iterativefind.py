@@ -0,0 +1,77 @@
+import gc
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet.core.call_later_manager import CallLaterManager
+from lbrynet.dht import constants
+from lbrynet.dht.iterativefind import iterativeFind
+
+
+class FakeContact(object):
+    def __init__(self, node_id, address, rtt=None, response=None):
+        self.id = node_id
+        self.int_id = long(node_id.encode('hex'), 16)
+        self.address = address
+        self.port = 4444
+        self.rtt = rtt
+        self.rpcTimeout = rtt * 2 if rtt is not None else constants.rpcTimeout
+        self.response = response
+        self.probed = []
+
+    def log_id(self, short=True):
+        return self.address
+
+    def findNode(self, key):
+        self.probed.append(key)
+        if isinstance(self.response, Exception):
+            return defer.fail(self.response)
+        if isinstance(self.response, defer.Deferred):
+            return self.response
+        return defer.succeed(self.response or [])
+
+
+class FakeContactManager(object):
+    def is_ignored(self, address):
+        return False
+
+
+class FakeNode(object):
+    def __init__(self, clock):
+        self.node_id = '\xff' * 48
+        self.contact_manager = FakeContactManager()
+        self.clock = clock
+        self.reactor_callLater = CallLaterManager(clock.callLater).call_later
+
+
+class TestIterativeFind(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.node = FakeNode(self.clock)
+        self.key = '\x00' * 48
+        # contacts from closest to furthest from the key
+        self.contacts = [FakeContact(chr(i) * 48, '1.2.3.%i' % i) for i in range(1, 10)]
+
+    def _find(self, contacts):
+        d = iterativeFind(self.node, contacts, self.key, 'findNode')
+        for _ in range(100):
+            self.clock.advance(1)
+        return self.successResultOf(d)
+
+    def test_closest_contacts_are_probed_first(self):
+        # a further contact known to reply quickly doesn't take the place of a closer one
+        self.contacts[-1].rtt, self.contacts[-1].rpcTimeout = 0.01, 0.02
+        for contact in self.contacts:
+            contact.response = defer.Deferred()
+        iterativeFind(self.node, list(reversed(self.contacts)), self.key, 'findNode')
+        self.clock.advance(0)
+        self.assertEqual([True] * constants.alpha + [False] * (len(self.contacts) - constants.alpha),
+                         [bool(contact.probed) for contact in self.contacts])
+
+    def test_remote_errors_are_consumed(self):
+        self.contacts[0].response = KeyError('findNode')
+        self.contacts[1].response = TypeError()
+        result = self._find(self.contacts)
+        self.assertNotIn(self.contacts[0], result)
+        self.assertIn(self.contacts[2], result)
+        gc.collect()
+        self.assertEqual([], self.flushLoggedErrors())
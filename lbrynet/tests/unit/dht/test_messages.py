@@ -7,7 +7,9 @@
 from twisted.trial import unittest
 
 from lbrynet.dht.msgtypes import RequestMessage, ResponseMessage, ErrorMessage
-from lbrynet.dht.msgformat import MessageTranslator, DefaultFormat
+from lbrynet.dht.msgformat import MessageTranslator, DefaultFormat, BinaryFormat
+from lbrynet.dht.encoding import Bencode
+from lbrynet.dht.error import DecodeError
 
 
 class DefaultFormatTranslatorTest(unittest.TestCase):
@@ -82,3 +84,67 @@ class DefaultFormatTranslatorTest(unittest.TestCase):
                     'Message instance variable "%s" not translated correctly; '
                     'expected "%s", got "%s"' %
                     (key, msg.__dict__[key], translatedObj.__dict__[key]))
+
+
+class BinaryFormatTest(unittest.TestCase):
+    """ Test case for the binary message format """
+    def setUp(self):
+        self.format = BinaryFormat()
+        peers = ['\x7f\x00\x00\x01\x0d\x05' + chr(i) * 48 for i in range(3)]
+        contacts = [(chr(i) * 48, '127.0.0.%i' % i, 4444 + i) for i in range(8)]
+        self.cases = (
+            (RequestMessage('1' * 48, 'ping', (), '1' * 20), ()),
+            (RequestMessage('1' * 48, 'findNode', ('k' * 48,), '1' * 20), ('k' * 48,)),
+            (RequestMessage('1' * 48, 'findValue', ('k' * 48,), '1' * 20), ('k' * 48,)),
+            (RequestMessage('1' * 48, 'store', ('k' * 48, 't' * 48, 3333, '2' * 48, 10), '1' * 20),
+             ('k' * 48, 't' * 48, 3333, '2' * 48, 10)),
+            (ResponseMessage('2' * 20, '2' * 48, 'pong'), 'pong'),
+            (ResponseMessage('2' * 20, '2' * 48, contacts), contacts),
+            (ResponseMessage('2' * 20, '2' * 48, {'token': 't' * 48, 'protocolVersion': 2, 'contacts': contacts}),
+             {'token': 't' * 48, 'protocolVersion': 2, 'contacts': contacts}),
+            (ResponseMessage('2' * 20, '2' * 48, {'token': 't' * 48, 'protocolVersion': 2, 'k' * 48: peers}),
+             {'token': 't' * 48, 'protocolVersion': 2, 'k' * 48: peers}),
+            (ErrorMessage('3' * 20, '3' * 48, 'exceptions.ValueError', 'Invalid token'), 'Invalid token'),
+        )
+
+    def testRoundTrip(self):
+        for msg, expected in self.cases:
+            encoded = self.format.encode(msg)
+            self.assertEqual(encoded[0], BinaryFormat.marker)
+            decoded = self.format.decode(encoded)
+            self.assertEqual(type(decoded), type(msg))
+            self.assertEqual((decoded.id, decoded.nodeID), (msg.id, msg.nodeID))
+            if isinstance(msg, RequestMessage):
+                self.assertEqual(decoded.request, msg.request)
+                # the protocol version is implied by the format and passed on like in a bencoded request
+                self.assertEqual(decoded.args, expected + ({'protocolVersion': BinaryFormat.protocolVersion},))
+            elif isinstance(msg, ErrorMessage):
+                self.assertEqual(decoded.exceptionType, msg.exceptionType)
+                self.assertEqual(decoded.response, expected)
+            else:
+                self.assertEqual(decoded.response, expected)
+
+    def testSmallerThanBencode(self):
+        translator, encoder = DefaultFormat(), Bencode()
+        for msg, _ in self.cases:
+            bencoded = encoder.encode(translator.toPrimitive(msg))
+            self.assertLess(len(self.format.encode(msg)), len(bencoded))
+
+    def testUnsupportedMessages(self):
+        unsupported = (
+            RequestMessage('1' * 48, 'rpcMethod', {'arg1': 'a string'}, '1' * 20),
+            RequestMessage('1' * 48, 'findNode', ('short key',), '1' * 20),
+            RequestMessage('1' * 48, 'store', ('k' * 48, {'token': 't', 'port': 3333, 'lbryid': '2' * 48}, '2' * 48,
+                                               False), '1' * 20),
+            ResponseMessage('2' * 20, '2' * 48, {'token': 't' * 48, 'contacts': []}),
+            ResponseMessage('2' * 20, '2' * 48, [('2' * 48, 'not an ip', 4444)]),
+            ResponseMessage('2' * 20, '2' * 48, 123),
+        )
+        for msg in unsupported:
+            self.assertRaises(ValueError, self.format.encode, msg)
+
+    def testMalformedDatagrams(self):
+        encoded = self.format.encode(self.cases[3][0])
+        for datagram in (encoded[:-1], encoded + '\x00', encoded[:40], 'd' + encoded[1:],
+                         encoded[:70] + '\x09' + encoded[71:]):
+            self.assertRaises(DecodeError, self.format.decode, datagram)
@@ -0,0 +1,45 @@
+import json
+from twisted.internet import task
+from twisted.trial import unittest
+from lbrynet.dht.metrics import DHTMetrics, Histogram
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.add(value)
+        self.assertDictEqual(histogram.to_dict(), {
+            'buckets': [[1, 2], [2, 1], [4, 1], ['+inf', 1]],
+            'count': 5,
+            'mean': 3.2
+        })
+
+
+class DHTMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.metrics = DHTMetrics(self.clock.seconds, max_traces=2)
+
+    def test_rpcs(self):
+        self.metrics.rpc_sent('findNode')
+        self.metrics.rpc_sent('findNode')
+        self.metrics.rpc_replied('findNode', 0.2)
+        self.metrics.rpc_timed_out('findNode')
+        self.metrics.rpc_received('ping')
+        stats = self.metrics.to_dict()
+        self.assertDictEqual(stats['rpcsSent'], {'findNode': 2})
+        self.assertDictEqual(stats['rpcsReceived'], {'ping': 1})
+        self.assertDictEqual(stats['timeouts'], {'findNode': 1})
+        self.assertEqual(stats['rtt']['findNode']['count'], 1)
+
+    def test_lookup_traces(self):
+        for i in range(3):
+            self.clock.advance(1)
+            self.metrics.lookup_finished('findValue', chr(i) * 48, self.clock.seconds() - 0.5, 2, 6, i)
+        stats = self.metrics.to_dict()
+        self.assertDictEqual(stats['lookups']['findValue']['hops'], {2: 3})
+        self.assertEqual(stats['lookups']['findValue']['contacted']['mean'], 6)
+        self.assertEqual([trace['found'] for trace in stats['lookupTraces']], [1, 2])
+        self.assertEqual(stats['lookupTraces'][0]['duration'], 0.5)
+        json.dumps(stats)
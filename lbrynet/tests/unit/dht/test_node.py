@@ -8,7 +8,7 @@ import hashlib
 from twisted.trial import unittest
 import struct
 
-from twisted.internet import defer
+from twisted.internet import defer, task
 from lbrynet.dht.node import Node
 from lbrynet.dht import constants
 
@@ -110,6 +110,41 @@ class NodeContactTest(unittest.TestCase):
         self.failIf(contact in closestNodes, 'Node added itself as a contact')
 
 
+class NodeRefreshTest(unittest.TestCase):
+    """ Test case for the Node class's k-bucket refreshes """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.node = Node(clock=self.clock, callLater=self.clock.callLater)
+        self.lookups = []
+        self.node.iterativeFindNode = self._fakeFindNode
+
+    def _fakeFindNode(self, key):
+        d = defer.Deferred()
+        self.lookups.append(d)
+        return d
+
+    def testConcurrentRefreshLookups(self):
+        """ Tests that bucket refresh lookups run concurrently, but no more than the limit at once """
+        searchIDs = [hashlib.sha384(str(i)).digest() for i in range(constants.maxConcurrentRefreshLookups + 2)]
+        self.node._routingTable.getRefreshList = lambda startIndex, force: list(searchIDs)
+        refreshed = self.node._refreshRoutingTable()
+        self.failUnlessEqual(len(self.lookups), constants.maxConcurrentRefreshLookups)
+        self.lookups[0].callback([])
+        self.lookups[1].errback(Exception())
+        self.failUnlessEqual(len(self.lookups), len(searchIDs))
+        for d in self.lookups[2:]:
+            d.callback([])
+        self.failUnless(refreshed.called)
+
+    def testRecentlyLookedUpBucketIsNotRefreshed(self):
+        """ Tests that a bucket a lookup was done in recently isn't refreshed """
+        self.clock.advance(constants.refreshTimeout)
+        self.failUnlessEqual(len(self.node._routingTable.getRefreshList(0, False)), 1)
+        self.node._routingTable.touchKBucket(self.node.node_id)
+        self.node._refreshRoutingTable()
+        self.failUnlessEqual(len(self.lookups), 0)
+
+
 # class FakeRPCProtocol(protocol.DatagramProtocol):
 #     def __init__(self):
 #         self.reactor = selectreactor.SelectReactor()
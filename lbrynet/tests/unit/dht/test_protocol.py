@@ -0,0 +1,229 @@
+from twisted.internet import task, defer
+from twisted.trial import unittest
+from lbrynet.core.call_later_manager import CallLaterManager
+from lbrynet.dht.error import TimeoutError
+from lbrynet.dht.protocol import PartialMessageBuffer, RequestRateLimiter, PingQueue
+
+
+class PartialMessageBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.buffer = PartialMessageBuffer(self.clock.seconds, timeout=5, max_size=100, max_per_address=2,
+                                           max_fragments=4, max_time=6)
+
+    def test_reassemble_out_of_order(self):
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 3, 2, 'ccc'))
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 3, 0, 'aaa'))
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 3, 0, 'aaa'))
+        self.assertEqual(self.buffer.add('a' * 20, '1.2.3.4', 3, 1, 'bbb'), 'aaabbbccc')
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.size, 0)
+
+    def test_expired_messages_are_dropped(self):
+        self.buffer.add('a' * 20, '1.2.3.4', 2, 0, 'aaa')
+        self.clock.advance(5)
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 2, 1, 'bbb'))
+        self.assertEqual(self.buffer.dropped['expired'], 1)
+        self.assertIn('a' * 20, self.buffer)
+        self.assertEqual(self.buffer.size, 3)
+
+    def test_arriving_datagrams_extend_the_deadline(self):
+        self.buffer.add('a' * 20, '1.2.3.4', 4, 0, 'aaa')
+        self.buffer.add('b' * 20, '4.3.2.1', 4, 0, 'aaa')
+        self.clock.advance(4)
+        self.buffer.add('a' * 20, '1.2.3.4', 4, 1, 'bbb')
+        self.clock.advance(4)
+        # the message still arriving is kept, the other one is given up on
+        self.buffer.remove_expired()
+        self.assertIn('a' * 20, self.buffer)
+        self.assertNotIn('b' * 20, self.buffer)
+        # datagrams arriving more than max_time after the first don't extend the deadline any more
+        self.buffer.add('a' * 20, '1.2.3.4', 4, 2, 'ccc')
+        self.clock.advance(1)
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 4, 3, 'ddd'))
+        self.assertEqual(self.buffer.dropped['expired'], 4)
+        self.assertEqual(self.buffer.size, 3)
+
+    def test_invalid_sequence_numbers(self):
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 5, 0, 'aaa'))
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 0, 0, 'aaa'))
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 2, 2, 'aaa'))
+        self.assertEqual(self.buffer.dropped['invalid'], 3)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_fragment_from_other_address(self):
+        self.buffer.add('a' * 20, '1.2.3.4', 2, 0, 'aaa')
+        self.assertIsNone(self.buffer.add('a' * 20, '4.3.2.1', 2, 1, 'bbb'))
+        self.assertIsNone(self.buffer.add('a' * 20, '1.2.3.4', 3, 1, 'bbb'))
+        self.assertEqual(self.buffer.dropped['invalid'], 2)
+
+    def test_address_limit(self):
+        self.buffer.add('a' * 20, '1.2.3.4', 2, 0, 'aaa')
+        self.buffer.add('b' * 20, '1.2.3.4', 2, 0, 'aaa')
+        self.assertIsNone(self.buffer.add('c' * 20, '1.2.3.4', 2, 0, 'aaa'))
+        self.assertEqual(self.buffer.dropped['address_limit'], 1)
+        self.assertEqual(self.buffer.add('c' * 20, '4.3.2.1', 2, 0, 'aaa'), None)
+        self.assertEqual(len(self.buffer), 3)
+
+    def test_size_limit(self):
+        self.buffer.add('a' * 20, '1.2.3.4', 2, 0, 'a' * 60)
+        self.assertIsNone(self.buffer.add('b' * 20, '4.3.2.1', 2, 0, 'b' * 60))
+        self.assertEqual(self.buffer.dropped['buffer_full'], 1)
+        self.assertEqual(self.buffer.add('a' * 20, '1.2.3.4', 2, 1, 'a' * 40), 'a' * 100)
+        self.assertEqual(self.buffer.size, 0)
+
+    def test_progress(self):
+        self.assertFalse(self.buffer.has_progress('a' * 20))
+        self.buffer.add('a' * 20, '1.2.3.4', 3, 0, 'aaa')
+        self.assertTrue(self.buffer.has_progress('a' * 20))
+        self.assertFalse(self.buffer.has_progress('a' * 20))
+        self.buffer.add('a' * 20, '1.2.3.4', 3, 1, 'bbb')
+        self.assertTrue(self.buffer.has_progress('a' * 20))
+
+
+class RequestRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.limiter = RequestRateLimiter(self.clock.seconds, rate_per_address=1, burst_per_address=5, rate=10,
+                                          burst=20, thresholds={'store': 0.5, 'findNode': 0.1, 'ping': 0.0})
+
+    def test_address_limit(self):
+        for _ in range(5):
+            self.assertTrue(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+        self.assertFalse(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+        self.assertEqual(self.limiter.dropped['address_limit'], 1)
+        self.assertTrue(self.limiter.allow(('4.3.2.1', 4444), 'ping'))
+        self.clock.advance(1)
+        self.assertTrue(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+        self.assertFalse(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+
+    def test_ports_of_an_address_are_limited_separately(self):
+        # like the nodes of a multi-process seed, or users behind the same NAT
+        for _ in range(5):
+            self.assertTrue(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+        self.assertFalse(self.limiter.allow(('1.2.3.4', 4444), 'ping'))
+        for _ in range(5):
+            self.assertTrue(self.limiter.allow(('1.2.3.4', 4445), 'ping'))
+        self.assertFalse(self.limiter.allow(('1.2.3.4', 4445), 'ping'))
+        self.assertEqual(self.limiter.dropped['address_limit'], 2)
+
+    def test_load_shedding_order(self):
+        for i in range(9):
+            self.assertTrue(self.limiter.allow(('10.0.0.%i' % i, 4444), 'store'))
+        # the store threshold is half of the global budget
+        self.assertTrue(self.limiter.allow(('10.0.1.0', 4444), 'store'))
+        self.assertFalse(self.limiter.allow(('10.0.1.1', 4444), 'store'))
+        self.assertEqual(self.limiter.dropped['store'], 1)
+        for i in range(8):
+            self.assertTrue(self.limiter.allow(('10.0.2.%i' % i, 4444), 'findNode'))
+        self.assertFalse(self.limiter.allow(('10.0.3.0', 4444), 'findNode'))
+        self.assertEqual(self.limiter.dropped['findNode'], 1)
+        self.assertTrue(self.limiter.allow(('10.0.3.1', 4444), 'ping'))
+        self.assertTrue(self.limiter.allow(('10.0.3.2', 4444), 'ping'))
+        self.assertFalse(self.limiter.allow(('10.0.3.3', 4444), 'ping'))
+        self.assertEqual(self.limiter.dropped['ping'], 1)
+        # methods without a threshold are shed first
+        self.clock.advance(1)
+        self.assertFalse(self.limiter.allow(('10.0.4.0', 4444), 'fake'))
+        self.assertEqual(self.limiter.dropped['other'], 1)
+        self.assertTrue(self.limiter.allow(('10.0.4.0', 4444), 'findNode'))
+
+    def test_idle_addresses_are_pruned(self):
+        for i in range(1024):
+            self.limiter.allow(('10.0.%i.%i' % (i / 256, i % 256), 4444), 'ping')
+            self.clock.advance(0.1)
+        self.assertEqual(len(self.limiter), 1024)
+        self.clock.advance(5)
+        self.limiter.allow(('1.2.3.4', 4444), 'ping')
+        self.assertEqual(len(self.limiter), 1)
+
+
+class FakeContact(object):
+    def __init__(self, pings, contact_is_good=None):
+        self._pings = pings
+        self.contact_is_good = contact_is_good
+
+    def ping(self):
+        d = defer.Deferred()
+        self._pings.append((self, d))
+        return d
+
+
+class FakeNode(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.call_later_manager = CallLaterManager(clock.callLater)
+        self.reactor_callLater = self.call_later_manager.call_later
+
+
+class PingQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pings = []
+        self.queue = PingQueue(FakeNode(self.clock), max_concurrent_pings=2)
+        self.queue.start()
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def test_contacts_are_pinged_when_due(self):
+        late, soon = FakeContact(self.pings), FakeContact(self.pings)
+        self.queue.enqueue_maybe_ping(late, delay=900)
+        self.queue.enqueue_maybe_ping(soon, delay=0)
+        self.assertEqual(len(self.queue), 2)
+        self.clock.advance(0)
+        self.assertEqual([contact for contact, _ in self.pings], [soon])
+        self.clock.advance(899)
+        self.assertEqual(len(self.pings), 1)
+        self.clock.advance(1)
+        self.assertEqual([contact for contact, _ in self.pings], [soon, late])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_contact_is_only_enqueued_once(self):
+        contact = FakeContact(self.pings)
+        self.queue.enqueue_maybe_ping(contact, delay=10)
+        self.queue.enqueue_maybe_ping(contact, delay=5)
+        self.clock.advance(5)
+        self.assertEqual(len(self.pings), 0)
+        self.clock.advance(5)
+        self.assertEqual(len(self.pings), 1)
+        # it can't be enqueued again while the ping is in flight
+        self.queue.enqueue_maybe_ping(contact, delay=0)
+        self.pings[0][1].callback('pong')
+        self.clock.advance(0)
+        self.assertEqual(len(self.pings), 1)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_good_contacts_are_not_pinged(self):
+        self.queue.enqueue_maybe_ping(FakeContact(self.pings, contact_is_good=True), delay=1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.pings), 0)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_concurrency_and_stats(self):
+        for i in range(3):
+            self.queue.enqueue_maybe_ping(FakeContact(self.pings), delay=i)
+        self.clock.advance(2)
+        self.assertEqual(len(self.pings), 2)
+        self.assertEqual(self.queue.stats()['inFlight'], 2)
+        self.clock.advance(3)
+        self.pings[0][1].callback('pong')
+        self.assertEqual(len(self.pings), 3)
+        self.pings[1][1].errback(TimeoutError('1' * 48))
+        self.pings[2][1].callback('pong')
+        self.assertDictEqual(self.queue.stats(), {
+            'queued': 0,
+            'inFlight': 0,
+            'pinged': 3,
+            'timeouts': 1,
+            'latencyMedian': 3
+        })
+
+    def test_stop(self):
+        self.queue.enqueue_maybe_ping(FakeContact(self.pings), delay=1)
+        self.queue.stop()
+        self.clock.advance(1)
+        self.assertEqual(len(self.pings), 0)
+        self.queue.start()
+        self.clock.advance(0)
+        self.assertEqual(len(self.pings), 1)
@@ -0,0 +1,126 @@
+"""
+Measures the cpu time BlobRequester spends deciding what to request from a peer for a stream with thousands of blobs
+and dozens of peers, comparing the blob to peer set indexes with the per peer lists it used before
+
+Each round asks every connected peer for the blob to download next and looks up the next blob to search for peers
+for, like ConnectionManager does when it manages its connections.
+"""
+
+import time
+import random
+import argparse
+from collections import defaultdict
+from twisted.internet import defer
+from lbrynet.core.Peer import Peer
+from lbrynet.core.client.BlobRequester import BlobRequester, DownloadRequest
+
+
+class Blob(object):
+    def __init__(self, blob_hash):
+        self.blob_hash = blob_hash
+        self.writers = {}
+
+    def is_downloading(self):
+        return bool(self.writers)
+
+    def get_is_verified(self):
+        return False
+
+
+class DownloadManager(object):
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def needed_blobs(self):
+        return self.blobs
+
+
+class PeerFinder(object):
+    def __init__(self, peers):
+        self.peers = peers
+
+    def find_peers_for_blob(self, blob_hash, filter_self=False):
+        return defer.succeed(self.peers)
+
+
+class OldBlobRequester(BlobRequester):
+    def __init__(self, *args):
+        BlobRequester.__init__(self, *args)
+        self._available_blobs = defaultdict(list)
+
+    def _set_hash_available(self, blob_hash, peer):
+        self._available_blobs[peer].append(blob_hash)
+
+    def _find_peers_for_hash(self, h):
+        d = self.peer_finder.find_peers_for_blob(h, filter_self=True)
+
+        def choose_best_peers(peers):
+            bad_peers = [p for p in self._peers.iterkeys() if not self._should_send_request_to(p)]
+            without_bad_peers = [p for p in peers if not p in bad_peers]
+            return [p for p in without_bad_peers if p not in self._maxed_out_peers]
+
+        return d.addCallback(choose_best_peers)
+
+    def _hash_available(self, blob_hash):
+        for peer in self._available_blobs:
+            if blob_hash in self._available_blobs[peer]:
+                return True
+        return False
+
+    def _hash_available_on(self, blob_hash, peer):
+        return blob_hash in self._available_blobs[peer]
+
+
+class OldDownloadRequest(DownloadRequest):
+    def get_available_blobs(self):
+        return [
+            b for b in self.requestor._blobs_to_download()
+            if self.requestor._hash_available_on(b.blob_hash, self.peer)
+        ]
+
+
+def make_requester(requester_class, args, rng):
+    blobs = [Blob("%096x" % i) for i in range(args.blobs)]
+    peers = [Peer("10.0.0.%i" % i, 3333) for i in range(args.peers)]
+    requester = requester_class(None, PeerFinder(peers), None, None, DownloadManager(blobs))
+    # a few peers have the stream but the blobs at its end, the rest have a few blobs each, and a tenth of the
+    # peers are bad
+    with_sources = blobs[:-args.blobs // 10]
+    for i, peer in enumerate(peers):
+        peer_blobs = with_sources if i < args.seeders else rng.sample(with_sources, args.peer_blobs)
+        for blob in peer_blobs:
+            requester._set_hash_available(blob.blob_hash, peer)
+        requester._update_local_score(peer, -10.0 if i % 10 == 9 else 0.0)
+    return requester, peers
+
+
+def run(requester_class, download_request_class, args):
+    requester, peers = make_requester(requester_class, args, random.Random(args.seed))
+    started = time.clock()
+    for _ in range(args.rounds):
+        blob_hash = requester._get_hash_for_peer_search().result
+        requester._find_peers_for_hash(blob_hash)
+        for peer in peers:
+            if requester.should_send_next_request(peer):
+                download_request_class(requester, peer, None, None, None, None).get_available_blobs()
+    return (time.clock() - started) / args.rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blobs', type=int, default=5000)
+    parser.add_argument('--peers', type=int, default=50)
+    parser.add_argument('--seeders', type=int, default=2, help="peers having every blob with sources")
+    parser.add_argument('--peer_blobs', type=int, default=200, help="blobs each of the other peers has")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print "%-10s %14s" % ("requester", "ms per round")
+    for name, requester_class, download_request_class in (("old", OldBlobRequester, OldDownloadRequest),
+                                                          ("indexed", BlobRequester, DownloadRequest)):
+        print "%-10s %14.1f" % (name, run(requester_class, download_request_class, args) * 1000)
+
+
+if __name__ == "__main__":
+    main()
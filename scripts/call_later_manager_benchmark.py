@@ -0,0 +1,58 @@
+"""
+Measures the cost of scheduling, cancelling and firing calls through lbrynet.core.call_later_manager with many
+calls outstanding, like the RPC timeouts and sends of a busy DHT node
+"""
+
+import time
+import random
+import argparse
+from twisted.internet import reactor
+from lbrynet.core.call_later_manager import CallLaterManager
+
+
+def noop():
+    pass
+
+
+def run(count, rng):
+    manager = CallLaterManager(reactor.callLater)
+    started = time.clock()
+    cancellers = [manager.call_later(rng.uniform(60, 120), noop)[1] for _ in xrange(count)]
+    scheduled = time.clock() - started
+
+    started = time.clock()
+    for _ in xrange(count / 10):
+        manager.call_soon(noop)
+    call_soon = time.clock() - started
+
+    rng.shuffle(cancellers)
+    started = time.clock()
+    for cancel in cancellers[:count / 2]:
+        cancel()
+    cancelled = time.clock() - started
+
+    started = time.clock()
+    reactor.runUntilCurrent()  # fires the call_soon calls
+    fired = time.clock() - started
+
+    started = time.clock()
+    manager.stop()
+    stopped = time.clock() - started
+    return scheduled / count, call_soon / (count / 10), cancelled / (count / 2), fired / (count / 10), stopped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 30000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    print "%8s %14s %14s %14s %14s %10s" % ("pending", "call_later", "call_soon", "cancel", "fire", "stop")
+    for size in args.sizes:
+        timings = run(size, rng)
+        print "%8i %12.2fus %12.2fus %12.2fus %12.2fus %8.1fms" % (
+            (size,) + tuple(1000000.0 * t for t in timings[:4]) + (1000.0 * timings[4],))
+
+
+if __name__ == "__main__":
+    main()
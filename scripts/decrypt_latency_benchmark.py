@@ -0,0 +1,166 @@
+"""
+Decrypts a stream's worth of blobs to a file, the way a download outputs them, while measuring how late a timer
+running every few milliseconds on the reactor fires, comparing StreamBlobDecryptor with the one it replaced, which
+read a whole blob into memory and decrypted and wrote it on the reactor
+
+A few distinct blobs are encrypted into a temporary directory and decrypted over and over, one at a time, until the
+requested amount of data has been written.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from io import BytesIO
+from twisted.internet import reactor, defer, task
+from twisted.web.client import FileBodyProducer
+from cryptography.hazmat.primitives.ciphers.algorithms import AES
+
+from lbrynet.cryptstream import CryptBlob
+from lbrynet.blob.blob_file import MAX_BLOB_SIZE
+
+
+class OldStreamBlobDecryptor(CryptBlob.StreamBlobDecryptor):
+    def decrypt(self, write_func):
+        read_handle = self.blob.open_for_reading()
+
+        @defer.inlineCallbacks
+        def decrypt_bytes():
+            producer = FileBodyProducer(read_handle)
+            buff = BytesIO()
+            yield producer.startProducing(buff)
+            data = buff.getvalue()
+            write_func(self.unpadder.update(self.cipher.update(data) + self.cipher.finalize()) +
+                       self.unpadder.finalize())
+
+        return decrypt_bytes()
+
+
+class Blob(object):
+    def __init__(self, path, blob_hash, key, iv, length):
+        self.path = path
+        self.blob_hash = blob_hash
+        self.key = key
+        self.iv = iv
+        self.length = length
+
+    def open_for_reading(self):
+        return open(self.path, 'rb')
+
+
+class BlobWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self.data = ''
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        return defer.succeed(os.path.basename(self.path))
+
+
+@defer.inlineCallbacks
+def make_blobs(blob_dir, args):
+    blobs = []
+    for i in range(args.distinct_blobs):
+        key = os.urandom(AES.block_size / 8)
+        iv = os.urandom(AES.block_size / 8)
+        writer = BlobWriter(os.path.join(blob_dir, 'blob%i' % i))
+        maker = CryptBlob.CryptStreamBlobMaker(key, iv, i, writer)
+        maker.write(os.urandom(MAX_BLOB_SIZE - 1))
+        info = yield maker.close()
+        blobs.append(Blob(writer.path, info.blob_hash, key, iv, info.length))
+    defer.returnValue(blobs)
+
+
+class LatencyMonitor(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.lags = []
+        self._expected = None
+        self._call = task.LoopingCall(self._tick)
+
+    def _tick(self):
+        now = time.time()
+        if self._expected is not None:
+            self.lags.append(max(now - self._expected, 0))
+        self._expected = now + self.interval
+
+    def start(self):
+        self.lags = []
+        self._expected = None
+        self._call.start(self.interval)
+
+    def stop(self):
+        self._call.stop()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+@defer.inlineCallbacks
+def decrypt(name, decryptor_class, blobs, output_dir, args):
+    output_path = os.path.join(output_dir, 'output')
+    output = open(output_path, 'wb')
+    lock = threading.Lock()
+
+    def write_func(data):
+        with lock:
+            output.write(data)
+
+    monitor = LatencyMonitor(args.interval)
+    num_blobs = args.megabytes * 2 ** 20 / MAX_BLOB_SIZE
+    started = time.time()
+    monitor.start()
+    for i in range(num_blobs):
+        blob = blobs[i % len(blobs)]
+        yield decryptor_class(blob, blob.key, blob.iv, blob.length).decrypt(write_func)
+    monitor.stop()
+    seconds = time.time() - started
+    output.close()
+    os.remove(output_path)
+    lags = [lag * 1000 for lag in monitor.lags]
+    print "%-8s %8i %10.2f %10.1f %12.2f %12.2f %12.2f" % (
+        name, num_blobs, seconds, num_blobs * MAX_BLOB_SIZE / seconds / 2 ** 20, percentile(lags, 0.5),
+        percentile(lags, 0.99), max(lags)
+    )
+
+
+@defer.inlineCallbacks
+def run(args):
+    blob_dir = tempfile.mkdtemp()
+    output_dir = tempfile.mkdtemp(dir=args.output_dir)
+    try:
+        blobs = yield make_blobs(blob_dir, args)
+        print "%-8s %8s %10s %10s %12s %12s %12s" % ("decryptor", "blobs", "seconds", "MB/s", "p50 lag ms",
+                                                     "p99 lag ms", "max lag ms")
+        for name, decryptor_class in (("old", OldStreamBlobDecryptor),
+                                      ("chunked", CryptBlob.StreamBlobDecryptor)):
+            yield decrypt(name, decryptor_class, blobs, output_dir, args)
+    finally:
+        shutil.rmtree(blob_dir)
+        shutil.rmtree(output_dir)
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=4096, help="the size of the stream to decrypt")
+    parser.add_argument('--distinct_blobs', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.005, help="seconds between the timer's calls")
+    parser.add_argument('--output_dir', default=None, help="where to write the decrypted stream, a temporary "
+                                                           "directory by default")
+    args = parser.parse_args()
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Measures the CPU cost of iterative DHT lookups against a simulated network
+
+The remote nodes are simulated in process: each one has a routing table with up to k contacts per bucket and
+replies to findNode/findValue immediately. Only the time spent by the searching node is reported, the time spent
+simulating the remote nodes is subtracted.
+"""
+
+import time
+import random
+import hashlib
+import argparse
+import bisect
+from twisted.internet import defer, task
+from lbrynet.dht import constants
+from lbrynet.dht.contact import ContactManager
+from lbrynet.dht.iterativefind import iterativeFind
+from lbrynet.core.call_later_manager import CallLaterManager
+
+
+def make_node_ids(count):
+    node_ids = [hashlib.sha384("node %i" % i).digest() for i in range(count)]
+    node_ids.sort()
+    return node_ids
+
+
+def to_int(node_id):
+    return long(node_id.encode('hex'), 16)
+
+
+def to_address(index):
+    return "10.%i.%i.%i" % ((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff), 4444
+
+
+class SimulatedNetwork(object):
+    def __init__(self, size, rng):
+        self.node_ids = make_node_ids(size)
+        self.int_ids = [to_int(node_id) for node_id in self.node_ids]
+        self.by_address = {to_address(i): i for i in range(size)}
+        self._rng = rng
+        self._routing_tables = {}
+        self.rpc_count = 0
+        self.simulation_time = 0.0
+
+    def _range_with_prefix(self, value, prefix_bits):
+        shift = constants.key_bits - prefix_bits
+        low = (value >> shift) << shift
+        return bisect.bisect_left(self.int_ids, low), bisect.bisect_left(self.int_ids, low + (1 << shift))
+
+    def routing_table(self, index):
+        if index not in self._routing_tables:
+            own = self.int_ids[index]
+            contacts = []
+            bit = 0
+            while True:
+                # the bucket of contacts sharing the first `bit` bits with us and differing at the next one
+                flipped = own ^ (1 << (constants.key_bits - bit - 1))
+                start, end = self._range_with_prefix(flipped, bit + 1)
+                bucket = range(start, end)
+                contacts.extend(self._rng.sample(bucket, min(constants.k, len(bucket))))
+                start, end = self._range_with_prefix(own, bit + 1)
+                if end - start <= 1:
+                    break
+                bit += 1
+            self._routing_tables[index] = contacts
+        return self._routing_tables[index]
+
+    def closest(self, index, key, count=constants.k):
+        key = to_int(key)
+        contacts = sorted(self.routing_table(index), key=lambda i: self.int_ids[i] ^ key)[:count]
+        return [(self.node_ids[i],) + to_address(i) for i in contacts]
+
+    def respond(self, address, method, key):
+        started = time.clock()
+        self.rpc_count += 1
+        triples = self.closest(self.by_address[address], key)
+        if method == 'findValue':
+            result = {'token': '\x00' * 48, 'contacts': triples}
+        else:
+            result = triples
+        self.simulation_time += time.clock() - started
+        return result
+
+
+class SimulatedProtocol(object):
+    def __init__(self, network):
+        self._network = network
+
+    def sendRPC(self, contact, method, args):
+        return defer.succeed(self._network.respond((contact.address, contact.port), method, args[0]))
+
+
+class SearchingNode(object):
+    def __init__(self, network, clock):
+        self.clock = clock
+        self.node_id = hashlib.sha384("searching node").digest()
+        self.contact_manager = ContactManager(clock.seconds)
+        self._protocol = SimulatedProtocol(network)
+        self.call_later_manager = CallLaterManager(clock.callLater)
+        self.reactor_callLater = self.call_later_manager.call_later
+
+
+def run_lookup(network, node, clock, key, rpc):
+    start_index = network.by_address[to_address(random.randrange(len(network.node_ids)))]
+    shortlist = [
+        node.contact_manager.make_contact(node_id, address, port, node._protocol)
+        for (node_id, address, port) in network.closest(start_index, key)
+    ]
+    finished = iterativeFind(node, shortlist, key, rpc)
+    while not finished.called and clock.calls:
+        clock.advance(max(0, clock.calls[0].getTime() - clock.seconds()))
+    return finished.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--rpc', default='findNode', choices=['findNode', 'findValue'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    network = SimulatedNetwork(args.nodes, random.Random(args.seed))
+    clock = task.Clock()
+    node = SearchingNode(network, clock)
+    keys = [hashlib.sha384("key %i" % i).digest() for i in range(args.lookups)]
+
+    started = time.clock()
+    results = [run_lookup(network, node, clock, key, args.rpc) for key in keys]
+    elapsed = time.clock() - started - network.simulation_time
+
+    found_closest = 0
+    for key, result in zip(keys, results):
+        if args.rpc == 'findNode' and result:
+            distance = to_int(key)
+            expected = min(network.int_ids, key=lambda i: i ^ distance)
+            found_closest += int(to_int(result[0].id) == expected)
+
+    print "%i %s lookups in a %i node network" % (args.lookups, args.rpc, args.nodes)
+    print "lookup cpu time: %.2fms per lookup (%.2fs total)" % (1000.0 * elapsed / args.lookups, elapsed)
+    print "rpcs per lookup: %.1f" % (float(network.rpc_count) / args.lookups)
+    if args.rpc == 'findNode':
+        print "closest node found: %.1f%%" % (100.0 * found_closest / args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the size and the encode/decode CPU cost of DHT messages in the bencoded format used with protocol version
+0 and 1 contacts and the binary format used with protocol version 2 contacts
+"""
+
+import time
+import hashlib
+import argparse
+from lbrynet.dht import constants
+from lbrynet.dht.encoding import Bencode
+from lbrynet.dht.msgformat import DefaultFormat, BinaryFormat
+from lbrynet.dht.msgtypes import RequestMessage, ResponseMessage
+from lbrynet.dht.protocol import KademliaProtocol
+
+
+def make_id(name):
+    return hashlib.sha384(name).digest()
+
+
+def make_messages(peers):
+    node_id, key, token = make_id("node"), make_id("key"), make_id("token")
+    contacts = [(make_id("contact %i" % i), "10.0.%i.%i" % (i / 256, i % 256), 4444) for i in range(constants.k)]
+    compact_peers = ['\x0a\x00\x00\x01\x0d\x05' + make_id("peer %i" % i) for i in range(peers)]
+    rpc_id = node_id[:constants.rpc_id_length]
+    return [
+        ("ping request", RequestMessage(node_id, 'ping', (), rpc_id)),
+        ("ping response", ResponseMessage(rpc_id, node_id, 'pong')),
+        ("findNode request", RequestMessage(node_id, 'findNode', (key,), rpc_id)),
+        ("findNode response", ResponseMessage(rpc_id, node_id, contacts)),
+        ("findValue request", RequestMessage(node_id, 'findValue', (key,), rpc_id)),
+        ("findValue response, contacts", ResponseMessage(
+            rpc_id, node_id, {'token': token, 'protocolVersion': 2, 'contacts': contacts})),
+        ("findValue response, %i peers" % peers, ResponseMessage(
+            rpc_id, node_id, {'token': token, 'protocolVersion': 2, key: compact_peers})),
+        ("store request", RequestMessage(node_id, 'store', (key, token, 3333, node_id, 0), rpc_id)),
+        ("store response", ResponseMessage(rpc_id, node_id, 'OK')),
+    ]
+
+
+def bencode_message(message):
+    # bencoded requests to version 1 contacts carry the protocol version as a keyword argument
+    if isinstance(message, RequestMessage):
+        message = RequestMessage(message.nodeID, message.request,
+                                 message.args + ({'protocolVersion': constants.protocolVersion},), message.id)
+    return Bencode().encode(DefaultFormat().toPrimitive(message))
+
+
+def time_per_call(func, arg, iterations):
+    started = time.clock()
+    for _ in xrange(iterations):
+        func(arg)
+    return 1000000.0 * (time.clock() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--peers', type=int, default=100, help="peers in the findValue response with peers")
+    args = parser.parse_args()
+
+    translator, encoder, binary = DefaultFormat(), Bencode(), BinaryFormat()
+
+    def bdecode(data):
+        return translator.fromPrimitive(encoder.decode(data))
+
+    print "%-32s %17s %17s %19s" % ("", "size (bytes)", "encode (us)", "decode (us)")
+    print "%-32s %8s %8s %8s %8s %9s %9s" % ("message", "bencode", "binary", "bencode", "binary", "bencode",
+                                             "binary")
+    for name, message in make_messages(args.peers):
+        bencoded, packed = bencode_message(message), binary.encode(message)
+        iterations = max(1, args.iterations / max(1, len(packed) / 500))
+        print "%-32s %8i %8i %8.1f %8.1f %9.1f %9.1f" % (
+            name, len(bencoded), len(packed),
+            time_per_call(bencode_message, message, iterations), time_per_call(binary.encode, message, iterations),
+            time_per_call(bdecode, bencoded, iterations), time_per_call(binary.decode, packed, iterations))
+    for fmt, encode in (("bencoded", bencode_message), ("binary", binary.encode)):
+        peers = 0
+        while len(encode(make_messages(peers + 1)[6][1])) <= KademliaProtocol.msgSizeLimit:
+            peers += 1
+        print "%s findValue response: up to %i peers fit in one datagram" % (fmt, peers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Runs a network of DHT nodes in process on a virtual clock and reports how bootstrapping, announcing and looking up
+behave at scale
+
+Every node is a real lbrynet.dht.node.Node talking over the mock UDP transport used by the functional tests, with
+configurable latency, jitter, packet loss and churn. Times reported as "virtual" are in simulated seconds, cpu and
+wall times are what it took to run the simulation.
+"""
+
+import os
+import sys
+import time
+import logging
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "lbrynet", "tests", "functional", "dht"))
+
+from dht_simulation import DHTSimulation, LookupRecorder  # pylint: disable=wrong-import-position
+from mock_transport import MockNetwork  # pylint: disable=wrong-import-position
+
+
+def rss_kb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Timer(object):
+    def __init__(self, simulation):
+        self._simulation = simulation
+
+    def __enter__(self):
+        self.virtual = self._simulation.clock.seconds()
+        self.cpu = time.clock()
+        self.wall = time.time()
+        self.datagrams = MockNetwork.datagrams_sent
+        self.bytes = MockNetwork.bytes_sent
+        return self
+
+    def __exit__(self, *exc_info):
+        self.virtual = self._simulation.clock.seconds() - self.virtual
+        self.cpu = time.clock() - self.cpu
+        self.wall = time.time() - self.wall
+        self.datagrams = MockNetwork.datagrams_sent - self.datagrams
+        self.bytes = MockNetwork.bytes_sent - self.bytes
+
+    def report(self, name):
+        print "%s: %.1fs virtual, %.2fs cpu, %.2fs wall, %i datagrams (%.1f KiB)" % (
+            name, self.virtual, self.cpu, self.wall, self.datagrams, self.bytes / 1024.0)
+
+
+def report_lookups(name, lookups, successful):
+    finished = [lookup for lookup in lookups if lookup['finished'] is not None]
+    hops = [lookup['hops'] for lookup in finished]
+    rpcs = [lookup['rpcs'] for lookup in finished]
+    latency = [lookup['finished'] - lookup['started'] for lookup in finished]
+    print "%s: %i lookups, %.1f%% successful" % (name, len(lookups), 100.0 * successful / max(1, len(lookups)))
+    if finished:
+        print "  hops: mean %.2f, p50 %i, p90 %i, max %i" % (
+            float(sum(hops)) / len(hops), percentile(hops, 0.5), percentile(hops, 0.9), max(hops))
+        print "  rpcs: mean %.1f, p50 %i, p90 %i, max %i" % (
+            float(sum(rpcs)) / len(rpcs), percentile(rpcs, 0.5), percentile(rpcs, 0.9), max(rpcs))
+        print "  virtual latency: p50 %.3fs, p90 %.3fs, p99 %.3fs" % (
+            percentile(latency, 0.5), percentile(latency, 0.9), percentile(latency, 0.99))
+
+
+def report_routing_tables(simulation):
+    sizes = [len(node.contacts) for node in simulation.all_nodes]
+    print "  routing table size: mean %.1f, min %i, max %i" % (float(sum(sizes)) / len(sizes), min(sizes), max(sizes))
+    known = [len(node.contact_manager._contacts) for node in simulation.all_nodes]
+    print "  contacts known: mean %.1f, max %i" % (float(sum(known)) / len(known), max(known))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--seeds', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help="one way latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.02, help="maximum random extra latency in seconds")
+    parser.add_argument('--loss', type=float, default=0.0, help="fraction of datagrams dropped")
+    parser.add_argument('--settle', type=float, default=900,
+                        help="virtual seconds to run the network for after bootstrapping, before the workloads")
+    parser.add_argument('--churn', type=int, default=0, help="nodes replaced before the lookups are run")
+    parser.add_argument('--announces', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger("lbrynet").setLevel(logging.CRITICAL)
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    rss_before = rss_kb()
+    simulation = DHTSimulation(args.seeds, args.latency, args.jitter, args.loss, args.seed)
+    recorder = LookupRecorder()
+    recorder.install()
+    try:
+        with Timer(simulation) as bootstrap:
+            simulation.start_seeds()
+            simulation.add_nodes(args.nodes - args.seeds)
+        bootstrap.report("bootstrap of %i nodes" % len(simulation.all_nodes))
+        print "  join time: p50 %.2fs, p90 %.2fs virtual" % (
+            percentile(simulation.join_times, 0.5), percentile(simulation.join_times, 0.9))
+        print "  memory: %.1f KiB per node" % (float(rss_kb() - rss_before) / len(simulation.all_nodes))
+        report_routing_tables(simulation)
+
+        if args.settle:
+            with Timer(simulation) as settle:
+                simulation.clock.advance(args.settle)
+            settle.report("settling")
+            print "  memory: %.1f KiB per node" % (float(rss_kb() - rss_before) / len(simulation.all_nodes))
+            report_routing_tables(simulation)
+
+        if args.churn:
+            with Timer(simulation) as churn:
+                simulation.churn(args.churn)
+            churn.report("churn of %i nodes" % args.churn)
+
+        rng = simulation.rng
+        blob_hashes = [hashlib.sha384("blob %i" % i).digest() for i in range(args.announces)]
+        recorder.clear()
+        with Timer(simulation) as announce:
+            simulation.run([rng.choice(simulation.nodes).announceHaveBlob(blob_hash) for blob_hash in blob_hashes],
+                           3600)
+        announce.report("announce of %i blobs" % args.announces)
+
+        recorder.clear()
+        results = []
+        with Timer(simulation) as find_value:
+            for blob_hash in (rng.choice(blob_hashes) for _ in range(args.lookups)):
+                d = rng.choice(simulation.nodes).iterativeFindValue(blob_hash)
+                d.addCallback(lambda peers: results.append(bool(peers)))
+                simulation.run([d], 3600)
+        find_value.report("findValue")
+        report_lookups("findValue", recorder.lookups, sum(results))
+
+        recorder.clear()
+        results = []
+        with Timer(simulation) as find_node:
+            for _ in range(args.lookups):
+                searcher, target = rng.sample(simulation.all_nodes, 2)
+                d = searcher.iterativeFindNode(target.node_id)
+                d.addCallback(lambda contacts, key=target.node_id: results.append(
+                    bool(contacts) and contacts[0].id == key))
+                simulation.run([d], 3600)
+        find_node.report("findNode")
+        report_lookups("findNode", recorder.lookups, sum(results))
+        print "datagrams lost: %i of %i" % (MockNetwork.datagrams_lost, MockNetwork.datagrams_sent)
+    finally:
+        recorder.uninstall()
+        simulation.stop()
+
+
+if __name__ == "__main__":
+    main()
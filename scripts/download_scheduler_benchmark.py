@@ -0,0 +1,197 @@
+"""
+Simulates downloading streams from swarms of peers with mixed upload speeds and reports the percentiles of the
+time it took to download the start of the stream, which is what playback waits for, and the whole stream, comparing DownloadScheduler with how blobs were chosen before it
+
+Each trial connects to a random set of peers, each having a random part of the stream. A peer uploads one blob
+at a time at its speed, and blob requests take one way latency to reach it. When a blob finishes downloading from
+one peer the other downloads of it are cancelled, which closes their connections like ClientProtocol does. They are
+reconnected by the next ConnectionManager.manage call, after a connection and price negotiation round trip. The data
+the cancelled downloads had received is reported as wasted.
+"""
+
+import heapq
+import random
+import argparse
+from lbrynet.core.client.ConnectionManager import ConnectionManager
+from lbrynet.core.client.DownloadScheduler import DownloadScheduler
+
+
+class Blob(object):
+    def __init__(self, blob_num, length):
+        self.blob_num = blob_num
+        self.blob_hash = str(blob_num)
+        self.length = length
+        self.writers = {}
+        self.verified = False
+
+    def is_downloading(self):
+        return bool(self.writers)
+
+    def get_is_verified(self):
+        return self.verified
+
+
+def old_choice(peer, needed_blobs, blob_peers):
+    # DownloadRequest.get_available_blobs and find_blob before the scheduler
+    return [blob for blob in sorted(needed_blobs, key=lambda b: b.is_downloading())
+            if peer in blob_peers[blob.blob_hash] and peer not in blob.writers]
+
+
+class Writer(object):
+    def __init__(self, simulation, connection, start):
+        self.simulation = simulation
+        self.connection = connection
+        self.start = start
+
+    @property
+    def len_so_far(self):
+        return max(0, int((self.simulation.now - self.start) * self.connection.speed))
+
+
+class Connection(object):
+    def __init__(self, peer, speed):
+        self.peer = peer
+        self.speed = speed
+        self.queued = []  # blobs requested and not finished
+        self.server_free_at = 0.0
+        self.epoch = 0  # bumped when the connection is closed, to ignore its pending events
+
+
+class Simulation(object):
+    def __init__(self, rng, choose_blobs, speeds, available, blob_size, latency, pipelined, start_blobs):
+        self.rng = rng
+        self.choose_blobs = choose_blobs
+        self.latency = latency
+        self.pipelined = pipelined
+        self.blobs = [Blob(i, blob_size) for i in range(len(available))]
+        self.connections = [Connection("peer %i" % i, speed) for i, speed in enumerate(speeds)]
+        self.blob_peers = {b.blob_hash: set(self.connections[i].peer for i in available[b.blob_num])
+                           for b in self.blobs}
+        self.events = []
+        self.now = 0.0
+        self.start_blobs = start_blobs
+        self.started_at = None
+        self.finished_at = None
+        self.counter = 0
+        self.wasted = 0
+
+    def schedule(self, at, action, *args):
+        self.counter += 1
+        heapq.heappush(self.events, (at, self.counter, action, args))
+
+    def needed(self):
+        return [blob for blob in self.blobs if not blob.verified]
+
+    def request_more(self, connection):
+        while len(connection.queued) < self.pipelined:
+            needed = self.needed()
+            if not needed:
+                return
+            choices = self.choose_blobs(connection.peer, needed, self.blob_peers)
+            if not choices:
+                return
+            self.request(connection, choices[0])
+
+    def request(self, connection, blob):
+        connection.queued.append(blob)
+        # the request reaches the server, which uploads its blobs one after the other
+        start = max(self.now + self.latency, connection.server_free_at)
+        blob.writers[connection.peer] = (Writer(self, connection, start + self.latency), None)
+        connection.server_free_at = start + float(blob.length) / connection.speed
+        if self.pipelined > 1:
+            # the next request is made when the response to this one arrives
+            self.schedule(start + self.latency, self.response_received, connection, connection.epoch)
+        self.schedule(connection.server_free_at + self.latency, self.blob_received, connection, blob,
+                      connection.epoch)
+
+    def response_received(self, connection, epoch):
+        if epoch == connection.epoch:
+            self.request_more(connection)
+
+    def blob_received(self, connection, blob, epoch):
+        if epoch != connection.epoch:
+            return
+        connection.queued.remove(blob)
+        del blob.writers[connection.peer]
+        blob.verified = True
+        for writer, _ in blob.writers.values():
+            self.wasted += min(writer.len_so_far, blob.length)
+            self.close(writer.connection)
+        blob.writers.clear()
+        if self.started_at is None and all(b.verified for b in self.blobs[:self.start_blobs]):
+            self.started_at = self.now
+        if not self.needed():
+            self.finished_at = self.now
+            return
+        self.request_more(connection)
+        for idle in self.connections:
+            if not idle.queued:
+                self.request_more(idle)
+
+    def close(self, connection):
+        connection.epoch += 1
+        for blob in connection.queued:
+            blob.writers.pop(connection.peer, None)
+        connection.queued = []
+        connection.server_free_at = 0.0
+        manage_call = self.rng.uniform(0, ConnectionManager.MANAGE_CALL_INTERVAL_SEC)
+        self.schedule(self.now + manage_call + 4 * self.latency, self.reconnect, connection, connection.epoch)
+
+    def reconnect(self, connection, epoch):
+        if epoch == connection.epoch:
+            self.request_more(connection)
+
+    def run(self):
+        for connection in self.connections:
+            self.request_more(connection)
+        while self.events and self.finished_at is None:
+            self.now, _, action, args = heapq.heappop(self.events)
+            action(*args)
+        return self.started_at, self.finished_at, self.wasted
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--trials', type=int, default=500)
+    parser.add_argument('--blobs', type=int, default=40)
+    parser.add_argument('--blob_size', type=int, default=2 ** 21)
+    parser.add_argument('--connections', type=int, default=5, help="peers downloaded from at once")
+    parser.add_argument('--latency', type=float, default=0.05, help="one way latency in seconds")
+    parser.add_argument('--speeds', type=float, nargs='+', default=[2000, 500, 100, 25],
+                        help="upload speeds in KiB/s, each peer gets one at random")
+    parser.add_argument('--availability', type=float, default=0.6,
+                        help="chance of a peer having a blob, every blob is on at least one peer")
+    parser.add_argument('--pipelined', type=int, default=1, help="blob requests queued per connection")
+    parser.add_argument('--start_blobs', type=int, default=4, help="blobs needed to start playing the stream")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    swarms = []
+    for _ in range(args.trials):
+        speeds = [rng.choice(args.speeds) * 1024 for _ in range(args.connections)]
+        available = []
+        for _ in range(args.blobs):
+            peers = set(i for i in range(args.connections) if rng.random() < args.availability)
+            available.append(peers or set([rng.randrange(args.connections)]))
+        swarms.append((speeds, available))
+    print "%-10s %8s %8s %8s %8s %8s %8s %12s" % ("policy", "start", "", "", "finish", "", "", "wasted MiB")
+    print "%-10s %8s %8s %8s %8s %8s %8s" % ("", "p50 s", "p90 s", "p99 s", "p50 s", "p90 s", "p99 s")
+    for name, choose_blobs in (("old", old_choice), ("scheduler", DownloadScheduler().blobs_for_peer)):
+        sim_rng = random.Random(args.seed)
+        results = [Simulation(sim_rng, choose_blobs, speeds, available, args.blob_size, args.latency,
+                              args.pipelined, args.start_blobs).run() for speeds, available in swarms]
+        started = [result[0] for result in results]
+        finished = [result[1] for result in results]
+        wasted = sum(result[2] for result in results) / 2.0 ** 20 / len(results)
+        print "%-10s %8.1f %8.1f %8.1f %8.1f %8.1f %8.1f %12.1f" % (
+            name, percentile(started, 0.5), percentile(started, 0.9), percentile(started, 0.99),
+            percentile(finished, 0.5), percentile(finished, 0.9), percentile(finished, 0.99), wasted)
+
+if __name__ == "__main__":
+    main()
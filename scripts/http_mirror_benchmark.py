@@ -0,0 +1,223 @@
+"""
+Downloads a stream's worth of blobs from local HTTP mirrors with injected latency, bandwidth limits and stalls,
+comparing HTTPBlobDownloader with the one it replaced, which downloaded 2 blobs at a time from mirrors chosen at
+random and never asked a second mirror
+
+By default one mirror is fast, one has high latency and little bandwidth, and one is fast but sometimes stalls for
+seconds before answering. Each mirror's bandwidth is per connection. The time half and 95% of the blobs were done
+by is reported along with the total.
+"""
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import argparse
+from twisted.internet import reactor, defer, task
+from twisted.web import server, resource
+import treq
+
+from lbrynet.blob.blob_file import BlobFile
+from lbrynet.core import HTTPBlobDownloader
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from lbrynet.core.Error import DownloadCanceledError
+
+
+class OldHTTPBlobDownloader(HTTPBlobDownloader.HTTPBlobDownloader):
+    def __init__(self, blob_manager, blob_hashes=None, servers=None, client=None, sd_hashes=None):
+        HTTPBlobDownloader.HTTPBlobDownloader.__init__(self, blob_manager, blob_hashes, servers, client or treq,
+                                                       sd_hashes)
+        self.semaphore = defer.DeferredSemaphore(2)
+
+    @defer.inlineCallbacks
+    def _start(self):
+        self.running = True
+        dl = []
+        for blob_hash in self.blob_hashes:
+            blob = yield self.blob_manager.get_blob(blob_hash)
+            if not blob.verified:
+                d = self.semaphore.run(self.download_blob, blob)
+                d.addErrback(lambda err: err.check(defer.TimeoutError, defer.CancelledError))
+                dl.append(d)
+        self.deferreds = dl
+        yield defer.DeferredList(dl)
+
+    @defer.inlineCallbacks
+    def download_blob(self, blob):
+        for _ in range(self.max_failures):
+            writer, finished_deferred = blob.open_for_writing('mirror')
+            self.writers.append(writer)
+            try:
+                response = yield self.client.get(HTTPBlobDownloader.url_for(random.choice(self.servers),
+                                                                            blob.blob_hash))
+                if response.code != 200:
+                    break
+                blob.set_length(response.length)
+                yield self.client.collect(response, writer.write)
+                yield finished_deferred
+                if blob.verified:
+                    yield self.blob_manager.blob_completed(blob, should_announce=False)
+                break
+            except (IOError, Exception) as e:
+                if isinstance(e, DownloadCanceledError) or 'closed file' in str(e):
+                    break
+            finally:
+                finished_deferred.addBoth(lambda _: None)
+                if 'mirror' in blob.writers:
+                    writer.close()
+                self.writers.remove(writer)
+
+
+class BlobResource(resource.Resource):
+    isLeaf = True
+    CHUNK_SIZE = 2 ** 14
+
+    def __init__(self, blobs, latency, bandwidth, stall_rate, stall_seconds, rng):
+        resource.Resource.__init__(self)
+        self.blobs = blobs
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.rng = rng
+        self.requests = 0
+
+    def render_GET(self, request):
+        self.requests += 1
+        blob_hash = request.postpath[0] if request.postpath else ''
+        if blob_hash not in self.blobs:
+            request.setResponseCode(404)
+            return ''
+        delay = self.latency
+        if self.rng.random() < self.stall_rate:
+            delay += self.stall_seconds
+        request.setHeader('content-length', str(len(self.blobs[blob_hash])))
+        cancelled = []
+        request.notifyFinish().addErrback(lambda _: cancelled.append(True))
+
+        def send(offset):
+            if cancelled:
+                return
+            request.write(self.blobs[blob_hash][offset:offset + self.CHUNK_SIZE])
+            offset += self.CHUNK_SIZE
+            if offset < len(self.blobs[blob_hash]):
+                reactor.callLater(float(self.CHUNK_SIZE) / self.bandwidth, send, offset)
+            else:
+                request.finish()
+
+        reactor.callLater(delay, send, 0)
+        return server.NOT_DONE_YET
+
+
+class CountingSite(server.Site):
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return server.Site.buildProtocol(self, addr)
+
+
+class BlobManager(object):
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        self.blobs = {}
+        self.completed = {}  # {blob_hash: timestamp}
+
+    def get_blob(self, blob_hash):
+        if blob_hash not in self.blobs:
+            self.blobs[blob_hash] = BlobFile(self.blob_dir, blob_hash)
+        return defer.succeed(self.blobs[blob_hash])
+
+    def blob_completed(self, blob, should_announce=False):
+        self.completed[blob.blob_hash] = time.time()
+        return defer.succeed(None)
+
+
+def make_blobs(args):
+    blobs = {}
+    for _ in range(args.blobs):
+        data = os.urandom(args.blob_size)
+        blob_hash = get_lbry_hash_obj()
+        blob_hash.update(data)
+        blobs[blob_hash.hexdigest()] = data
+    return blobs
+
+
+def start_mirrors(blobs, args, rng):
+    mirrors = []
+    for latency, bandwidth, stall_rate in ((args.fast_latency, args.fast_bandwidth, 0),
+                                           (args.slow_latency, args.slow_bandwidth, 0),
+                                           (args.fast_latency, args.fast_bandwidth, args.stall_rate)):
+        site = CountingSite(BlobResource(blobs, latency, bandwidth, stall_rate, args.stall_seconds, rng))
+        port = reactor.listenTCP(0, site, interface='127.0.0.1')
+        mirrors.append((site, port))
+    return mirrors
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+@defer.inlineCallbacks
+def download(name, downloader_class, blobs, mirrors, args):
+    blob_dir = tempfile.mkdtemp()
+    blob_manager = BlobManager(blob_dir)
+    servers = ['127.0.0.1:%i' % port.getHost().port for _, port in mirrors]
+    connections = sum(site.connections for site, _ in mirrors)
+    HTTPBlobDownloader._mirrors.clear()
+    downloader = downloader_class(blob_manager, list(blobs), servers)
+    started = time.time()
+    yield downloader.start()
+    seconds = time.time() - started
+    connections = sum(site.connections for site, _ in mirrors) - connections
+    shutil.rmtree(blob_dir)
+    blob_seconds = [completed - started for completed in blob_manager.completed.itervalues()]
+    if blob_seconds:
+        p50, p95 = percentile(blob_seconds, 0.5), percentile(blob_seconds, 0.95)
+    else:
+        p50 = p95 = 0
+    print "%-12s %8i %10.2f %12.2f %12.2f %12i" % (name, len(blob_manager.completed), seconds, p50, p95,
+                                                   connections)
+
+
+@defer.inlineCallbacks
+def run(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    blobs = make_blobs(args)
+    mirrors = start_mirrors(blobs, args, rng)
+    print "%-12s %8s %10s %12s %12s %12s" % ("downloader", "blobs", "seconds", "p50 done s", "p95 done s",
+                                             "connections")
+    try:
+        for name, downloader_class in (("old", OldHTTPBlobDownloader),
+                                       ("adaptive", HTTPBlobDownloader.HTTPBlobDownloader)):
+            yield download(name, downloader_class, blobs, mirrors, args)
+            # let the connections of the old downloader's pool close before the next run
+            yield task.deferLater(reactor, 0.1, lambda: None)
+    finally:
+        for _, port in mirrors:
+            yield port.stopListening()
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blobs', type=int, default=40)
+    parser.add_argument('--blob_size', type=int, default=2 ** 19)
+    parser.add_argument('--fast_latency', type=float, default=0.02, help="seconds before a fast mirror answers")
+    parser.add_argument('--fast_bandwidth', type=int, default=2 ** 21, help="bytes per second per connection")
+    parser.add_argument('--slow_latency', type=float, default=0.3)
+    parser.add_argument('--slow_bandwidth', type=int, default=2 ** 18)
+    parser.add_argument('--stall_rate', type=float, default=0.15, help="share of requests the stalling mirror "
+                                                                       "stalls")
+    parser.add_argument('--stall_seconds', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
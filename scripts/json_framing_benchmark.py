@@ -0,0 +1,96 @@
+"""
+Measures how many peer protocol messages per second can be decoded when they arrive split into TCP segments of
+random sizes, comparing JSONMessageDecoder with the buffering and parsing the client and server used before it
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+from lbrynet.core.json_framing import JSONMessageDecoder
+
+
+def make_message(blobs):
+    # an availability response like the one sent by the BlobAvailabilityHandler, with a price
+    return json.dumps({
+        'available_blobs': [hashlib.sha384(str(i)).hexdigest() for i in range(blobs)],
+        'lbrycrd_address': 'bMqNUYpxCAvmp3HRyKgTAHpe9eZr7c6Kzu',
+        'blob_data_payment_rate': 'RATE_ACCEPTED',
+    })
+
+
+def split(data, rng, max_segment):
+    segments = []
+    position = 0
+    while position < len(data):
+        size = rng.randint(1, max_segment)
+        segments.append(data[position:position + size])
+        position += size
+    return segments
+
+
+def old_client(segments):
+    # ClientProtocol._get_valid_response, run on the whole buffer for every segment
+    buff = ''
+    for segment in segments:
+        buff += segment
+        position = 0
+        while True:
+            close = buff.find('}', position)
+            if close == -1:
+                break
+            position = close + 1
+            try:
+                return json.loads(buff[:position])
+            except ValueError:
+                pass
+
+
+def old_server(segments):
+    # ServerRequestHandler.try_to_parse_request, run on the whole buffer for every segment
+    buff = ''
+    for segment in segments:
+        buff += segment
+        try:
+            return json.loads(buff)
+        except ValueError:
+            pass
+
+
+def decoder(segments):
+    json_decoder = JSONMessageDecoder()
+    for segment in segments:
+        json_decoder.feed(segment)
+        message = json_decoder.next_message()
+        if message is not None:
+            return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--blobs', type=int, nargs='+', default=[1, 20, 100])
+    parser.add_argument('--max_segment', type=int, nargs='+', default=[16, 256, 1460])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print "%6s %8s %11s %15s %15s %15s" % ("blobs", "bytes", "max segment", "old client/s", "old server/s",
+                                            "decoder/s")
+    for blobs in args.blobs:
+        message = make_message(blobs)
+        expected = json.loads(message)
+        for max_segment in args.max_segment:
+            streams = [split(message, rng, max_segment) for _ in range(args.messages)]
+            rates = []
+            for decode in (old_client, old_server, decoder):
+                started = time.clock()
+                for segments in streams:
+                    assert decode(segments) == expected
+                rates.append(args.messages / (time.clock() - started))
+            print "%6i %8i %11i %15.0f %15.0f %15.0f" % ((blobs, len(message), max_segment) + tuple(rates))
+
+
+if __name__ == "__main__":
+    main()
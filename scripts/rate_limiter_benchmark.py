@@ -0,0 +1,160 @@
+"""
+Simulates connections downloading and uploading as fast as they can under a rate limit on a virtual clock, and
+charts the throughput each stream or upload slot gets every second, comparing the hierarchical token bucket
+RateLimiter with the one it replaced, which counted bytes in 100 ms intervals and paused every protocol at once
+
+A watched stream and a background download share the download limit, with the background download using more
+connections, and a few upload slots share the upload limit. Half way through the background download stops.
+"""
+
+import argparse
+from collections import defaultdict
+from twisted.internet import task
+from lbrynet.core import utils
+from lbrynet.core import RateLimiter
+
+
+class OldRateLimiter(object):
+    def __init__(self, clock, max_dl_bytes=None, max_ul_bytes=None):
+        self.clock = clock
+        self.max_dl_bytes = max_dl_bytes
+        self.max_ul_bytes = max_ul_bytes
+        self.dl_bytes_this_interval = 0
+        self.ul_bytes_this_interval = 0
+        self.tick_interval = 0.1
+        self.dl_throttled = False
+        self.ul_throttled = False
+        self.protocols = []
+        self.tick_call = task.LoopingCall(self.tick)
+        self.tick_call.clock = clock
+        self.tick_call.start(self.tick_interval)
+
+    def tick(self):
+        self.dl_bytes_this_interval = 0
+        self.ul_bytes_this_interval = 0
+        self.set_throttled('dl', False)
+        self.set_throttled('ul', False)
+
+    def set_throttled(self, direction, throttled):
+        if getattr(self, direction + '_throttled') != throttled:
+            for protocol in self.protocols:
+                protocol.set_paused(direction, throttled)
+            setattr(self, direction + '_throttled', throttled)
+
+    def report_dl_bytes(self, num_bytes, protocol=None):
+        self.dl_bytes_this_interval += num_bytes
+        if self.max_dl_bytes is not None and self.dl_bytes_this_interval > self.max_dl_bytes * self.tick_interval:
+            self.clock.callLater(0, self.set_throttled, 'dl', True)
+
+    def report_ul_bytes(self, num_bytes, protocol=None):
+        self.ul_bytes_this_interval += num_bytes
+        if self.max_ul_bytes is not None and self.ul_bytes_this_interval > self.max_ul_bytes * self.tick_interval:
+            self.clock.callLater(0, self.set_throttled, 'ul', True)
+
+    def register_protocol(self, protocol, group=None, priority=None):
+        self.protocols.append(protocol)
+
+    def unregister_protocol(self, protocol):
+        self.protocols.remove(protocol)
+
+
+class Connection(object):
+    def __init__(self, name, direction):
+        self.name = name
+        self.direction = direction
+        self.paused = False
+        self.pauses = 0
+
+    def set_paused(self, direction, paused):
+        if direction == self.direction:
+            if paused and not self.paused:
+                self.pauses += 1
+            self.paused = paused
+
+    def throttle_download(self):
+        self.set_paused('dl', True)
+
+    def unthrottle_download(self):
+        self.set_paused('dl', False)
+
+    def throttle_upload(self):
+        self.set_paused('ul', True)
+
+    def unthrottle_upload(self):
+        self.set_paused('ul', False)
+
+
+def make_connections(rate_limiter, args):
+    groups = [
+        ("watched", 'dl', args.stream_connections, RateLimiter.PRIORITY_STREAMING),
+        ("background", 'dl', args.background_connections, RateLimiter.PRIORITY_DOWNLOAD),
+    ] + [("upload %i" % i, 'ul', 1, RateLimiter.PRIORITY_UPLOAD) for i in range(args.upload_slots)]
+    connections = []
+    for name, direction, count, priority in groups:
+        for _ in range(count):
+            connection = Connection(name, direction)
+            rate_limiter.register_protocol(connection, name, priority)
+            connections.append(connection)
+    return connections
+
+
+def run(make_rate_limiter, clock, args):
+    rate_limiter = make_rate_limiter()
+    connections = make_connections(rate_limiter, args)
+    chart = defaultdict(lambda: defaultdict(int))  # {second: {group: bytes}}
+    steps_per_second = int(round(1 / args.step))
+    for step in range(args.seconds * steps_per_second):
+        second = step // steps_per_second
+        if second == args.seconds // 2 and step % steps_per_second == 0:
+            for connection in [c for c in connections if c.name == "background"]:
+                rate_limiter.unregister_protocol(connection)
+                connections.remove(connection)
+        for connection in connections:
+            if not connection.paused:
+                chart[second][connection.name] += args.chunk_size
+                if connection.direction == 'dl':
+                    rate_limiter.report_dl_bytes(args.chunk_size, connection)
+                else:
+                    rate_limiter.report_ul_bytes(args.chunk_size, connection)
+        clock.advance(args.step)
+    pauses = sum(c.pauses for c in connections)
+    return chart, pauses
+
+
+def print_chart(title, chart, pauses, args):
+    names = ["watched", "background"] + ["upload %i" % i for i in range(args.upload_slots)]
+    print title
+    print "%-8s" % "second" + "".join("%12s" % name for name in names) + "%12s%12s" % ("total dl", "total ul")
+    for second in sorted(chart):
+        row = chart[second]
+        total_dl = row["watched"] + row["background"]
+        total_ul = sum(row[name] for name in names[2:])
+        print "%-8i" % second + "".join("%12.0f" % (row[name] / 1024.0) for name in names) + \
+            "%12.0f%12.0f" % (total_dl / 1024.0, total_ul / 1024.0)
+    print "KiB/s per group, %i pauses of the remaining connections\n" % pauses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dl_limit', type=int, default=1024 * 1024, help="bytes per second")
+    parser.add_argument('--ul_limit', type=int, default=256 * 1024, help="bytes per second")
+    parser.add_argument('--stream_connections', type=int, default=2)
+    parser.add_argument('--background_connections', type=int, default=6)
+    parser.add_argument('--upload_slots', type=int, default=3)
+    parser.add_argument('--chunk_size', type=int, default=8192, help="bytes each connection reads or writes a step")
+    parser.add_argument('--step', type=float, default=0.005, help="seconds between reads and writes")
+    parser.add_argument('--seconds', type=int, default=10)
+    args = parser.parse_args()
+
+    for title, make_rate_limiter in (
+            ("old", lambda clock: OldRateLimiter(clock, args.dl_limit, args.ul_limit)),
+            ("token buckets", lambda clock: RateLimiter.RateLimiter(args.dl_limit, args.ul_limit))):
+        clock = task.Clock()
+        utils.call_later = clock.callLater
+        utils.timestamp = clock.seconds
+        chart, pauses = run(lambda: make_rate_limiter(clock), clock, args)
+        print_chart(title, chart, pauses, args)
+
+
+if __name__ == "__main__":
+    main()
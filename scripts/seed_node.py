@@ -1,19 +1,23 @@
+import os
+import sys
+import time
 import struct
 import json
 import logging
 import argparse
 import hashlib
+import itertools
 from copy import deepcopy
 from urllib import urlopen
 from twisted.internet.epollreactor import install as install_epoll
 install_epoll()
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, task, protocol
 from twisted.web import resource
 from twisted.web.server import Site
 from lbrynet import conf
 from lbrynet.dht import constants
 from lbrynet.dht.node import Node
-from lbrynet.dht.error import TransportNotConnected
+from lbrynet.dht.error import TransportNotConnected, TimeoutError
 from lbrynet.core.log_support import configure_console, configure_twisted
 from lbrynet.daemon.auth.server import AuthJSONRPCServer
 
@@ -26,6 +30,16 @@ log.addHandler(lbrynet_handler)
 log.setLevel(logging.INFO)
 
 
+# how often workers report the stats of their nodes to the supervisor (in seconds)
+STATS_INTERVAL = 10
+# a worker that exits within WORKER_STABLE_SECONDS of starting is restarted after a delay doubling from
+# WORKER_RESTART_DELAY up to MAX_WORKER_RESTART_DELAY seconds, and left stopped after MAX_WORKER_RESTARTS such exits
+WORKER_STABLE_SECONDS = 60
+WORKER_RESTART_DELAY = 1
+MAX_WORKER_RESTART_DELAY = 300
+MAX_WORKER_RESTARTS = 10
+
+
 def node_id_supplier(seed="jack.lbry.tech"):  # simple deterministic node id generator
     h = hashlib.sha384()
     h.update(seed)
@@ -72,18 +86,38 @@ def format_datastore(node):
     return result
 
 
+def format_node_stats(node):
+    stats = node.get_stats()
+    stats["running"] = node._join_deferred is not None and node._join_deferred.called
+    return stats
+
+
 class MultiSeedRPCServer(AuthJSONRPCServer):
-    def __init__(self, starting_node_port, nodes, rpc_port):
+    def __init__(self, starting_node_port, nodes, rpc_port, external_ip=None, worker=0, workers=1, stats_fd=None):
         AuthJSONRPCServer.__init__(self, False)
         self.port = None
         self.rpc_port = rpc_port
-        self.external_ip = get_external_ip()
-        node_id_gen = node_id_supplier()
-        self._nodes = [Node(node_id=next(node_id_gen), udpPort=starting_node_port+i, externalIP=self.external_ip)
-                       for i in range(nodes)]
-        self._own_addresses = [(self.external_ip, starting_node_port+i) for i in range(nodes)]
+        self.external_ip = external_ip or get_external_ip()
+        # every node of the seed, including the ones run by other workers, as (node id, udp port)
+        self._all_nodes = zip(itertools.islice(node_id_supplier(), nodes),
+                              range(starting_node_port, starting_node_port + nodes))
+        self._nodes = [Node(node_id=node_id, udpPort=port, externalIP=self.external_ip, metrics=True)
+                       for node_id, port in self._all_nodes[worker::workers]]
+        self._own_addresses = [(self.external_ip, port) for _, port in self._all_nodes]
+        self._worker = worker
+        self._stats_file = None if stats_fd is None else os.fdopen(stats_fd, 'w')
+        self._stats_lc = task.LoopingCall(self._report_stats)
         reactor.addSystemEventTrigger('after', 'startup', self.start)
 
+    def _report_stats(self):
+        self._stats_file.write(json.dumps({
+            "worker": self._worker,
+            "pid": os.getpid(),
+            "rpc_port": self.rpc_port,
+            "nodes": {node.node_id.encode('hex'): format_node_stats(node) for node in self._nodes}
+        }) + "\n")
+        self._stats_file.flush()
+
     @defer.inlineCallbacks
     def start(self):
         self.announced_startup = True
@@ -97,22 +131,26 @@ class MultiSeedRPCServer(AuthJSONRPCServer):
             yield node._protocol._listening
 
         for node1 in self._nodes:
-            for node2 in self._nodes:
-                if node1 is node2:
+            for node_id, port in self._all_nodes:
+                if node_id == node1.node_id:
                     continue
                 try:
-                    yield node1.addContact(node1.contact_manager.make_contact(node2.node_id, node2.externalIP,
-                                                                              node2.port, node1._protocol))
-                except TransportNotConnected:
+                    yield node1.addContact(node1.contact_manager.make_contact(node_id, self.external_ip, port,
+                                                                              node1._protocol))
+                except (TransportNotConnected, TimeoutError):
                     pass
             node1.safe_start_looping_call(node1._change_token_lc, constants.tokenSecretChangeInterval)
             node1.safe_start_looping_call(node1._refresh_node_lc, constants.checkRefreshInterval)
             node1._join_deferred = defer.succeed(True)
         reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        if self._stats_file:
+            self._stats_lc.start(STATS_INTERVAL)
         log.info("finished bootstrapping the network, running %i nodes", len(self._nodes))
 
     @defer.inlineCallbacks
     def stop(self):
+        if self._stats_lc.running:
+            self._stats_lc.stop()
         yield self.port.stopListening()
         yield defer.DeferredList([node.stop() for node in self._nodes])
 
@@ -207,10 +245,144 @@ class MultiSeedRPCServer(AuthJSONRPCServer):
                     break
         defer.returnValue(nodes)
 
-    def jsonrpc_node_status(self):
+    def jsonrpc_node_status(self, include_stats=False):
+        if not include_stats:
+            return defer.succeed({
+                node.node_id.encode('hex'): node._join_deferred is not None and node._join_deferred.called
+                for node in self._nodes
+            })
+        return defer.succeed({node.node_id.encode('hex'): format_node_stats(node) for node in self._nodes})
+
+
+class SeedWorkerProcess(protocol.ProcessProtocol):
+    """
+    Runs one worker of a multi-process seed and keeps the last stats it reported while it is running
+    """
+
+    def __init__(self, supervisor, worker):
+        self._supervisor = supervisor
+        self.worker = worker
+        self.stats = None
+        self.started_at = time.time()
+        self._buffer = ""
+
+    def childDataReceived(self, childFD, data):
+        if childFD != 3:
+            return
+        self._buffer += data
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            try:
+                self.stats = json.loads(line)
+            except ValueError:
+                log.warning("invalid stats from worker %i", self.worker)
+
+    def processEnded(self, reason):
+        self.stats = None
+        self._supervisor.worker_ended(self, reason)
+
+
+class SeedSupervisorRPCServer(AuthJSONRPCServer):
+    """
+    Starts the workers of a multi-process seed, restarts them if they exit, and serves the stats they report
+
+    Workers that keep exiting soon after starting, like ones that can't listen on their ports, are restarted with
+    an exponential backoff and given up on after MAX_WORKER_RESTARTS tries.
+
+    Every worker runs its share of the nodes on their own udp ports in its own reactor (see MultiSeedRPCServer), the
+    rpc server of worker i listens on localhost at the rpc port + 1 + i.
+    """
+
+    def __init__(self, starting_node_port, nodes, rpc_port, workers, external_ip=None):
+        AuthJSONRPCServer.__init__(self, False)
+        self.port = None
+        self.rpc_port = rpc_port
+        self.external_ip = external_ip or get_external_ip()
+        self._starting_node_port = starting_node_port
+        self._node_count = nodes
+        self._worker_count = workers
+        self._workers = {}
+        self._restarts = {}  # {worker: the number of times in a row it exited soon after starting}
+        self._restart_calls = {}  # {worker: the DelayedCall restarting it}
+        self._stopping = False
+        reactor.addSystemEventTrigger('after', 'startup', self.start)
+
+    def start(self):
+        self.announced_startup = True
+        root = resource.Resource()
+        root.putChild('', self)
+        self.port = reactor.listenTCP(self.rpc_port, Site(root), interface='localhost')
+        for worker in range(self._worker_count):
+            self._spawn_worker(worker)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        log.info("started %i workers running %i nodes on %s, rpc available on localhost:%i", self._worker_count,
+                 self._node_count, self.external_ip, self.rpc_port)
+
+    def _spawn_worker(self, worker):
+        args = [sys.executable, os.path.abspath(__file__), '--worker', str(worker),
+                '--workers', str(self._worker_count), '--nodes', str(self._node_count),
+                '--starting_port', str(self._starting_node_port), '--rpc_port', str(self.rpc_port + 1 + worker),
+                '--external_ip', self.external_ip]
+        process = SeedWorkerProcess(self, worker)
+        self._workers[worker] = process
+        reactor.spawnProcess(process, sys.executable, args, env=os.environ, childFDs={0: 'w', 1: 1, 2: 2, 3: 'r'})
+
+    def worker_ended(self, process, reason):
+        if self._stopping:
+            return
+        worker = process.worker
+        if time.time() - process.started_at >= WORKER_STABLE_SECONDS:
+            self._restarts[worker] = 0
+        else:
+            self._restarts[worker] = self._restarts.get(worker, 0) + 1
+        restarts = self._restarts[worker]
+        if restarts > MAX_WORKER_RESTARTS:
+            log.error("worker %i exited (%s) %i times in a row soon after starting, not restarting it", worker,
+                      reason.getErrorMessage(), restarts)
+            return
+        delay = 0 if not restarts else min(WORKER_RESTART_DELAY * 2 ** (restarts - 1), MAX_WORKER_RESTART_DELAY)
+        log.warning("worker %i exited (%s), restarting it in %i seconds", worker, reason.getErrorMessage(), delay)
+        self._restart_calls[worker] = reactor.callLater(delay, self._restart_worker, worker)
+
+    def _restart_worker(self, worker):
+        del self._restart_calls[worker]
+        self._spawn_worker(worker)
+
+    def stop(self):
+        self._stopping = True
+        for restart_call in self._restart_calls.itervalues():
+            restart_call.cancel()
+        self._restart_calls.clear()
+        for process in self._workers.itervalues():
+            if process.transport is not None and process.transport.pid is not None:
+                process.transport.signalProcess('TERM')
+        return self.port.stopListening()
+
+    def _reported_nodes(self):
+        nodes = {}
+        for process in self._workers.itervalues():
+            if process.stats:
+                nodes.update(process.stats['nodes'])
+        return nodes
+
+    def jsonrpc_get_node_ids(self):
+        return defer.succeed([node_id.encode('hex') for node_id in itertools.islice(node_id_supplier(),
+                                                                                    self._node_count)])
+
+    def jsonrpc_node_status(self, include_stats=False):
+        nodes = self._reported_nodes()
+        if not include_stats:
+            return defer.succeed({node_id: stats['running'] for node_id, stats in nodes.iteritems()})
+        return defer.succeed(nodes)
+
+    def jsonrpc_worker_status(self):
         return defer.succeed({
-            node.node_id.encode('hex'): node._join_deferred is not None and node._join_deferred.called
-            for node in self._nodes
+            worker: None if not process.stats else {
+                "pid": process.stats['pid'],
+                "rpc_port": process.stats['rpc_port'],
+                "nodes": len(process.stats['nodes']),
+                "running": sum(stats['running'] for stats in process.stats['nodes'].itervalues())
+            } for worker, process in self._workers.iteritems()
         })
 
 
@@ -219,8 +391,18 @@ def main():
     parser.add_argument('--rpc_port', default=5280)
     parser.add_argument('--starting_port', default=4455)
     parser.add_argument('--nodes', default=32)
+    parser.add_argument('--workers', default=1, help="number of processes to run the nodes in")
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--external_ip', default=None, help="defaults to the address reported by api.lbry.io")
     args = parser.parse_args()
-    MultiSeedRPCServer(int(args.starting_port), int(args.nodes), int(args.rpc_port))
+    if args.worker is not None:
+        MultiSeedRPCServer(int(args.starting_port), int(args.nodes), int(args.rpc_port), args.external_ip,
+                           int(args.worker), int(args.workers), stats_fd=3)
+    elif int(args.workers) > 1:
+        SeedSupervisorRPCServer(int(args.starting_port), int(args.nodes), int(args.rpc_port), int(args.workers),
+                                args.external_ip)
+    else:
+        MultiSeedRPCServer(int(args.starting_port), int(args.nodes), int(args.rpc_port), args.external_ip)
     reactor.run()
 
 
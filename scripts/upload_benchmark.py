@@ -0,0 +1,129 @@
+"""
+Measures how fast ServerRequestHandler uploads blobs over a loopback TCP connection, comparing it with the string
+buffer and per chunk reactor.callLater(0) it used before
+
+The client reading the data runs in the same process, so the cpu time includes receiving the data as well as
+sending it.
+"""
+
+import time
+import StringIO
+import argparse
+from twisted.internet import reactor, defer, protocol
+from twisted.protocols.basic import FileSender
+from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
+
+
+class OldServerRequestHandler(ServerRequestHandler):
+    def __init__(self, consumer):
+        ServerRequestHandler.__init__(self, consumer)
+        self.response_buff = ''
+
+    def resumeProducing(self):
+        self.production_paused = False
+        self._produce_more()
+        if self.producer is not None:
+            reactor.callLater(0, self.producer.resumeProducing)
+
+    def _produce_more(self):
+        if self.production_paused:
+            return
+        chunk = self.response_buff[:self.CHUNK_SIZE]
+        self.response_buff = self.response_buff[self.CHUNK_SIZE:]
+        if chunk == '':
+            return
+        self.consumer.write(chunk)
+        reactor.callLater(0, self._produce_more)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        producer.resumeProducing()
+
+    def write(self, data):
+        self.response_buff = self.response_buff + data
+        self._produce_more()
+
+        def get_more_data():
+            if self.producer is not None:
+                self.producer.resumeProducing()
+
+        reactor.callLater(0, get_more_data)
+
+    def send_response(self, msg):
+        self.response_buff = self.response_buff + msg
+        self._produce_more()
+
+
+class UploadProtocol(protocol.Protocol):
+    # the consumer side of ServerProtocol, sending a blob as soon as the connection is made
+    def connectionMade(self):
+        self.request_handler = self.factory.handler_class(self)
+        self.request_handler.send_response('{"incoming_blob": {"length": %i}}' % len(self.factory.blob))
+        d = FileSender().beginFileTransfer(StringIO.StringIO(self.factory.blob), self.request_handler)
+        d.addCallback(lambda _: self.transport.loseConnection())
+
+    def registerProducer(self, producer, streaming):
+        if self.factory.handler_class is ServerRequestHandler:
+            self.transport.registerProducer(producer, True)
+
+    def unregisterProducer(self):
+        self.transport.unregisterProducer()
+
+    def write(self, data):
+        self.transport.write(data)
+
+
+class DownloadProtocol(protocol.Protocol):
+    def connectionMade(self):
+        self.received = 0
+
+    def dataReceived(self, data):
+        self.received += len(data)
+
+    def connectionLost(self, reason=None):
+        self.factory.finished.callback(self.received)
+
+
+@defer.inlineCallbacks
+def upload(handler_class, blob, count):
+    server_factory = protocol.ServerFactory()
+    server_factory.protocol = UploadProtocol
+    server_factory.handler_class = handler_class
+    server_factory.blob = blob
+    port = reactor.listenTCP(0, server_factory, interface='127.0.0.1')
+    received = 0
+    started_cpu, started_wall = time.clock(), time.time()
+    for _ in range(count):
+        client_factory = protocol.ClientFactory()
+        client_factory.protocol = DownloadProtocol
+        client_factory.finished = defer.Deferred()
+        reactor.connectTCP('127.0.0.1', port.getHost().port, client_factory)
+        received += yield client_factory.finished
+    cpu, wall = time.clock() - started_cpu, time.time() - started_wall
+    yield port.stopListening()
+    defer.returnValue((received / 2.0 ** 20, cpu, wall))
+
+
+@defer.inlineCallbacks
+def run(args):
+    blob = ''.join(chr(i % 256) for i in range(args.blob_size))
+    print "%-12s %10s %10s %10s %12s" % ("handler", "MiB", "cpu s", "wall s", "MiB/cpu s")
+    try:
+        for name, handler_class in (("old", OldServerRequestHandler), ("deque", ServerRequestHandler)):
+            mib, cpu, wall = yield upload(handler_class, blob, args.blobs)
+            print "%-12s %10.1f %10.2f %10.2f %12.1f" % (name, mib, cpu, wall, mib / cpu)
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blob_size', type=int, default=2 ** 21 - 1)
+    parser.add_argument('--blobs', type=int, default=50)
+    args = parser.parse_args()
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()